@@ -14,7 +14,9 @@ Script to integrate CARLA and SUMO simulations
 # ==================================================================================================
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import random
 import time
 
 # ==================================================================================================
@@ -49,6 +51,7 @@ else:
 from sumo_integration.bridge_helper import BridgeHelper  # pylint: disable=wrong-import-position
 from sumo_integration.carla_simulation import CarlaSimulation  # pylint: disable=wrong-import-position
 from sumo_integration.constants import INVALID_ACTOR_ID  # pylint: disable=wrong-import-position
+from sumo_integration.pacing import Pacer, StepStatistics  # pylint: disable=wrong-import-position
 from sumo_integration.sumo_simulation import SumoSimulation  # pylint: disable=wrong-import-position
 
 # ==================================================================================================
@@ -66,11 +69,20 @@ class SimulationSynchronization(object):
                  carla_simulation,
                  tls_manager='none',
                  sync_vehicle_color=False,
-                 sync_vehicle_lights=False):
+                 sync_vehicle_lights=False,
+                 seed=None,
+                 pipelined=False):
 
         self.sumo = sumo_simulation
         self.carla = carla_simulation
 
+        # In pipelined mode, carla ticks in a worker thread while sumo computes its next step.
+        self.pipelined = pipelined
+        self._executor = ThreadPoolExecutor(max_workers=1) if pipelined else None
+
+        # Duration of the phases of the last tick, in seconds.
+        self.timings = {}  # {phase: seconds}
+
         self.tls_manager = tls_manager
         self.sync_vehicle_color = sync_vehicle_color
         self.sync_vehicle_lights = sync_vehicle_lights
@@ -80,12 +92,24 @@ class SimulationSynchronization(object):
         elif tls_manager == 'sumo':
             self.carla.switch_off_traffic_lights()
 
+        # Landmarks with a traffic light in both simulations, and the last state sent to each one.
+        self._common_landmarks = self.sumo.traffic_light_ids & self.carla.traffic_light_ids
+        self._traffic_light_states = {}  # {landmark_id: state}
+
         # Mapped actor ids.
         self.sumo2carla_ids = {}  # Contains only actors controlled by sumo.
         self.carla2sumo_ids = {}  # Contains only actors controlled by carla.
 
+        # Values of the mapped ids, kept up to date with the maps above.
+        self._sumo_driven_carla_ids = set()  # set(self.sumo2carla_ids.values())
+        self._carla_driven_sumo_ids = set()  # set(self.carla2sumo_ids.values())
+
+        # Time spent spawning the sumo actors departed in the last step, in seconds.
+        self.spawn_latency = 0.0
+
         BridgeHelper.blueprint_library = self.carla.world.get_blueprint_library()
         BridgeHelper.offset = self.sumo.get_net_offset()
+        BridgeHelper.random_generator = random.Random(seed)
 
         # Configuring carla simulation in sync mode.
         settings = self.carla.world.get_settings()
@@ -100,13 +124,58 @@ class SimulationSynchronization(object):
         """
         Tick to simulation synchronization
         """
+        if self.pipelined:
+            self._tick_pipelined()
+            return
+
         # -----------------
         # sumo-->carla sync
         # -----------------
-        self.sumo.tick()
+        self._timed('sumo_step', self.sumo.tick)
+        self._timed('carla_push', self._synchronize_sumo_to_carla)
 
-        # Spawning new sumo actors in carla (i.e, not controlled by carla).
-        sumo_spawned_actors = self.sumo.spawned_actors - set(self.carla2sumo_ids.values())
+        # -----------------
+        # carla-->sumo sync
+        # -----------------
+        self._timed('carla_tick', self.carla.tick)
+        self._timed('sumo_push', self._synchronize_carla_to_sumo)
+
+    def _tick_pipelined(self):
+        """
+        Tick to simulation synchronization, overlapping the sumo and carla steps.
+
+        Carla computes the frame of the updates pushed in the previous tick while sumo computes its
+        next step. The state of the carla actors is pushed to sumo once sumo has already stepped, so
+        sumo receives it with a lag of one step. Both simulators always apply the same operations
+        in the same order, so the co-simulation stays deterministic.
+        """
+        carla_tick = self._executor.submit(self._timed, 'carla_tick', self.carla.tick)
+        try:
+            self._timed('sumo_step', self.sumo.tick)
+        finally:
+            carla_tick.result()
+
+        self._timed('sumo_push', self._synchronize_carla_to_sumo)
+        self._timed('carla_push', self._synchronize_sumo_to_carla)
+
+    def _timed(self, phase, function):
+        """
+        Calls the given function, storing its duration in the timings of the phase.
+        """
+        start = time.perf_counter()
+        try:
+            return function()
+        finally:
+            self.timings[phase] = time.perf_counter() - start
+
+    def _synchronize_sumo_to_carla(self):
+        """
+        Updates carla with the current state of the sumo simulation.
+        """
+        # Spawning new sumo actors in carla (i.e, not controlled by carla). All the actors departed
+        # in this step are spawned with a single batch.
+        sumo_spawned_actors = self.sumo.spawned_actors - self._carla_driven_sumo_ids
+        spawned_sumo_ids, carla_spawn_requests = [], []
         for sumo_actor_id in sumo_spawned_actors:
             self.sumo.subscribe(sumo_actor_id)
             sumo_actor = self.sumo.get_actor(sumo_actor_id)
@@ -116,50 +185,72 @@ class SimulationSynchronization(object):
                 carla_transform = BridgeHelper.get_carla_transform(sumo_actor.transform,
                                                                    sumo_actor.extent)
 
-                carla_actor_id = self.carla.spawn_actor(carla_blueprint, carla_transform)
-                if carla_actor_id != INVALID_ACTOR_ID:
-                    self.sumo2carla_ids[sumo_actor_id] = carla_actor_id
+                spawned_sumo_ids.append(sumo_actor_id)
+                carla_spawn_requests.append((carla_blueprint, carla_transform))
             else:
                 self.sumo.unsubscribe(sumo_actor_id)
 
-        # Destroying sumo arrived actors in carla.
-        for sumo_actor_id in self.sumo.destroyed_actors:
-            if sumo_actor_id in self.sumo2carla_ids:
-                self.carla.destroy_actor(self.sumo2carla_ids.pop(sumo_actor_id))
+        self.spawn_latency = 0.0
+        if carla_spawn_requests:
+            start = time.perf_counter()
+            carla_actor_ids = self.carla.spawn_actors(carla_spawn_requests)
+            self.spawn_latency = time.perf_counter() - start
+            logging.debug('Spawned %d sumo actors in carla in %.2f ms', len(carla_actor_ids),
+                          self.spawn_latency * 1000.0)
+
+            for sumo_actor_id, carla_actor_id in zip(spawned_sumo_ids, carla_actor_ids):
+                if carla_actor_id != INVALID_ACTOR_ID:
+                    self.sumo2carla_ids[sumo_actor_id] = carla_actor_id
+                    self._sumo_driven_carla_ids.add(carla_actor_id)
 
-        # Updating sumo actors in carla.
-        for sumo_actor_id in self.sumo2carla_ids:
+        # Destroying sumo arrived actors in carla.
+        carla_destroyed_ids = [
+            self.sumo2carla_ids.pop(sumo_actor_id)
+            for sumo_actor_id in self.sumo.destroyed_actors
+            if sumo_actor_id in self.sumo2carla_ids
+        ]
+        self._sumo_driven_carla_ids.difference_update(carla_destroyed_ids)
+        self.carla.destroy_actors(carla_destroyed_ids)
+
+        # Updating sumo actors in carla. The states of all the actors are decoded and transformed
+        # at once, and the updates are sent in a single batch.
+        sumo_states = self.sumo.get_actor_states(list(self.sumo2carla_ids))
+        carla_transforms = BridgeHelper.to_carla_transforms(*BridgeHelper.get_carla_transforms(
+            sumo_states.locations, sumo_states.rotations, sumo_states.extents))
+
+        carla_updates = []
+        for sumo_actor_id, carla_transform, sumo_signals in zip(sumo_states.ids, carla_transforms,
+                                                                sumo_states.signals.tolist()):
             carla_actor_id = self.sumo2carla_ids[sumo_actor_id]
 
-            sumo_actor = self.sumo.get_actor(sumo_actor_id)
             carla_actor = self.carla.get_actor(carla_actor_id)
+            if carla_actor is None:
+                continue
 
-            carla_transform = BridgeHelper.get_carla_transform(sumo_actor.transform,
-                                                               sumo_actor.extent)
+            # The light state is only sent when it changes.
+            carla_lights = None
             if self.sync_vehicle_lights:
-                carla_lights = BridgeHelper.get_carla_lights_state(carla_actor.get_light_state(),
-                                                                   sumo_actor.signals)
-            else:
-                carla_lights = None
+                current_lights = carla_actor.get_light_state()
+                carla_lights = BridgeHelper.get_carla_lights_state(current_lights, sumo_signals)
+                if carla_lights == current_lights:
+                    carla_lights = None
 
-            self.carla.synchronize_vehicle(carla_actor_id, carla_transform, carla_lights)
+            carla_updates.append((carla_actor_id, carla_transform, carla_lights))
+
+        self.carla.synchronize_vehicles(carla_updates)
 
         # Updates traffic lights in carla based on sumo information.
         if self.tls_manager == 'sumo':
-            common_landmarks = self.sumo.traffic_light_ids & self.carla.traffic_light_ids
-            for landmark_id in common_landmarks:
-                sumo_tl_state = self.sumo.get_traffic_light_state(landmark_id)
-                carla_tl_state = BridgeHelper.get_carla_traffic_light_state(sumo_tl_state)
-
-                self.carla.synchronize_traffic_light(landmark_id, carla_tl_state)
-
-        # -----------------
-        # carla-->sumo sync
-        # -----------------
-        self.carla.tick()
+            self.carla.synchronize_traffic_lights(self._get_changed_traffic_lights(
+                lambda landmark_id: BridgeHelper.get_carla_traffic_light_state(
+                    self.sumo.get_traffic_light_state(landmark_id))))
 
+    def _synchronize_carla_to_sumo(self):
+        """
+        Updates sumo with the current state of the carla simulation.
+        """
         # Spawning new carla actors (not controlled by sumo)
-        carla_spawned_actors = self.carla.spawned_actors - set(self.sumo2carla_ids.values())
+        carla_spawned_actors = self.carla.spawned_actors - self._sumo_driven_carla_ids
         for carla_actor_id in carla_spawned_actors:
             carla_actor = self.carla.get_actor(carla_actor_id)
 
@@ -169,12 +260,15 @@ class SimulationSynchronization(object):
                 sumo_actor_id = self.sumo.spawn_actor(type_id, color)
                 if sumo_actor_id != INVALID_ACTOR_ID:
                     self.carla2sumo_ids[carla_actor_id] = sumo_actor_id
+                    self._carla_driven_sumo_ids.add(sumo_actor_id)
                     self.sumo.subscribe(sumo_actor_id)
 
         # Destroying required carla actors in sumo.
         for carla_actor_id in self.carla.destroyed_actors:
             if carla_actor_id in self.carla2sumo_ids:
-                self.sumo.destroy_actor(self.carla2sumo_ids.pop(carla_actor_id))
+                sumo_actor_id = self.carla2sumo_ids.pop(carla_actor_id)
+                self._carla_driven_sumo_ids.discard(sumo_actor_id)
+                self.sumo.destroy_actor(sumo_actor_id)
 
         # Updating carla actors in sumo.
         for carla_actor_id in self.carla2sumo_ids:
@@ -199,13 +293,25 @@ class SimulationSynchronization(object):
 
         # Updates traffic lights in sumo based on carla information.
         if self.tls_manager == 'carla':
-            common_landmarks = self.sumo.traffic_light_ids & self.carla.traffic_light_ids
-            for landmark_id in common_landmarks:
-                carla_tl_state = self.carla.get_traffic_light_state(landmark_id)
-                sumo_tl_state = BridgeHelper.get_sumo_traffic_light_state(carla_tl_state)
+            self.sumo.synchronize_traffic_lights(self._get_changed_traffic_lights(
+                lambda landmark_id: BridgeHelper.get_sumo_traffic_light_state(
+                    self.carla.get_traffic_light_state(landmark_id))))
 
-                # Updates all the sumo links related to this landmark.
-                self.sumo.synchronize_traffic_light(landmark_id, sumo_tl_state)
+    def _get_changed_traffic_lights(self, get_state):
+        """
+        Returns the common landmarks whose state changed since the last call.
+
+            :param get_state: function returning the state to be sent for a landmark.
+            :return: dict {landmark_id: state} with the changed landmarks.
+        """
+        changed = {}
+        for landmark_id in self._common_landmarks:
+            state = get_state(landmark_id)
+            if self._traffic_light_states.get(landmark_id) != state:
+                changed[landmark_id] = state
+
+        self._traffic_light_states.update(changed)
+        return changed
 
     def close(self):
         """
@@ -218,8 +324,7 @@ class SimulationSynchronization(object):
         self.carla.world.apply_settings(settings)
 
         # Destroying synchronized actors.
-        for carla_actor_id in self.sumo2carla_ids.values():
-            self.carla.destroy_actor(carla_actor_id)
+        self.carla.destroy_actors(list(self.sumo2carla_ids.values()))
 
         for sumo_actor_id in self.carla2sumo_ids.values():
             self.sumo.destroy_actor(sumo_actor_id)
@@ -228,6 +333,9 @@ class SimulationSynchronization(object):
         self.carla.close()
         self.sumo.close()
 
+        if self._executor is not None:
+            self._executor.shutdown()
+
 
 def synchronization_loop(args):
     """
@@ -238,17 +346,24 @@ def synchronization_loop(args):
     carla_simulation = CarlaSimulation(args.carla_host, args.carla_port, args.step_length)
 
     synchronization = SimulationSynchronization(sumo_simulation, carla_simulation, args.tls_manager,
-                                                args.sync_vehicle_color, args.sync_vehicle_lights)
+                                                args.sync_vehicle_color, args.sync_vehicle_lights,
+                                                args.seed, args.pipelined)
+    pacer = Pacer(args.step_length, args.as_fast_as_possible)
+    statistics = StepStatistics(args.step_length)
     try:
+        pacer.start()
+        last_report = time.monotonic()
         while True:
-            start = time.time()
+            start = time.perf_counter()
 
             synchronization.tick()
 
-            end = time.time()
-            elapsed = end - start
-            if elapsed < args.step_length:
-                time.sleep(args.step_length - elapsed)
+            step_seconds = time.perf_counter() - start
+            statistics.record(step_seconds, synchronization.timings, pacer.wait())
+
+            if args.report_interval > 0 and time.monotonic() - last_report >= args.report_interval:
+                logging.info(statistics.summary_line())
+                last_report = time.monotonic()
 
     except KeyboardInterrupt:
         logging.info('Cancelled by user.')
@@ -258,6 +373,11 @@ def synchronization_loop(args):
 
         synchronization.close()
 
+        if statistics.steps > 0:
+            logging.info('Step statistics:\n%s', statistics.summary())
+        if args.stats_file is not None:
+            statistics.dump(args.stats_file)
+
 
 if __name__ == '__main__':
     argparser = argparse.ArgumentParser(description=__doc__)
@@ -304,6 +424,29 @@ if __name__ == '__main__':
                            choices=['none', 'sumo', 'carla'],
                            help="select traffic light manager (default: none)",
                            default='none')
+    argparser.add_argument('--seed',
+                           metavar='S',
+                           default=None,
+                           type=int,
+                           help='seed for the random choices of the co-simulation (default: None)')
+    argparser.add_argument('--pipelined',
+                           action='store_true',
+                           help='overlap the sumo and carla steps, the carla actors reach sumo '
+                           'with a lag of one step (default: False)')
+    argparser.add_argument('--as-fast-as-possible',
+                           action='store_true',
+                           help='run the steps without waiting for real time (default: False)')
+    argparser.add_argument('--report-interval',
+                           metavar='SECONDS',
+                           default=10.0,
+                           type=float,
+                           help='interval between step statistics summaries, 0 to disable '
+                           '(default: 10.0)')
+    argparser.add_argument('--stats-file',
+                           metavar='FILE',
+                           default=None,
+                           help='write the step statistics at exit, as csv if FILE ends with .csv '
+                           'and as json otherwise (default: None)')
     argparser.add_argument('--debug', action='store_true', help='enable debug messages')
     arguments = argparser.parse_args()
 
@@ -52,10 +52,10 @@ else:
 # ==================================================================================================
 
 import sumolib  # pylint: disable=wrong-import-position
-import traci  # pylint: disable=wrong-import-position
 
 from sumo_integration.carla_simulation import CarlaSimulation  # pylint: disable=wrong-import-position
 from sumo_integration.sumo_simulation import SumoSimulation  # pylint: disable=wrong-import-position
+from sumo_integration.sumo_simulation import traci  # pylint: disable=wrong-import-position
 
 from run_synchronization import SimulationSynchronization  # pylint: disable=wrong-import-position
 
@@ -18,9 +18,48 @@ import os
 import random
 
 import carla  # pylint: disable=import-error
-import traci  # pylint: disable=import-error
+import numpy as np
+
+from .sumo_simulation import SumoSignalState, SumoVehSignal, traci  # traci or libsumo backend
+
+# ==================================================================================================
+# -- helpers ---------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+def _as_carla_floats(values):
+    """
+    Returns the given values as a float64 array (N, 3), rounded to the single precision used by
+    carla to store locations and rotations.
+    """
+    return np.asarray(values, dtype=np.float32).reshape(-1, 3).astype(np.float64)
+
+
+class _BlueprintIndex(object):
+    """
+    Precomputed lookups of a blueprint library, so that resolving the blueprint of a vehicle does
+    not scan the whole library.
+    """
+    def __init__(self, library, vtypes):
+        self.library = library
+
+        self.ids = set()
+        self.vclass_ids = {}  # {vclass: [blueprint_id, ...]}, in library order.
+        self.colors = {}  # {blueprint_id: recommended colors}
+        self.driver_ids = {}  # {blueprint_id: recommended driver ids}
+
+        for blueprint in library:
+            self.ids.add(blueprint.id)
+            if blueprint.id in vtypes:
+                vclass = vtypes[blueprint.id]['vClass']
+                self.vclass_ids.setdefault(vclass, []).append(blueprint.id)
+            if blueprint.has_attribute('color'):
+                self.colors[blueprint.id] = list(
+                    blueprint.get_attribute('color').recommended_values)
+            if blueprint.has_attribute('driver_id'):
+                self.driver_ids[blueprint.id] = list(
+                    blueprint.get_attribute('driver_id').recommended_values)
 
-from .sumo_simulation import SumoSignalState, SumoVehSignal
 
 # ==================================================================================================
 # -- Bridge helper (SUMO <=> CARLA) ----------------------------------------------------------------
@@ -35,11 +74,18 @@ class BridgeHelper(object):
     blueprint_library = []
     offset = (0, 0)
 
+    # Random generator used to choose blueprints, colors and drivers. It can be replaced by a
+    # seeded random.Random to obtain reproducible co-simulations.
+    random_generator = random.Random()
+
     _vtypes_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "data",
                                 "vtypes.json")
     with open(_vtypes_path) as f:
         _VTYPES = json.load(f)['carla_blueprints']
 
+    # Index of blueprint_library, rebuilt the first time it is used after the library is set.
+    _blueprint_index = None
+
     @staticmethod
     def get_carla_transform(in_sumo_transform, extent):
         """
@@ -95,56 +141,142 @@ class BridgeHelper(object):
 
         return out_transform
 
+    @staticmethod
+    def get_carla_transforms(locations, rotations, extents):
+        """
+        Vectorized version of get_carla_transform, converting all the given sumo transforms at once.
+
+        Inputs are rounded to single precision as carla.Transform does, and the computations
+        follow the same order as the scalar method, so both give the same results.
+
+            :param locations: array (N, 3) with the sumo locations (x, y, z).
+            :param rotations: array (N, 3) with the sumo rotations (pitch, yaw, roll).
+            :param extents: array (N, 3) with the extents of the actors.
+            :return: tuple of float32 arrays (N, 3) with the carla locations and rotations.
+        """
+        offset = BridgeHelper.offset
+        in_location = _as_carla_floats(locations)
+        in_rotation = _as_carla_floats(rotations)
+        extent_x = _as_carla_floats(extents)[:, 0]
+
+        # From front-center-bumper to center (sumo reference system).
+        yaw = -1 * in_rotation[:, 1] + 90
+        pitch = in_rotation[:, 0]
+
+        # Applying offset sumo-carla net and transform to carla reference system.
+        out_location = np.empty_like(in_location)
+        out_location[:, 0] = (in_location[:, 0] - np.cos(np.radians(yaw)) * extent_x) - offset[0]
+        out_location[:, 1] = -((in_location[:, 1] - np.sin(np.radians(yaw)) * extent_x) - offset[1])
+        out_location[:, 2] = in_location[:, 2] - np.sin(np.radians(pitch)) * extent_x
+
+        out_rotation = in_rotation.copy()
+        out_rotation[:, 1] -= 90
+
+        return out_location.astype(np.float32), out_rotation.astype(np.float32)
+
+    @staticmethod
+    def get_sumo_transforms(locations, rotations, extents):
+        """
+        Vectorized version of get_sumo_transform, converting all the given carla transforms at once.
+
+            :param locations: array (N, 3) with the carla locations (x, y, z).
+            :param rotations: array (N, 3) with the carla rotations (pitch, yaw, roll).
+            :param extents: array (N, 3) with the extents of the actors.
+            :return: tuple of float32 arrays (N, 3) with the sumo locations and rotations.
+        """
+        offset = BridgeHelper.offset
+        in_location = _as_carla_floats(locations)
+        in_rotation = _as_carla_floats(rotations)
+        extent_x = _as_carla_floats(extents)[:, 0]
+
+        # From center to front-center-bumper (carla reference system).
+        yaw = -1 * in_rotation[:, 1]
+        pitch = in_rotation[:, 0]
+
+        # Applying offset carla-sumo net and transform to sumo reference system.
+        out_location = np.empty_like(in_location)
+        out_location[:, 0] = (in_location[:, 0] + np.cos(np.radians(yaw)) * extent_x) + offset[0]
+        out_location[:, 1] = -((in_location[:, 1] - np.sin(np.radians(yaw)) * extent_x) - offset[1])
+        out_location[:, 2] = in_location[:, 2] - np.sin(np.radians(pitch)) * extent_x
+
+        out_rotation = in_rotation.copy()
+        out_rotation[:, 1] += 90
+
+        return out_location.astype(np.float32), out_rotation.astype(np.float32)
+
+    @staticmethod
+    def to_carla_transforms(locations, rotations):
+        """
+        Builds the carla transforms of the arrays returned by get_carla_transforms, ready to be
+        used in batched commands (e.g., carla.command.ApplyTransform).
+        """
+        return [
+            carla.Transform(carla.Location(x, y, z), carla.Rotation(pitch, yaw, roll))
+            for (x, y, z), (pitch, yaw, roll) in zip(locations.tolist(), rotations.tolist())
+        ]
+
+    @staticmethod
+    def _get_blueprint_index():
+        """
+        Returns the index of the current blueprint library, building it if the library changed.
+        """
+        if BridgeHelper._blueprint_index is None or \
+           BridgeHelper._blueprint_index.library is not BridgeHelper.blueprint_library:
+            BridgeHelper._blueprint_index = _BlueprintIndex(BridgeHelper.blueprint_library,
+                                                            BridgeHelper._VTYPES)
+        return BridgeHelper._blueprint_index
+
     @staticmethod
     def _get_recommended_carla_blueprint(sumo_actor):
         """
-        Returns an appropriate blueprint based on the given sumo actor.
+        Returns the id of an appropriate blueprint based on the given sumo actor.
         """
         vclass = sumo_actor.vclass.value
 
-        blueprints = []
-        for blueprint in BridgeHelper.blueprint_library:
-            if blueprint.id in BridgeHelper._VTYPES and \
-               BridgeHelper._VTYPES[blueprint.id]['vClass'] == vclass:
-                blueprints.append(blueprint)
-
-        if not blueprints:
+        blueprint_ids = BridgeHelper._get_blueprint_index().vclass_ids.get(vclass)
+        if not blueprint_ids:
             return None
 
-        return random.choice(blueprints)
+        return BridgeHelper.random_generator.choice(blueprint_ids)
 
     @staticmethod
     def get_carla_blueprint(sumo_actor, sync_color=False):
         """
         Returns an appropriate blueprint based on the received sumo actor.
         """
-        blueprint_library = BridgeHelper.blueprint_library
+        index = BridgeHelper._get_blueprint_index()
         type_id = sumo_actor.type_id
 
-        if type_id in [bp.id for bp in blueprint_library]:
-            blueprint = blueprint_library.filter(type_id)[0]
+        if type_id in index.ids:
+            blueprint_id = type_id
             logging.debug('[BridgeHelper] sumo vtype %s found in carla blueprints', type_id)
         else:
-            blueprint = BridgeHelper._get_recommended_carla_blueprint(sumo_actor)
-            if blueprint is not None:
+            blueprint_id = BridgeHelper._get_recommended_carla_blueprint(sumo_actor)
+            if blueprint_id is not None:
                 logging.warning(
                     'sumo vtype %s not found in carla. The following blueprint will be used: %s',
-                    type_id, blueprint.id)
+                    type_id, blueprint_id)
             else:
                 logging.error('sumo vtype %s not supported. No vehicle will be spawned in carla',
                               type_id)
                 return None
 
-        if blueprint.has_attribute('color'):
+        # The library returns a copy of the blueprint, so the attributes set below do not leak into
+        # other vehicles spawned in the same batch.
+        blueprint = BridgeHelper.blueprint_library.find(blueprint_id)
+
+        colors = index.colors.get(blueprint_id)
+        if colors is not None:
             if sync_color:
                 color = "{},{},{}".format(sumo_actor.color[0], sumo_actor.color[1],
                                           sumo_actor.color[2])
             else:
-                color = random.choice(blueprint.get_attribute('color').recommended_values)
+                color = BridgeHelper.random_generator.choice(colors)
             blueprint.set_attribute('color', color)
 
-        if blueprint.has_attribute('driver_id'):
-            driver_id = random.choice(blueprint.get_attribute('driver_id').recommended_values)
+        driver_ids = index.driver_ids.get(blueprint_id)
+        if driver_ids is not None:
+            driver_id = BridgeHelper.random_generator.choice(driver_ids)
             blueprint.set_attribute('driver_id', driver_id)
 
         blueprint.set_attribute('role_name', 'sumo_driver')
@@ -152,8 +284,8 @@ class BridgeHelper(object):
         logging.debug(
             '''[BridgeHelper] sumo vtype %s will be spawned in carla with the following attributes:
             \tblueprint: %s
-            \tcolor: %s''', type_id, blueprint.id,
-            sumo_actor.color if blueprint.has_attribute('color') else (-1, -1, -1))
+            \tcolor: %s''', type_id, blueprint_id,
+            sumo_actor.color if colors is not None else (-1, -1, -1))
 
         return blueprint
 
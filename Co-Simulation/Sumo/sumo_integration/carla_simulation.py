@@ -39,6 +39,13 @@ class CarlaSimulation(object):
         self.spawned_actors = set()
         self.destroyed_actors = set()
 
+        # Ids of the actors in the world that are not vehicles, so that their type is only looked
+        # up once.
+        self._ignored_actors = set()
+
+        # Actor handles, resolved once and reused until the actor is destroyed.
+        self._actors = {}  # {actor_id: carla.Actor}
+
         # Set traffic lights.
         self._tls = {}  # {landmark_id: traffic_ligth_actor}
 
@@ -54,8 +61,15 @@ class CarlaSimulation(object):
     def get_actor(self, actor_id):
         """
         Accessor for carla actor.
+
+        The handle is cached after the first lookup. If the actor does not exist, returns None.
         """
-        return self.world.get_actor(actor_id)
+        actor = self._actors.get(actor_id)
+        if actor is None:
+            actor = self.world.get_actor(actor_id)
+            if actor is not None:
+                self._actors[actor_id] = actor
+        return actor
 
     # This is a workaround to fix synchronization issues when other carla clients remove an actor in
     # carla without waiting for tick (e.g., running sumo co-simulation and manual control at the
@@ -105,29 +119,63 @@ class CarlaSimulation(object):
             :param transform: transform where the actor will be spawned.
             :return: actor id if the actor is successfully spawned. Otherwise, INVALID_ACTOR_ID.
         """
-        transform = carla.Transform(transform.location + carla.Location(0, 0, SPAWN_OFFSET_Z),
-                                    transform.rotation)
+        return self.spawn_actors([(blueprint, transform)])[0]
 
-        batch = [
-            carla.command.SpawnActor(blueprint, transform).then(
-                carla.command.SetSimulatePhysics(carla.command.FutureActor, False))
-        ]
-        response = self.client.apply_batch_sync(batch, False)[0]
-        if response.error:
-            logging.error('Spawn carla actor failed. %s', response.error)
-            return INVALID_ACTOR_ID
+    def spawn_actors(self, requests):
+        """
+        Spawns several actors with a single batch of commands.
 
-        return response.actor_id
+            :param requests: list of (blueprint, transform) of the actors to be spawned.
+            :return: list with the id of each spawned actor, in the same order as the requests.
+                INVALID_ACTOR_ID for the actors that could not be spawned.
+        """
+        if not requests:
+            return []
+
+        batch = []
+        for blueprint, transform in requests:
+            transform = carla.Transform(transform.location + carla.Location(0, 0, SPAWN_OFFSET_Z),
+                                        transform.rotation)
+            batch.append(
+                carla.command.SpawnActor(blueprint, transform).then(
+                    carla.command.SetSimulatePhysics(carla.command.FutureActor, False)))
+
+        actor_ids = []
+        for response in self.client.apply_batch_sync(batch, False):
+            if response.error:
+                logging.error('Spawn carla actor failed. %s', response.error)
+                actor_ids.append(INVALID_ACTOR_ID)
+            else:
+                actor_ids.append(response.actor_id)
+        return actor_ids
 
     def destroy_actor(self, actor_id):
         """
         Destroys the given actor.
         """
-        actor = self.world.get_actor(actor_id)
+        actor = self.get_actor(actor_id)
+        self._actors.pop(actor_id, None)
         if actor is not None:
             return actor.destroy()
         return False
 
+    def destroy_actors(self, actor_ids):
+        """
+        Destroys several actors with a single batch of commands.
+
+            :param actor_ids: ids of the actors to be destroyed.
+            :return: list of booleans, True for the actors successfully destroyed.
+        """
+        if not actor_ids:
+            return []
+
+        batch = []
+        for actor_id in actor_ids:
+            self._actors.pop(actor_id, None)
+            batch.append(carla.command.DestroyActor(actor_id))
+
+        return [not response.error for response in self.client.apply_batch_sync(batch, False)]
+
     def synchronize_vehicle(self, vehicle_id, transform, lights=None):
         """
         Updates vehicle state.
@@ -137,7 +185,7 @@ class CarlaSimulation(object):
             :param lights: new vehicle light state.
             :return: True if successfully updated. Otherwise, False.
         """
-        vehicle = self.world.get_actor(vehicle_id)
+        vehicle = self.get_actor(vehicle_id)
         if vehicle is None:
             return False
 
@@ -146,6 +194,30 @@ class CarlaSimulation(object):
             vehicle.set_light_state(carla.VehicleLightState(lights))
         return True
 
+    def synchronize_vehicles(self, updates):
+        """
+        Updates the state of several vehicles with a single batch of commands.
+
+            :param updates: list of (vehicle_id, transform, lights), with lights set to None to
+                leave the vehicle lights untouched. The caller already knows the current light
+                state of the vehicles, so it is expected to only pass the lights that change.
+            :return: number of commands sent.
+        """
+        batch = []
+        for vehicle_id, transform, lights in updates:
+            vehicle = self.get_actor(vehicle_id)
+            if vehicle is None:
+                continue
+
+            batch.append(carla.command.ApplyTransform(vehicle_id, transform))
+            if lights is not None:
+                batch.append(
+                    carla.command.SetVehicleLightState(vehicle_id, carla.VehicleLightState(lights)))
+
+        if batch:
+            self.client.apply_batch(batch)
+        return len(batch)
+
     def synchronize_traffic_light(self, landmark_id, state):
         """
         Updates traffic light state.
@@ -162,18 +234,43 @@ class CarlaSimulation(object):
         traffic_light.set_state(state)
         return True
 
+    def synchronize_traffic_lights(self, states):
+        """
+        Updates the state of several traffic lights.
+
+            :param states: new state of each landmark, {landmark_id: state}.
+        """
+        for landmark_id, state in states.items():
+            self.synchronize_traffic_light(landmark_id, state)
+
     def tick(self):
         """
         Tick to carla simulation.
         """
         self.world.tick()
 
-        # Update data structures for the current frame.
-        current_actors = set(
-            [vehicle.id for vehicle in self.world.get_actors().filter('vehicle.*')])
-        self.spawned_actors = current_actors.difference(self._active_actors)
-        self.destroyed_actors = self._active_actors.difference(current_actors)
-        self._active_actors = current_actors
+        # Update data structures for the current frame. The actors of the world are read from the
+        # snapshot of the frame, and only the actors that were not known are looked up.
+        snapshot = self.world.get_snapshot()
+        current_actors = set(actor_snapshot.id for actor_snapshot in snapshot)
+
+        self.spawned_actors = set()
+        new_actors = current_actors - self._active_actors - self._ignored_actors
+        if new_actors:
+            for actor in self.world.get_actors(list(new_actors)):
+                if actor.type_id.startswith('vehicle.'):
+                    self.spawned_actors.add(actor.id)
+                    self._actors[actor.id] = actor
+                else:
+                    self._ignored_actors.add(actor.id)
+
+        self.destroyed_actors = self._active_actors - current_actors
+        self._active_actors -= self.destroyed_actors
+        self._active_actors |= self.spawned_actors
+        self._ignored_actors &= current_actors
+
+        for actor_id in self.destroyed_actors:
+            self._actors.pop(actor_id, None)
 
     def close(self):
         """
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+""" This module provides the real-time pacing and the step statistics of the co-simulation. """
+
+# ==================================================================================================
+# -- imports ---------------------------------------------------------------------------------------
+# ==================================================================================================
+
+import csv
+import json
+import math
+import time
+
+# ==================================================================================================
+# -- pacer -----------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+class Pacer(object):
+    """
+    Pacer keeps the co-simulation in real time. Steps are scheduled on a fixed grid of the monotonic
+    clock, so the time spent out of the loop does not accumulate as drift. After an overrun, the
+    grid restarts at the end of the late step instead of running the following steps back to back.
+    """
+    def __init__(self, step_length, as_fast_as_possible=False):
+        self.step_length = step_length
+        self.as_fast_as_possible = as_fast_as_possible
+        self._deadline = None
+
+    def start(self):
+        """
+        Starts the schedule, the first step ends one step length from now.
+        """
+        self._deadline = time.monotonic() + self.step_length
+
+    def wait(self):
+        """
+        Waits for the end of the current step, unless running as fast as possible.
+
+            :return: the time by which the step exceeded the step length, in seconds, or 0.0.
+        """
+        if self._deadline is None:
+            self.start()
+
+        now = time.monotonic()
+        lag = now - self._deadline
+        if lag > 0.0:
+            self._deadline = now + self.step_length
+            return lag
+
+        if self.as_fast_as_possible:
+            self._deadline = now + self.step_length
+        else:
+            time.sleep(-lag)
+            self._deadline += self.step_length
+        return 0.0
+
+# ==================================================================================================
+# -- statistics ------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of durations with logarithmic buckets, bucket i holding durations up to 2^i
+    microseconds.
+    """
+    NUM_BUCKETS = 32
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * self.NUM_BUCKETS
+
+    def add(self, seconds):
+        """
+        Adds a duration, in seconds.
+        """
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        _, exponent = math.frexp(seconds * 1e6)
+        self.buckets[min(max(exponent, 0), self.NUM_BUCKETS - 1)] += 1
+
+    def mean(self):
+        """
+        Mean duration, in seconds.
+        """
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        """
+        Upper bound of the bucket holding the given percentile, in seconds.
+        """
+        threshold = percent / 100.0 * self.count
+        accumulated = 0
+        for i, count in enumerate(self.buckets):
+            accumulated += count
+            if count and accumulated >= threshold:
+                return min(2.0**i * 1e-6, self.max)
+        return self.max
+
+
+class StepStatistics(object):
+    """
+    StepStatistics accumulates the duration of the steps of the co-simulation and of their phases,
+    and the overruns of the step length.
+    """
+    COLUMNS = ('phase', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+
+    def __init__(self, step_length):
+        self.step_length = step_length
+
+        self.steps = 0
+        self.overruns = 0
+        self.max_lag = 0.0
+        self.histograms = {'step': LatencyHistogram()}  # {phase: LatencyHistogram}
+
+    def record(self, step_seconds, timings, lag=0.0):
+        """
+        Records a step.
+
+            :param step_seconds: duration of the step.
+            :param timings: duration of each phase of the step, {phase: seconds}.
+            :param lag: time by which the step exceeded the step length (see Pacer.wait).
+        """
+        self.steps += 1
+        if lag > 0.0:
+            self.overruns += 1
+            self.max_lag = max(self.max_lag, lag)
+
+        self.histograms['step'].add(step_seconds)
+        for phase, seconds in timings.items():
+            if phase not in self.histograms:
+                self.histograms[phase] = LatencyHistogram()
+            self.histograms[phase].add(seconds)
+
+    def rows(self):
+        """
+        Returns a row per phase with the values of COLUMNS.
+        """
+        return [(phase, histogram.count, histogram.mean() * 1e3, histogram.percentile(50) * 1e3,
+                 histogram.percentile(95) * 1e3, histogram.percentile(99) * 1e3,
+                 histogram.max * 1e3) for phase, histogram in self.histograms.items()]
+
+    def summary_line(self):
+        """
+        Returns a one line summary of the steps.
+        """
+        step = self.histograms['step']
+        return 'steps: {}, overruns: {} ({:.1f}%), step mean: {:.2f} ms, p95: {:.2f} ms, ' \
+            'max: {:.2f} ms'.format(self.steps, self.overruns,
+                                    100.0 * self.overruns / self.steps if self.steps else 0.0,
+                                    step.mean() * 1e3, step.percentile(95) * 1e3, step.max * 1e3)
+
+    def summary(self):
+        """
+        Returns a table with the statistics of each phase.
+        """
+        lines = [self.summary_line()]
+        lines.append('{:<12} {:>8} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(*self.COLUMNS))
+        for row in self.rows():
+            lines.append('{:<12} {:>8} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}'.format(*row))
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        """
+        Returns the statistics as a dictionary.
+        """
+        return {
+            'step_length': self.step_length,
+            'steps': self.steps,
+            'overruns': self.overruns,
+            'max_lag_ms': self.max_lag * 1e3,
+            'phases': {row[0]: dict(zip(self.COLUMNS[1:], row[1:])) for row in self.rows()},
+            'buckets_us': {
+                phase: {2**i: count for i, count in enumerate(histogram.buckets) if count}
+                for phase, histogram in self.histograms.items()
+            },
+        }
+
+    def dump(self, filename):
+        """
+        Writes the statistics to a json file, or to a csv file with a row per phase if the
+        filename ends with '.csv'.
+        """
+        if filename.endswith('.csv'):
+            with open(filename, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(self.COLUMNS + ('overruns',))
+                for row in self.rows():
+                    writer.writerow(row + (self.overruns if row[0] == 'step' else '',))
+        else:
+            with open(filename, 'w') as f:
+                json.dump(self.to_dict(), f, indent=2)
@@ -17,8 +17,22 @@ import logging
 import os
 
 import carla  # pylint: disable=import-error
+import numpy as np
 import sumolib  # pylint: disable=import-error
-import traci  # pylint: disable=import-error
+
+# libsumo runs sumo in the same process with the same interface as traci, avoiding the socket
+# communication. As in the sumo tools, it is selected defining the LIBSUMO_AS_TRACI environment
+# variable. The rest of the co-simulation uses the backend through this module.
+if 'LIBSUMO_AS_TRACI' in os.environ:
+    try:
+        import libsumo as traci  # pylint: disable=import-error
+    except ImportError:
+        logging.warning('libsumo not found, falling back to traci')
+        import traci  # pylint: disable=import-error
+else:
+    import traci  # pylint: disable=import-error
+
+SUMO_BACKEND = traci.__name__.split('.')[0]
 
 from .constants import INVALID_ACTOR_ID
 
@@ -101,6 +115,35 @@ class SumoActorClass(enum.Enum):
 
 SumoActor = collections.namedtuple('SumoActor', 'type_id vclass transform signals extent color')
 
+# State of several sumo actors, as arrays: locations (N, 3), rotations (N, 3) as (slope, angle, 0),
+# extents (N, 3) and signals (N,).
+SumoActorStates = collections.namedtuple('SumoActorStates', 'ids locations rotations extents signals')
+
+
+def decode_subscription_results(results, actor_ids):
+    """
+    Decodes the subscription results of several actors into arrays.
+
+        :param results: subscription results of the vehicles, as returned by
+            traci.vehicle.getAllSubscriptionResults ({actor_id: {variable: value}}).
+        :param actor_ids: ids of the actors to decode. Actors without results are skipped.
+        :return: SumoActorStates of the decoded actors.
+    """
+    ids = [actor_id for actor_id in actor_ids if results.get(actor_id)]
+    rows = [results[actor_id] for actor_id in ids]
+
+    locations = np.array([row[traci.constants.VAR_POSITION3D] for row in rows],
+                         dtype=np.float64).reshape(-1, 3)
+    rotations = np.array([(row[traci.constants.VAR_SLOPE], row[traci.constants.VAR_ANGLE], 0.0)
+                          for row in rows], dtype=np.float64).reshape(-1, 3)
+    extents = np.array([(row[traci.constants.VAR_LENGTH], row[traci.constants.VAR_WIDTH],
+                         row[traci.constants.VAR_HEIGHT]) for row in rows],
+                       dtype=np.float64).reshape(-1, 3) / 2.0
+    signals = np.array([row[traci.constants.VAR_SIGNALS] for row in rows], dtype=np.int64)
+
+    return SumoActorStates(ids, locations, rotations, extents, signals)
+
+
 # ==================================================================================================
 # -- sumo traffic lights ---------------------------------------------------------------------------
 # ==================================================================================================
@@ -164,6 +207,9 @@ class SumoTLManager(object):
         self._current_program = {}  # {tlid: program_id}
         self._current_phase = {}  # {tlid: index_phase}
 
+        # Signals of each landmark with the current programs. Rebuilt when a program changes.
+        self._landmark_signals = None  # {landmark_id: set((tlid, link_index), ...)}
+
         for tlid in traci.trafficlight.getIDList():
             self.subscribe(tlid)
 
@@ -209,24 +255,31 @@ class SumoTLManager(object):
             signals.update(self._tls[tlid][program_id].get_all_signals())
         return signals
 
+    def _get_landmark_signals(self):
+        """
+        Returns the signals associated with each landmark with the current programs.
+        """
+        if self._landmark_signals is None:
+            self._landmark_signals = {}
+            for tlid, program_id in self._current_program.items():
+                tl = self._tls[tlid][program_id]
+                for landmark_id in tl.get_all_landmarks():
+                    self._landmark_signals.setdefault(landmark_id, set()).update(
+                        tl.get_associated_signals(landmark_id))
+        return self._landmark_signals
+
     def get_all_landmarks(self):
         """
         Returns all the landmarks associated with a traffic light in the simulation.
         """
-        landmarks = set()
-        for tlid, program_id in self._current_program.items():
-            landmarks.update(self._tls[tlid][program_id].get_all_landmarks())
-        return landmarks
+        return set(self._get_landmark_signals().keys())
 
     def get_all_associated_signals(self, landmark_id):
         """
         Returns all the signals associated with the given landmark.
             :returns list: [(tlid, link_index), (tlid, link_index), ...]
         """
-        signals = set()
-        for tlid, program_id in self._current_program.items():
-            signals.update(self._tls[tlid][program_id].get_associated_signals(landmark_id))
-        return signals
+        return set(self._get_landmark_signals().get(landmark_id, ()))
 
     def get_state(self, landmark_id):
         """
@@ -257,6 +310,25 @@ class SumoTLManager(object):
             traci.trafficlight.setLinkState(tlid, link_index, state)
         return True
 
+    def set_states(self, states):
+        """
+        Updates the state of the signals associated with several landmarks. The state of each
+        traffic light is read and written once, whatever the number of its signals that change.
+
+            :param states: new state of each landmark, {landmark_id: state}.
+        """
+        link_states = {}  # {tlid: {link_index: state}}
+        for landmark_id, state in states.items():
+            for tlid, link_index in self._get_landmark_signals().get(landmark_id, ()):
+                link_states.setdefault(tlid, {})[link_index] = state
+
+        for tlid, tl_link_states in link_states.items():
+            full_state = list(traci.trafficlight.getRedYellowGreenState(tlid))
+            for link_index, state in tl_link_states.items():
+                full_state[link_index] = state
+            traci.trafficlight.setRedYellowGreenState(tlid, ''.join(full_state))
+        return True
+
     def switch_off(self):
         """
         Switch off all traffic lights.
@@ -276,6 +348,8 @@ class SumoTLManager(object):
                 current_phase = results[traci.constants.TL_CURRENT_PHASE]
 
                 if current_program != 'online':
+                    if current_program != self._current_program[tl_id]:
+                        self._landmark_signals = None
                     self._current_program[tl_id] = current_program
                     self._current_phase[tl_id] = current_phase
 
@@ -301,7 +375,7 @@ def _get_sumo_net(cfg_file):
     net_file = os.path.join(os.path.dirname(cfg_file), tag.get('value'))
     logging.debug('Reading net file: %s', net_file)
 
-    sumo_net = traci.sumolib.net.readNet(net_file)
+    sumo_net = sumolib.net.readNet(net_file)
     return sumo_net
 
 class SumoSimulation(object):
@@ -314,8 +388,12 @@ class SumoSimulation(object):
         else:
             sumo_binary = sumolib.checkBinary('sumo')
 
+        if SUMO_BACKEND == 'libsumo' and (sumo_gui is True or None not in (host, port)):
+            raise RuntimeError('libsumo runs sumo in process, sumo-gui and connecting to a sumo '
+                               'server require the traci backend')
+
         if host is None or port is None:
-            logging.info('Starting new sumo server...')
+            logging.info('Starting new sumo server (%s backend)...', SUMO_BACKEND)
             if sumo_gui is True:
                 logging.info('Remember to press the play button to start the simulation')
 
@@ -330,7 +408,8 @@ class SumoSimulation(object):
             logging.info('Connection to sumo server. Host: %s Port: %s', host, port)
             traci.init(host=host, port=port)
 
-        traci.setOrder(client_order)
+        if SUMO_BACKEND == 'traci':
+            traci.setOrder(client_order)
 
         # Retrieving net from configuration file.
         self.net = _get_sumo_net(cfg_file)
@@ -414,6 +493,17 @@ class SumoSimulation(object):
 
         return SumoActor(type_id, vclass, transform, signals, extent, color)
 
+    @staticmethod
+    def get_actor_states(actor_ids):
+        """
+        Accessor for the state of several sumo actors, decoded from the subscription results of all
+        the vehicles at once.
+
+            :param actor_ids: ids of the subscribed actors.
+            :return: SumoActorStates of the actors.
+        """
+        return decode_subscription_results(traci.vehicle.getAllSubscriptionResults(), actor_ids)
+
     def spawn_actor(self, type_id, color=None):
         """
         Spawns a new actor.
@@ -438,7 +528,7 @@ class SumoSimulation(object):
                     return INVALID_ACTOR_ID
 
             traci.vehicle.add(actor_id, 'carla_route_{}'.format(vclass), typeID=type_id)
-        except traci.exceptions.TraCIException as error:
+        except traci.TraCIException as error:
             logging.error('Spawn sumo actor failed: %s', error)
             return INVALID_ACTOR_ID
 
@@ -498,6 +588,15 @@ class SumoSimulation(object):
         """
         self.traffic_light_manager.set_state(landmark_id, state)
 
+    def synchronize_traffic_lights(self, states):
+        """
+        Updates the state of several traffic lights.
+
+            :param states: new state of each landmark, {landmark_id: state}.
+        """
+        if states:
+            self.traffic_light_manager.set_states(states)
+
     def tick(self):
         """
         Tick to sumo simulation.
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Micro-benchmarks for the sumo-carla co-simulation bridge. They run offline, on synthetic
+vehicles, so neither a carla nor a sumo server are needed.
+"""
+
+# ==================================================================================================
+# -- imports ---------------------------------------------------------------------------------------
+# ==================================================================================================
+
+import argparse
+import json
+import platform
+import time
+import timeit
+
+# ==================================================================================================
+# -- find carla module -----------------------------------------------------------------------------
+# ==================================================================================================
+
+import glob
+import os
+import sys
+
+try:
+    sys.path.append(
+        glob.glob('../../../PythonAPI/carla/dist/carla-*%d.%d-%s.egg' %
+                  (sys.version_info.major, sys.version_info.minor,
+                   'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+# ==================================================================================================
+# -- find traci module -----------------------------------------------------------------------------
+# ==================================================================================================
+
+if 'SUMO_HOME' in os.environ:
+    sys.path.append(os.path.join(os.environ['SUMO_HOME'], 'tools'))
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+
+# ==================================================================================================
+# -- sumo integration imports ----------------------------------------------------------------------
+# ==================================================================================================
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import carla  # pylint: disable=import-error,wrong-import-position
+import numpy as np  # pylint: disable=wrong-import-position
+
+from sumo_integration.bridge_helper import BridgeHelper  # pylint: disable=wrong-import-position
+
+# ==================================================================================================
+# -- benchmarks ------------------------------------------------------------------------------------
+# ==================================================================================================
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Registers a benchmark function, which returns a dictionary of results"""
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def time_per_call(function, repeat, number):
+    """Best time per call, in microseconds"""
+    return 1e6 * min(timeit.repeat(function, repeat=repeat, number=number)) / number
+
+
+def random_vehicles(rng, num_vehicles):
+    """
+    Returns the locations, rotations and extents, as arrays (N, 3), of random vehicles.
+    """
+    locations = np.column_stack([
+        rng.uniform(-1000.0, 1000.0, num_vehicles),
+        rng.uniform(-1000.0, 1000.0, num_vehicles),
+        rng.uniform(0.0, 10.0, num_vehicles)])
+    rotations = np.column_stack([
+        rng.uniform(-10.0, 10.0, num_vehicles),
+        rng.uniform(0.0, 360.0, num_vehicles),
+        np.zeros(num_vehicles)])
+    extents = np.column_stack([
+        rng.uniform(0.8, 6.0, num_vehicles),
+        rng.uniform(0.4, 1.3, num_vehicles),
+        rng.uniform(0.6, 2.0, num_vehicles)])
+    return locations, rotations, extents
+
+
+def to_transform_arrays(transforms):
+    """Returns the locations and rotations of a list of carla transforms, as float32 arrays"""
+    locations = np.array([[t.location.x, t.location.y, t.location.z] for t in transforms],
+                         dtype=np.float32)
+    rotations = np.array([[t.rotation.pitch, t.rotation.yaw, t.rotation.roll] for t in transforms],
+                         dtype=np.float32)
+    return locations, rotations
+
+
+@benchmark('transforms')
+def bench_transforms(args):
+    """Per-vehicle cost of the scalar and vectorized sumo <=> carla transforms"""
+    rng = np.random.RandomState(args.seed)
+    BridgeHelper.offset = (-102.5, 207.3)
+
+    results = {}
+    for num_vehicles in (10, 100, 1000):
+        locations, rotations, extents = random_vehicles(rng, num_vehicles)
+        transforms = [
+            carla.Transform(carla.Location(*location), carla.Rotation(*rotation))
+            for location, rotation in zip(locations.tolist(), rotations.tolist())
+        ]
+        vectors = [carla.Vector3D(*extent) for extent in extents.tolist()]
+
+        cases = {
+            'to_carla': (BridgeHelper.get_carla_transform, BridgeHelper.get_carla_transforms),
+            'to_sumo': (BridgeHelper.get_sumo_transform, BridgeHelper.get_sumo_transforms),
+        }
+        for name, (scalar, vectorized) in cases.items():
+            scalar_results = to_transform_arrays(
+                [scalar(transform, extent) for transform, extent in zip(transforms, vectors)])
+            vectorized_results = vectorized(locations, rotations, extents)
+
+            number = max(1, args.number * 10 // num_vehicles)
+            results['{}_{}'.format(name, num_vehicles)] = {
+                'scalar_us': time_per_call(
+                    lambda: [scalar(t, e) for t, e in zip(transforms, vectors)],
+                    args.repeat, number) / num_vehicles,
+                'vectorized_us': time_per_call(
+                    lambda: vectorized(locations, rotations, extents),
+                    args.repeat, number) / num_vehicles,
+                'vectorized_with_transforms_us': time_per_call(
+                    lambda: BridgeHelper.to_carla_transforms(
+                        *vectorized(locations, rotations, extents)),
+                    args.repeat, number) / num_vehicles,
+                'bit_compatible': all(
+                    np.array_equal(a, b) for a, b in zip(scalar_results, vectorized_results)),
+            }
+    return results
+
+# ==================================================================================================
+# -- main ------------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        '--filter',
+        nargs='+',
+        default=None,
+        help='names of the benchmarks to run (default: all)')
+    argparser.add_argument(
+        '--repeat',
+        default=5,
+        type=int,
+        help='number of repetitions of each measurement (default: 5)')
+    argparser.add_argument(
+        '--number',
+        default=100,
+        type=int,
+        help='number of calls per repetition (default: 100)')
+    argparser.add_argument(
+        '--seed',
+        default=0,
+        type=int,
+        help='seed of the synthetic vehicles (default: 0)')
+    argparser.add_argument(
+        '--output',
+        default=None,
+        help='write the results to a json file')
+    args = argparser.parse_args()
+
+    names = args.filter if args.filter else sorted(BENCHMARKS)
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'number': args.number,
+        }
+    }
+    for name in names:
+        print('Running {}...'.format(name))
+        report[name] = BENCHMARKS[name](args)
+        print(json.dumps(report[name], indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2)
+
+
+if __name__ == '__main__':
+    main()
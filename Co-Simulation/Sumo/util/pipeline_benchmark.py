@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Benchmark comparing the wall-clock time of the serial and pipelined co-simulation loops. Sumo runs
+the given example, while carla is replaced by a stub whose ticks take a fixed time, standing for
+the frame time of the carla server.
+"""
+
+# ==================================================================================================
+# -- imports ---------------------------------------------------------------------------------------
+# ==================================================================================================
+
+import argparse
+import json
+import logging
+import time
+
+# ==================================================================================================
+# -- find carla module -----------------------------------------------------------------------------
+# ==================================================================================================
+
+import glob
+import os
+import sys
+
+try:
+    sys.path.append(
+        glob.glob('../../../PythonAPI/carla/dist/carla-*%d.%d-%s.egg' %
+                  (sys.version_info.major, sys.version_info.minor,
+                   'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+# ==================================================================================================
+# -- find traci module -----------------------------------------------------------------------------
+# ==================================================================================================
+
+if 'SUMO_HOME' in os.environ:
+    sys.path.append(os.path.join(os.environ['SUMO_HOME'], 'tools'))
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+
+# ==================================================================================================
+# -- sumo integration imports ----------------------------------------------------------------------
+# ==================================================================================================
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from run_synchronization import SimulationSynchronization  # pylint: disable=wrong-import-position
+from sumo_integration.bridge_helper import BridgeHelper  # pylint: disable=wrong-import-position
+from sumo_integration.sumo_simulation import SumoSimulation  # pylint: disable=wrong-import-position
+
+# ==================================================================================================
+# -- carla stub ------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+class StubAttribute(object):
+    """Blueprint attribute with its recommended values"""
+
+    def __init__(self, recommended_values):
+        self.recommended_values = recommended_values
+
+
+class StubBlueprint(object):
+    """Vehicle blueprint with a color attribute"""
+
+    def __init__(self, blueprint_id):
+        self.id = blueprint_id
+        self._attributes = {'color': StubAttribute(['255,0,0', '0,255,0', '0,0,255'])}
+
+    def has_attribute(self, name):
+        return name in self._attributes
+
+    def get_attribute(self, name):
+        return self._attributes[name]
+
+    def set_attribute(self, name, value):
+        pass
+
+
+class StubBlueprintLibrary(list):
+    """Blueprint library with the blueprints of the carla vtypes"""
+
+    def find(self, blueprint_id):
+        return StubBlueprint(blueprint_id)
+
+
+class StubVehicle(object):
+    """Vehicle spawned by the stub, with its lights switched off"""
+
+    def __init__(self, actor_id):
+        self.id = actor_id
+
+    @staticmethod
+    def get_light_state():
+        return 0
+
+
+class StubSettings(object):
+    """World settings"""
+    synchronous_mode = False
+    fixed_delta_seconds = None
+
+
+class StubWorld(object):
+    """World of the stub, only used to configure the synchronization"""
+
+    def __init__(self, blueprint_library):
+        self._blueprint_library = blueprint_library
+
+    def get_blueprint_library(self):
+        return self._blueprint_library
+
+    @staticmethod
+    def get_settings():
+        return StubSettings()
+
+    def apply_settings(self, settings):
+        pass
+
+
+class StubTrafficManager(object):
+    """Traffic manager of the stub"""
+
+    def set_synchronous_mode(self, mode):
+        pass
+
+
+class StubClient(object):
+    """Client of the stub"""
+
+    @staticmethod
+    def get_trafficmanager():
+        return StubTrafficManager()
+
+
+class StubCarlaSimulation(object):
+    """
+    Replacement of CarlaSimulation, keeping the spawned vehicles and spending `frame_time` seconds
+    in each tick.
+    """
+
+    def __init__(self, step_length, frame_time):
+        self.step_length = step_length
+        self.frame_time = frame_time
+        self.client = StubClient()
+        self.world = StubWorld(StubBlueprintLibrary(
+            StubBlueprint(blueprint_id) for blueprint_id in BridgeHelper._VTYPES))  # pylint: disable=protected-access
+
+        self.spawned_actors = set()
+        self.destroyed_actors = set()
+        self.traffic_light_ids = set()
+        self._actors = {}
+        self._next_id = 1
+
+    def get_actor(self, actor_id):
+        return self._actors.get(actor_id)
+
+    def spawn_actors(self, requests):
+        actor_ids = []
+        for _ in requests:
+            self._actors[self._next_id] = StubVehicle(self._next_id)
+            actor_ids.append(self._next_id)
+            self._next_id += 1
+        return actor_ids
+
+    def destroy_actors(self, actor_ids):
+        return [self._actors.pop(actor_id, None) is not None for actor_id in actor_ids]
+
+    def synchronize_vehicles(self, updates):
+        return len(updates)
+
+    def switch_off_traffic_lights(self):
+        pass
+
+    def tick(self):
+        time.sleep(self.frame_time)
+        self.spawned_actors = set()
+        self.destroyed_actors = set()
+
+    def close(self):
+        pass
+
+# ==================================================================================================
+# -- main ------------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+def run(args, pipelined):
+    """
+    Runs the co-simulation of the example for the given number of steps, and returns its wall-clock
+    time and the mean duration of its phases.
+    """
+    sumo = SumoSimulation(args.sumo_cfg_file, args.step_length)
+    carla = StubCarlaSimulation(args.step_length, args.frame_time)
+    synchronization = SimulationSynchronization(sumo, carla, seed=args.seed, pipelined=pipelined)
+
+    totals = {}
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        synchronization.tick()
+        for phase, seconds in synchronization.timings.items():
+            totals[phase] = totals.get(phase, 0.0) + seconds
+    elapsed = time.perf_counter() - start
+
+    synchronization.close()
+
+    return {
+        'seconds': elapsed,
+        'steps_per_second': args.steps / elapsed,
+        'mean_phase_ms': {phase: 1e3 * total / args.steps for phase, total in totals.items()},
+    }
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('sumo_cfg_file',
+                           type=str,
+                           nargs='?',
+                           default=os.path.join(os.path.dirname(os.path.realpath(__file__)), '..',
+                                                'examples', 'Town04.sumocfg'),
+                           help='sumo configuration file (default: examples/Town04.sumocfg)')
+    argparser.add_argument('--steps',
+                           default=1000,
+                           type=int,
+                           help='number of simulation steps (default: 1000)')
+    argparser.add_argument('--step-length',
+                           default=0.05,
+                           type=float,
+                           help='set fixed delta seconds (default: 0.05s)')
+    argparser.add_argument('--frame-time',
+                           default=0.002,
+                           type=float,
+                           help='time spent by the carla stub in each tick (default: 0.002s)')
+    argparser.add_argument('--seed',
+                           default=0,
+                           type=int,
+                           help='seed for the random choices of the co-simulation (default: 0)')
+    argparser.add_argument('--output', default=None, help='write the results to a json file')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.WARNING)
+
+    report = {}
+    for mode in ('serial', 'pipelined'):
+        print('Running {}...'.format(mode))
+        report[mode] = run(args, mode == 'pipelined')
+        print(json.dumps(report[mode], indent=2))
+
+    report['speedup'] = report['serial']['seconds'] / report['pipelined']['seconds']
+    print('pipelined speedup: {:.2f}x'.format(report['speedup']))
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Benchmark comparing the steps per second of the sumo side of the co-simulation with the traci and
+libsumo backends. Each backend runs in its own process, as the backend is selected when the sumo
+integration modules are imported. No carla server is needed.
+"""
+
+# ==================================================================================================
+# -- imports ---------------------------------------------------------------------------------------
+# ==================================================================================================
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+# ==================================================================================================
+# -- worker ----------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+def run_worker(args):
+    """
+    Runs the sumo side of the co-simulation loop with the backend selected in the environment, and
+    prints the results as json.
+    """
+    if 'SUMO_HOME' in os.environ:
+        sys.path.append(os.path.join(os.environ['SUMO_HOME'], 'tools'))
+    else:
+        sys.exit("please declare environment variable 'SUMO_HOME'")
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+    from sumo_integration.sumo_simulation import SUMO_BACKEND, SumoSimulation  # pylint: disable=import-outside-toplevel
+
+    sumo = SumoSimulation(args.sumo_cfg_file, args.step_length)
+
+    subscribed = set()
+    num_vehicles = 0
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        sumo.tick()
+
+        for actor_id in sumo.spawned_actors:
+            sumo.subscribe(actor_id)
+            subscribed.add(actor_id)
+        subscribed.difference_update(sumo.destroyed_actors)
+
+        states = sumo.get_actor_states(subscribed)
+        num_vehicles += len(states.ids)
+    elapsed = time.perf_counter() - start
+
+    sumo.close()
+
+    print(json.dumps({
+        'backend': SUMO_BACKEND,
+        'steps': args.steps,
+        'seconds': elapsed,
+        'steps_per_second': args.steps / elapsed,
+        'mean_vehicles': num_vehicles / float(args.steps),
+    }))
+
+# ==================================================================================================
+# -- main ------------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+def run_backend(args, backend):
+    """
+    Runs the worker in a new process with the given backend, and returns its results.
+    """
+    env = dict(os.environ)
+    env.pop('LIBSUMO_AS_TRACI', None)
+    if backend == 'libsumo':
+        env['LIBSUMO_AS_TRACI'] = '1'
+
+    command = [
+        sys.executable, os.path.realpath(__file__), args.sumo_cfg_file, '--worker',
+        '--steps', str(args.steps), '--step-length', str(args.step_length)
+    ]
+    output = subprocess.check_output(command, env=env, universal_newlines=True)
+    results = json.loads(output.strip().splitlines()[-1])
+    if results['backend'] != backend:
+        logging.warning('%s backend not available, %s was used instead', backend,
+                        results['backend'])
+    return results
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('sumo_cfg_file',
+                           type=str,
+                           nargs='?',
+                           default=os.path.join(os.path.dirname(os.path.realpath(__file__)), '..',
+                                                'examples', 'Town04.sumocfg'),
+                           help='sumo configuration file (default: examples/Town04.sumocfg)')
+    argparser.add_argument('--steps',
+                           default=2000,
+                           type=int,
+                           help='number of simulation steps (default: 2000)')
+    argparser.add_argument('--step-length',
+                           default=0.05,
+                           type=float,
+                           help='set fixed delta seconds (default: 0.05s)')
+    argparser.add_argument('--backends',
+                           nargs='+',
+                           default=['traci', 'libsumo'],
+                           choices=['traci', 'libsumo'],
+                           help='backends to compare (default: traci libsumo)')
+    argparser.add_argument('--output', default=None, help='write the results to a json file')
+    argparser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    report = {}
+    for backend in args.backends:
+        logging.info('Running %s backend...', backend)
+        report[backend] = run_backend(args, backend)
+        print(json.dumps(report[backend], indent=2))
+
+    if 'traci' in report and 'libsumo' in report:
+        report['speedup'] = report['libsumo']['steps_per_second'] / report['traci']['steps_per_second']
+        print('libsumo speedup: {:.2f}x'.format(report['speedup']))
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,14 +9,18 @@ waypoints and avoiding other vehicles. The agent also responds to traffic lights
 It can also make use of the global route planner to follow a specifed route
 """
 
+import numpy as np
 import carla
 from shapely.geometry import Polygon
 
 from agents.navigation.local_planner import LocalPlanner, RoadOption
 from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.navigation.route_planning_service import RoutePlanningService
 from agents.tools.misc import (get_speed, is_within_distance,
                                get_trafficlight_trigger_location,
                                compute_distance)
+from agents.tools.map_cache import CachedMap
+from agents.tools.profiling import profiled, profile_phase
 
 
 class BasicAgent(object):
@@ -34,18 +38,22 @@ class BasicAgent(object):
             :param vehicle: actor to apply to agent logic onto
             :param target_speed: speed (in Km/h) at which the vehicle will move
             :param opt_dict: dictionary in case some of its parameters want to be changed.
-                This also applies to parameters related to the LocalPlanner.
+                This also applies to parameters related to the LocalPlanner, such as
+                'random_generator', the random.Random or numpy.random.Generator used for the
+                random choices at junctions while roaming. If not given, the global random
+                module is used.
             :param map_inst: carla.Map instance to avoid the expensive call of getting it.
+                A CachedMap can be used instead, to share the waypoint queries between agents.
             :param grp_inst: GlobalRoutePlanner instance to avoid the expensive call of getting it.
 
         """
         self._vehicle = vehicle
         self._world = self._vehicle.get_world()
         if map_inst:
-            if isinstance(map_inst, carla.Map):
+            if isinstance(map_inst, (carla.Map, CachedMap)):
                 self._map = map_inst
             else:
-                print("Warning: Ignoring the given map as it is not a 'carla.Map'")
+                print("Warning: Ignoring the given map as it is not a 'carla.Map' or 'CachedMap'")
                 self._map = self._world.get_map()
         else:
             self._map = self._world.get_map()
@@ -63,6 +71,7 @@ class BasicAgent(object):
         self._speed_ratio = 1
         self._max_brake = 0.5
         self._offset = 0
+        self._route_planning_service = None
 
         # Change parameters according to the dictionary
         opt_dict['target_speed'] = target_speed
@@ -86,6 +95,8 @@ class BasicAgent(object):
             self._max_brake = opt_dict['max_brake']
         if 'offset' in opt_dict:
             self._offset = opt_dict['offset']
+        if 'route_planning_service' in opt_dict:
+            self._route_planning_service = opt_dict['route_planning_service']
 
         # Initialize the planners
         self._local_planner = LocalPlanner(self._vehicle, opt_dict=opt_dict, map_inst=self._map)
@@ -138,7 +149,16 @@ class BasicAgent(object):
         """Get method for protected member local planner"""
         return self._global_planner
 
-    def set_destination(self, end_location, start_location=None):
+    def get_route_planning_service(self):
+        """
+        Returns the service computing the asynchronous routes. If none was given
+        as option, one is created for the global planner of the agent.
+        """
+        if self._route_planning_service is None:
+            self._route_planning_service = RoutePlanningService(self._global_planner)
+        return self._route_planning_service
+
+    def set_destination(self, end_location, start_location=None, asynchronous=False):
         """
         This method creates a list of waypoints between a starting and ending location,
         based on the route returned by the global router, and adds it to the local planner.
@@ -147,6 +167,9 @@ class BasicAgent(object):
 
             :param end_location (carla.Location): final location of the route
             :param start_location (carla.Location): starting location of the route
+            :param asynchronous (bool): if True, the route is computed in the background by the
+                route planning service, and the agent keeps following its current plan until it is ready
+            :return: if asynchronous, the concurrent.futures.Future of the route
         """
         if not start_location:
             start_location = self._local_planner.target_waypoint.transform.location
@@ -158,6 +181,12 @@ class BasicAgent(object):
         start_waypoint = self._map.get_waypoint(start_location)
         end_waypoint = self._map.get_waypoint(end_location)
 
+        if asynchronous:
+            future_route = self.get_route_planning_service().submit(
+                start_waypoint.transform.location, end_waypoint.transform.location)
+            self._local_planner.set_global_plan_async(future_route, clean_queue=clean_queue)
+            return future_route
+
         route_trace = self.trace_route(start_waypoint, end_waypoint)
         self._local_planner.set_global_plan(route_trace, clean_queue=clean_queue)
 
@@ -184,14 +213,18 @@ class BasicAgent(object):
         """
         start_location = start_waypoint.transform.location
         end_location = end_waypoint.transform.location
+        if self._route_planning_service is not None:
+            return self._route_planning_service.trace_route(start_location, end_location)
         return self._global_planner.trace_route(start_location, end_location)
 
+    @profiled('agent.run_step')
     def run_step(self):
         """Execute one step of navigation."""
         hazard_detected = False
 
         # Retrieve all relevant actors
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
+        with profile_phase(self._vehicle, 'server.get_actors'):
+            vehicle_list = self._world.get_actors().filter("*vehicle*")
 
         vehicle_speed = get_speed(self._vehicle) / 3.6
 
@@ -237,7 +270,8 @@ class BasicAgent(object):
         """
         Changes the path so that the vehicle performs a lane change.
         Use 'direction' to specify either a 'left' or 'right' lane change,
-        and the other 3 fine tune the maneuver
+        and the other 3 fine tune the maneuver. After it, the vehicle moves back
+        to the route of the plan, taking 'lane_change_time' again.
         """
         speed = self._vehicle.get_velocity().length()
         path = self._generate_lane_change_path(
@@ -252,9 +286,12 @@ class BasicAgent(object):
         )
         if not path:
             print("WARNING: Ignoring the lane change as no path was found")
+            return
 
-        self.set_global_plan(path)
+        self._local_planner.splice_plan(
+            path, rejoin_distance=max(lane_change_time * speed, self._sampling_resolution))
 
+    @profiled('obstacles.traffic_lights')
     def _affected_by_traffic_light(self, lights_list=None, max_distance=None):
         """
         Method to check if there is a red light affecting the vehicle.
@@ -268,7 +305,8 @@ class BasicAgent(object):
             return (False, None)
 
         if not lights_list:
-            lights_list = self._world.get_actors().filter("*traffic_light*")
+            with profile_phase(self._vehicle, 'server.get_actors'):
+                lights_list = self._world.get_actors().filter("*traffic_light*")
 
         if not max_distance:
             max_distance = self._base_tlight_threshold
@@ -312,7 +350,9 @@ class BasicAgent(object):
 
         return (False, None)
 
-    def _vehicle_obstacle_detected(self, vehicle_list=None, max_distance=None, up_angle_th=90, low_angle_th=0, lane_offset=0):
+    @profiled('obstacles.vehicles')
+    def _vehicle_obstacle_detected(self, vehicle_list=None, max_distance=None, up_angle_th=90, low_angle_th=0,
+                                   lane_offset=0, predicted_locations=None):
         """
         Method to check if there is a vehicle in front of the agent blocking its path.
 
@@ -320,6 +360,8 @@ class BasicAgent(object):
                 If None, all vehicle in the scene are used
             :param max_distance: max freespace to check for obstacles.
                 If None, the base threshold value is used
+            :param predicted_locations: optional dictionary {actor id: carla.Location} with the
+                locations at which to check the vehicles instead of their current ones
         """
         def get_route_polygon():
             route_bb = []
@@ -350,7 +392,8 @@ class BasicAgent(object):
             return (False, None, -1)
 
         if not vehicle_list:
-            vehicle_list = self._world.get_actors().filter("*vehicle*")
+            with profile_phase(self._vehicle, 'server.get_actors'):
+                vehicle_list = self._world.get_actors().filter("*vehicle*")
 
         if not max_distance:
             max_distance = self._base_vehicle_threshold
@@ -379,6 +422,8 @@ class BasicAgent(object):
                 continue
 
             target_transform = target_vehicle.get_transform()
+            if predicted_locations is not None:
+                target_transform.location = predicted_locations[target_vehicle.id]
             if target_transform.location.distance(ego_location) > max_distance:
                 continue
 
@@ -388,7 +433,7 @@ class BasicAgent(object):
             if (use_bbs or target_wpt.is_junction) and route_polygon:
 
                 target_bb = target_vehicle.bounding_box
-                target_vertices = target_bb.get_world_vertices(target_vehicle.get_transform())
+                target_vertices = target_bb.get_world_vertices(target_transform)
                 target_list = [[v.x, v.y, v.z] for v in target_vertices]
                 target_polygon = Polygon(target_list)
 
@@ -425,11 +470,19 @@ class BasicAgent(object):
         This methods generates a path that results in a lane change.
         Use the different distances to fine-tune the maneuver.
         If the lane change is impossible, the returned path will be empty.
+        Single lane changes that fit within the lane segments of the global planner are read
+        from its cached samples, spaced by its sampling resolution instead of `step_distance`.
         """
         distance_same_lane = max(distance_same_lane, 0.1)
         distance_other_lane = max(distance_other_lane, 0.1)
         lane_change_distance = max(lane_change_distance, 0.1)
 
+        if lane_changes == 1:
+            plan = self._generate_lane_change_path_from_samples(
+                waypoint, direction, distance_same_lane, distance_other_lane, lane_change_distance, check)
+            if plan is not None:
+                return plan
+
         plan = []
         plan.append((waypoint, RoadOption.LANEFOLLOW))  # start position
 
@@ -493,3 +546,76 @@ class BasicAgent(object):
             plan.append((next_wp, RoadOption.LANEFOLLOW))
 
         return plan
+
+    def _generate_lane_change_path_from_samples(self, waypoint, direction, distance_same_lane,
+                                                distance_other_lane, lane_change_distance, check):
+        """
+        Version of _generate_lane_change_path for a single lane change that reads the lanes from the
+        samples cached by the global planner, and the side lane from its lane change links, instead of
+        moving forward with next() calls.
+        Returns None if the maneuver does not fit within the cached lane segments.
+        """
+        if direction == 'left':
+            option = RoadOption.CHANGELANELEFT
+        elif direction == 'right':
+            option = RoadOption.CHANGELANERIGHT
+        else:
+            # ERROR, input value for change must be 'left' or 'right'
+            return []
+
+        samples = self._global_planner.get_lane_samples(waypoint)
+        if samples is None:
+            return None
+        waypoints, locations, distances = samples
+
+        # Same lane
+        start = _closest_sample(locations, waypoint.transform.location)
+        same_lane_end = int(np.searchsorted(distances, distances[start] + distance_same_lane))
+        if same_lane_end >= len(waypoints):
+            return None
+        change = int(np.searchsorted(distances, distances[same_lane_end] + lane_change_distance))
+        if change >= len(waypoints):
+            return None
+
+        plan = [(waypoint, RoadOption.LANEFOLLOW)]
+        plan.extend((w, RoadOption.LANEFOLLOW) for w in waypoints[start + 1:same_lane_end + 1])
+
+        # Lane change
+        next_wp = waypoints[change]
+        if direction == 'left':
+            if check and str(next_wp.lane_change) not in ['Left', 'Both']:
+                return []
+        else:
+            if check and str(next_wp.lane_change) not in ['Right', 'Both']:
+                return []
+
+        side_samples = self._global_planner.get_side_lane_samples(next_wp, option)
+        if side_samples is not None:
+            side_waypoints, side_locations, side_distances = side_samples
+            side_start = _closest_sample(side_locations, next_wp.transform.location)
+            side_wp = side_waypoints[side_start]
+        else:
+            # The graph has no lane change link in this segment, read the side lane from the map
+            side_wp = next_wp.get_left_lane() if direction == 'left' else next_wp.get_right_lane()
+            if not side_wp or side_wp.lane_type != carla.LaneType.Driving:
+                return []
+            side_samples = self._global_planner.get_lane_samples(side_wp)
+            if side_samples is None:
+                return None
+            side_waypoints, side_locations, side_distances = side_samples
+            side_start = _closest_sample(side_locations, side_wp.transform.location)
+        plan.append((side_wp, option))
+
+        # Other lane
+        other_lane_end = int(np.searchsorted(side_distances, side_distances[side_start] + distance_other_lane))
+        if other_lane_end >= len(side_waypoints):
+            return None
+        plan.extend((w, RoadOption.LANEFOLLOW) for w in side_waypoints[side_start + 1:other_lane_end + 1])
+
+        return plan
+
+
+def _closest_sample(locations, location):
+    """Index of the row of an array (N, 3) of locations closest to a carla.Location"""
+    diff = locations - (location.x, location.y, location.z)
+    return int(np.argmin(np.einsum('ij,ij->i', diff, diff)))
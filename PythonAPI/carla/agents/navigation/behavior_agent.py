@@ -8,14 +8,15 @@
 waypoints and avoiding other vehicles. The agent also responds to traffic lights,
 traffic signs, and has different possible configurations. """
 
-import random
 import numpy as np
 import carla
 from agents.navigation.basic_agent import BasicAgent
 from agents.navigation.local_planner import RoadOption
 from agents.navigation.behavior_types import Cautious, Aggressive, Normal
 
-from agents.tools.misc import get_speed, positive, is_within_distance, compute_distance
+from agents.tools.misc import (get_speed, positive, is_within_distance, compute_distance,
+                               compute_corridor_intervals)
+from agents.tools.profiling import profiled, profile_phase
 
 class BehaviorAgent(BasicAgent):
     """
@@ -36,6 +37,12 @@ class BehaviorAgent(BasicAgent):
 
             :param vehicle: actor to apply to local planner logic onto
             :param behavior: type of agent to apply
+            :param opt_dict: dictionary in case some of its parameters want to be changed.
+                This also applies to parameters related to the BasicAgent and the LocalPlanner,
+                such as 'random_generator', the random.Random or numpy.random.Generator used
+                for the random choices at junctions while roaming.
+            :param map_inst: carla.Map instance to avoid the expensive call of getting it.
+            :param grp_inst: GlobalRoutePlanner instance to avoid the expensive call of getting it.
         """
 
         super().__init__(vehicle, opt_dict=opt_dict, map_inst=map_inst, grp_inst=grp_inst)
@@ -50,6 +57,7 @@ class BehaviorAgent(BasicAgent):
         self._min_speed = 5
         self._behavior = None
         self._sampling_resolution = 4.5
+        self._hazard_horizon = 3.0  # seconds
 
         # Parameters for agent behavior
         if behavior == 'cautious':
@@ -84,7 +92,8 @@ class BehaviorAgent(BasicAgent):
         """
         This method is in charge of behaviors for red lights.
         """
-        actor_list = self._world.get_actors()
+        with profile_phase(self._vehicle, 'server.get_actors'):
+            actor_list = self._world.get_actors()
         lights_list = actor_list.filter("*traffic_light*")
         affected, _ = self._affected_by_traffic_light(lights_list)
 
@@ -112,21 +121,128 @@ class BehaviorAgent(BasicAgent):
                     carla.LaneChange.Both) and waypoint.lane_id * right_wpt.lane_id > 0 and right_wpt.lane_type == carla.LaneType.Driving:
                 new_vehicle_state, _, _ = self._vehicle_obstacle_detected(vehicle_list, max(
                     self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=1)
-                if not new_vehicle_state:
+                if not new_vehicle_state and self._tailgating_lane_change(waypoint, 'right'):
                     print("Tailgating, moving to the right!")
-                    end_waypoint = self._local_planner.target_waypoint
-                    self._behavior.tailgate_counter = 200
-                    self.set_destination(end_waypoint.transform.location,
-                                         right_wpt.transform.location)
             elif left_turn == carla.LaneChange.Left and waypoint.lane_id * left_wpt.lane_id > 0 and left_wpt.lane_type == carla.LaneType.Driving:
                 new_vehicle_state, _, _ = self._vehicle_obstacle_detected(vehicle_list, max(
                     self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=-1)
-                if not new_vehicle_state:
+                if not new_vehicle_state and self._tailgating_lane_change(waypoint, 'left'):
                     print("Tailgating, moving to the left!")
-                    end_waypoint = self._local_planner.target_waypoint
-                    self._behavior.tailgate_counter = 200
-                    self.set_destination(end_waypoint.transform.location,
-                                         left_wpt.transform.location)
+
+    def _tailgating_lane_change(self, waypoint, direction):
+        """
+        Splices a lane change into the current plan to let a faster vehicle pass, moving back to
+        the route a few lane change lengths later.
+
+            :param waypoint: current waypoint of the agent
+            :param direction: 'left' or 'right'
+            :return: True if the lane change was possible
+        """
+        lane_change_distance = max(2 * self._speed / 3.6, self._sampling_resolution)
+        path = self._generate_lane_change_path(
+            waypoint, direction, distance_same_lane=0, distance_other_lane=3 * lane_change_distance,
+            lane_change_distance=lane_change_distance, check=False, step_distance=self._sampling_resolution)
+        if not path:
+            return False
+
+        self._behavior.tailgate_counter = 200
+        self._local_planner.splice_plan(path, rejoin_distance=lane_change_distance)
+        return True
+
+    @profiled('obstacles.screening')
+    def _screen_hazards(self, actor_list, waypoint, max_distance, up_angle_th=90, lane_offset=0, check_distance=None):
+        """
+        Selects the actors that go through the obstacle checks, in a single numpy pass. The checks
+        on the current state skip the actors further than max_distance from the agent, so only the
+        others are returned for them. Besides, the actors that can get within max_distance during
+        the hazard horizon, given their speed relative to the agent, are rolled forward at constant
+        velocity. Those that enter the checked lane are returned with their predicted location while
+        inside of it, so that the obstacle checks can act on predicted conflicts.
+
+            :param actor_list: list of actors to screen
+            :param waypoint: current waypoint of the agent
+            :param max_distance: max distance used by the obstacle checks
+            :param up_angle_th: upper angle of the obstacle checks, above 90 the lane behind the
+                agent is checked too
+            :param lane_offset: lane of the obstacle checks, -1 for the left one and 1 for the right one
+            :param check_distance: distance to the agent of the actors returned for the checks on the
+                current state, if other checks need more than max_distance
+            :return: tuple with the list of actors to check with their current state, the list of
+                actors at risk and a dictionary {actor id: carla.Location} with their predicted locations
+        """
+        actor_list = [a for a in actor_list if a.id != self._vehicle.id]
+        if not actor_list:
+            return [], [], {}
+
+        ego_transform = self._vehicle.get_transform()
+        ego_loc = ego_transform.location
+        ego_vel = self._vehicle.get_velocity()
+
+        locations = [actor.get_location() for actor in actor_list]
+        positions = np.array([(loc.x, loc.y, loc.z) for loc in locations], dtype=np.float64)
+        velocities = [actor.get_velocity() for actor in actor_list]
+        velocities = np.array([(vel.x, vel.y) for vel in velocities], dtype=np.float64) - (ego_vel.x, ego_vel.y)
+
+        diff = positions - (ego_loc.x, ego_loc.y, ego_loc.z)
+        distances = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+        check_distance = max_distance if check_distance is None else check_distance
+        check_actors = [actor_list[i] for i in np.flatnonzero(distances <= check_distance)]
+
+        # Only the actors that can reach the checked lane within the horizon are rolled forward
+        half_width = waypoint.lane_width / 2.0
+        center = lane_offset * waypoint.lane_width
+        reach = max_distance + abs(center) + half_width + \
+            self._hazard_horizon * np.hypot(velocities[:, 0], velocities[:, 1])
+        reachable = np.flatnonzero(distances < reach)
+        if reachable.size == 0:
+            return check_actors, [], {}
+
+        # Frame of the agent, x pointing forward and y to the right, centered on the checked lane
+        yaw = np.radians(ego_transform.rotation.yaw)
+        rotation = np.array([[np.cos(yaw), -np.sin(yaw)], [np.sin(yaw), np.cos(yaw)]])
+        relative = diff[reachable, 0:2].dot(rotation) - (0.0, center)
+        velocities = velocities[reachable].dot(rotation)
+
+        # Checked lane, ahead of the front of the agent (or also behind it) up to max_distance
+        corridor_start = -max_distance if up_angle_th > 90 else self._vehicle.bounding_box.extent.x
+        enter, exit_ = compute_corridor_intervals(
+            relative, velocities, corridor_start, max_distance, half_width, self._hazard_horizon)
+        at_risk = np.flatnonzero(enter <= exit_)
+
+        # The actors are checked halfway through their stay in the lane, well inside of it
+        times = (enter[at_risk] + exit_[at_risk]) / 2.0
+        predicted = relative[at_risk] + velocities[at_risk] * times[:, np.newaxis] + (0.0, center)
+        predicted = predicted.dot(rotation.T)
+
+        risk_actors = []
+        predicted_locations = {}
+        for i, (x, y) in zip(reachable[at_risk].tolist(), predicted.tolist()):
+            risk_actors.append(actor_list[i])
+            predicted_locations[actor_list[i].id] = carla.Location(ego_loc.x + x, ego_loc.y + y, ego_loc.z)
+        return check_actors, risk_actors, predicted_locations
+
+    def _hazard_detected(self, check_actors, risk_actors, predicted_locations, max_distance, **kwargs):
+        """
+        Runs the obstacle checks on the current state of the actors to check and, if none of them
+        is an obstacle, on the predicted state of the actors at risk (see _screen_hazards).
+
+            :param max_distance: max distance of the obstacle checks
+            :param kwargs: other arguments of _vehicle_obstacle_detected
+            :return: tuple (detected, actor, current distance to the actor)
+        """
+        # An empty list would make the checks use all the vehicles of the world
+        if check_actors:
+            state, actor, distance = self._vehicle_obstacle_detected(check_actors, max_distance, **kwargs)
+            if state:
+                return state, actor, distance
+        if not risk_actors:
+            return False, None, -1
+
+        state, actor, _ = self._vehicle_obstacle_detected(
+            risk_actors, max_distance, predicted_locations=predicted_locations, **kwargs)
+        if not state:
+            return False, None, -1
+        return True, actor, compute_distance(actor.get_location(), self._vehicle.get_location())
 
     def collision_and_car_avoid_manager(self, waypoint):
         """
@@ -140,28 +256,31 @@ class BehaviorAgent(BasicAgent):
             :return distance: distance to nearby vehicle
         """
 
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
-        def dist(v): return v.get_location().distance(waypoint.transform.location)
-        vehicle_list = [v for v in vehicle_list if dist(v) < 45 and v.id != self._vehicle.id]
+        with profile_phase(self._vehicle, 'server.get_actors'):
+            vehicle_list = self._world.get_actors().filter("*vehicle*")
 
         if self._direction == RoadOption.CHANGELANELEFT:
-            vehicle_state, vehicle, distance = self._vehicle_obstacle_detected(
-                vehicle_list, max(
-                    self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=-1)
+            detection = {'max_distance': max(self._behavior.min_proximity_threshold, self._speed_limit / 2),
+                         'up_angle_th': 180, 'lane_offset': -1}
         elif self._direction == RoadOption.CHANGELANERIGHT:
-            vehicle_state, vehicle, distance = self._vehicle_obstacle_detected(
-                vehicle_list, max(
-                    self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=1)
+            detection = {'max_distance': max(self._behavior.min_proximity_threshold, self._speed_limit / 2),
+                         'up_angle_th': 180, 'lane_offset': 1}
         else:
-            vehicle_state, vehicle, distance = self._vehicle_obstacle_detected(
-                vehicle_list, max(
-                    self._behavior.min_proximity_threshold, self._speed_limit / 3), up_angle_th=30)
-
-            # Check for tailgating
-            if not vehicle_state and self._direction == RoadOption.LANEFOLLOW \
-                    and not waypoint.is_junction and self._speed > 10 \
-                    and self._behavior.tailgate_counter == 0:
-                self._tailgating(waypoint, vehicle_list)
+            detection = {'max_distance': max(self._behavior.min_proximity_threshold, self._speed_limit / 3),
+                         'up_angle_th': 30}
+
+        # The checks of the tailgating reach further than the obstacle checks
+        tailgating_distance = max(self._behavior.min_proximity_threshold, self._speed_limit / 2)
+        vehicle_list, risk_list, predicted_locations = self._screen_hazards(
+            vehicle_list, waypoint, check_distance=tailgating_distance, **detection)
+        vehicle_state, vehicle, distance = self._hazard_detected(
+            vehicle_list, risk_list, predicted_locations, **detection)
+
+        # Check for tailgating
+        if not vehicle_state and self._direction == RoadOption.LANEFOLLOW \
+                and not waypoint.is_junction and self._speed > 10 \
+                and self._behavior.tailgate_counter == 0 and vehicle_list:
+            self._tailgating(waypoint, vehicle_list)
 
         return vehicle_state, vehicle, distance
 
@@ -177,21 +296,21 @@ class BehaviorAgent(BasicAgent):
             :return distance: distance to nearby walker
         """
 
-        walker_list = self._world.get_actors().filter("*walker.pedestrian*")
-        def dist(w): return w.get_location().distance(waypoint.transform.location)
-        walker_list = [w for w in walker_list if dist(w) < 10]
+        with profile_phase(self._vehicle, 'server.get_actors'):
+            walker_list = self._world.get_actors().filter("*walker.pedestrian*")
 
         if self._direction == RoadOption.CHANGELANELEFT:
-            walker_state, walker, distance = self._vehicle_obstacle_detected(walker_list, max(
-                self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=90, lane_offset=-1)
+            detection = {'max_distance': max(self._behavior.min_proximity_threshold, self._speed_limit / 2),
+                         'up_angle_th': 90, 'lane_offset': -1}
         elif self._direction == RoadOption.CHANGELANERIGHT:
-            walker_state, walker, distance = self._vehicle_obstacle_detected(walker_list, max(
-                self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=90, lane_offset=1)
+            detection = {'max_distance': max(self._behavior.min_proximity_threshold, self._speed_limit / 2),
+                         'up_angle_th': 90, 'lane_offset': 1}
         else:
-            walker_state, walker, distance = self._vehicle_obstacle_detected(walker_list, max(
-                self._behavior.min_proximity_threshold, self._speed_limit / 3), up_angle_th=60)
+            detection = {'max_distance': max(self._behavior.min_proximity_threshold, self._speed_limit / 3),
+                         'up_angle_th': 60}
 
-        return walker_state, walker, distance
+        check_list, risk_list, predicted_locations = self._screen_hazards(walker_list, waypoint, **detection)
+        return self._hazard_detected(check_list, risk_list, predicted_locations, **detection)
 
     def car_following_manager(self, vehicle, distance, debug=False):
         """
@@ -236,6 +355,7 @@ class BehaviorAgent(BasicAgent):
 
         return control
 
+    @profiled('agent.run_step')
     def run_step(self, debug=False):
         """
         Execute one step of navigation.
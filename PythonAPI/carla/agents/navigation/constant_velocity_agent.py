@@ -12,6 +12,7 @@ It can also make use of the global route planner to follow a specifed route
 import carla
 
 from agents.navigation.basic_agent import BasicAgent
+from agents.tools.profiling import profile_phase
 
 class ConstantVelocityAgent(BasicAgent):
     """
@@ -28,7 +29,10 @@ class ConstantVelocityAgent(BasicAgent):
             :param vehicle: actor to apply to agent logic onto
             :param target_speed: speed (in Km/h) at which the vehicle will move
             :param opt_dict: dictionary in case some of its parameters want to be changed.
-                This also applies to parameters related to the LocalPlanner.
+                This also applies to parameters related to the LocalPlanner, such as
+                'random_generator', the random.Random or numpy.random.Generator used for the
+                random choices at junctions while roaming. If not given, the global random
+                module is used.
             :param map_inst: carla.Map instance to avoid the expensive call of getting it.
             :param grp_inst: GlobalRoutePlanner instance to avoid the expensive call of getting it.
         """
@@ -85,7 +89,8 @@ class ConstantVelocityAgent(BasicAgent):
         hazard_detected = False
 
         # Retrieve all relevant actors
-        actor_list = self._world.get_actors()
+        with profile_phase(self._vehicle, 'server.get_actors'):
+            actor_list = self._world.get_actors()
         vehicle_list = actor_list.filter("*vehicle*")
         lights_list = actor_list.filter("*traffic_light*")
 
@@ -10,6 +10,12 @@ import math
 import numpy as np
 import carla
 from agents.tools.misc import get_speed
+from agents.tools.profiling import profiled
+
+
+def _clip(value, min_value, max_value):
+    """Scalar equivalent of np.clip, without the numpy call overhead"""
+    return max(min_value, min(max_value, value))
 
 
 class VehiclePIDController():
@@ -51,6 +57,7 @@ class VehiclePIDController():
         self._lon_controller = PIDLongitudinalController(self._vehicle, **args_longitudinal)
         self._lat_controller = PIDLateralController(self._vehicle, offset, **args_lateral)
 
+    @profiled('controller.run_step')
     def run_step(self, target_speed, waypoint):
         """
         Execute one step of control invoking both lateral and longitudinal
@@ -161,7 +168,7 @@ class PIDLongitudinalController():
             _de = 0.0
             _ie = 0.0
 
-        return np.clip((self._k_p * error) + (self._k_d * _de) + (self._k_i * _ie), -1.0, 1.0)
+        return _clip((self._k_p * error) + (self._k_d * _de) + (self._k_i * _ie), -1.0, 1.0)
 
     def change_parameters(self, K_P, K_I, K_D, dt):
         """Changes the PID parameters"""
@@ -220,10 +227,11 @@ class PIDLateralController():
             :param vehicle_transform: current transform of the vehicle
             :return: steering control in the range [-1, 1]
         """
-        # Get the ego's location and forward vector
+        # Get the ego's location and forward vector. Plain floats are used instead of
+        # numpy arrays, as the call overhead dominates for such small vectors.
         ego_loc = vehicle_transform.location
         v_vec = vehicle_transform.get_forward_vector()
-        v_vec = np.array([v_vec.x, v_vec.y, 0.0])
+        v_x, v_y = v_vec.x, v_vec.y
 
         # Get the vector vehicle-target_wp
         if self._offset != 0:
@@ -235,17 +243,16 @@ class PIDLateralController():
         else:
             w_loc = waypoint.transform.location
 
-        w_vec = np.array([w_loc.x - ego_loc.x,
-                          w_loc.y - ego_loc.y,
-                          0.0])
+        w_x = w_loc.x - ego_loc.x
+        w_y = w_loc.y - ego_loc.y
 
-        wv_linalg = np.linalg.norm(w_vec) * np.linalg.norm(v_vec)
+        wv_linalg = math.sqrt(w_x * w_x + w_y * w_y) * math.sqrt(v_x * v_x + v_y * v_y)
         if wv_linalg == 0:
             _dot = 1
         else:
-            _dot = math.acos(np.clip(np.dot(w_vec, v_vec) / (wv_linalg), -1.0, 1.0))
-        _cross = np.cross(v_vec, w_vec)
-        if _cross[2] < 0:
+            _dot = math.acos(_clip((w_x * v_x + w_y * v_y) / wv_linalg, -1.0, 1.0))
+        _cross = v_x * w_y - v_y * w_x
+        if _cross < 0:
             _dot *= -1.0
 
         self._e_buffer.append(_dot)
@@ -256,7 +263,7 @@ class PIDLateralController():
             _de = 0.0
             _ie = 0.0
 
-        return np.clip((self._k_p * _dot) + (self._k_d * _de) + (self._k_i * _ie), -1.0, 1.0)
+        return _clip((self._k_p * _dot) + (self._k_d * _de) + (self._k_i * _ie), -1.0, 1.0)
 
     def change_parameters(self, K_P, K_I, K_D, dt):
         """Changes the PID parameters"""
@@ -264,3 +271,185 @@ class PIDLateralController():
         self._k_i = K_I
         self._k_d = K_D
         self._dt = dt
+
+
+class PIDControllerBank():
+    """
+    PIDControllerBank holds the state of the lateral and longitudinal PID controllers
+    of several vehicles as arrays, computing the control of all of them at once.
+    Each slot of the bank behaves as a VehiclePIDController, with the error buffers
+    of the controllers stored as ring buffers.
+    """
+
+    def __init__(self, vehicles, args_lateral, args_longitudinal, offset=0, max_throttle=0.75, max_brake=0.3,
+                 max_steering=0.8, buffer_length=10):
+        """
+        Constructor method.
+
+        :param vehicles: list of actors controlled by the bank, one per slot
+        :param args_lateral: dictionary of arguments to set the lateral PID controllers
+        :param args_longitudinal: dictionary of arguments to set the longitudinal PID controllers
+        :param offset: lateral offset from the center line, shared by all the vehicles
+        :param max_throttle: maximum throttle applied to the vehicles
+        :param max_brake: maximum brake applied to the vehicles
+        :param max_steering: maximum steering applied to the vehicles
+        :param buffer_length: length of the error buffers, used by the integral terms
+        """
+        size = len(vehicles)
+        self.size = size
+        self._buffer_length = buffer_length
+
+        self.max_throt = np.full(size, max_throttle, dtype=np.float64)
+        self.max_brake = np.full(size, max_brake, dtype=np.float64)
+        self.max_steer = np.full(size, max_steering, dtype=np.float64)
+        self.past_steering = np.array([vehicle.get_control().steer for vehicle in vehicles], dtype=np.float64)
+        self._offset = np.full(size, offset, dtype=np.float64)
+
+        self._lon_gains = np.zeros((size, 4), dtype=np.float64)  # K_P, K_I, K_D, dt
+        self._lat_gains = np.zeros((size, 4), dtype=np.float64)
+        self._lon_gains[:] = _pid_gains(**args_longitudinal)
+        self._lat_gains[:] = _pid_gains(**args_lateral)
+
+        self._lon_buffer = np.zeros((size, buffer_length), dtype=np.float64)
+        self._lat_buffer = np.zeros((size, buffer_length), dtype=np.float64)
+        self._head = np.zeros(size, dtype=np.int64)
+        self._count = np.zeros(size, dtype=np.int64)
+        self._rows = np.arange(size)
+
+    def reset(self, index, vehicle):
+        """
+        Clears the state of a slot, so that it can be used by another vehicle.
+
+            :param index: slot of the bank
+            :param vehicle: actor controlled by the slot from now on
+        """
+        self._lon_buffer[index] = 0.0
+        self._lat_buffer[index] = 0.0
+        self._head[index] = 0
+        self._count[index] = 0
+        self.past_steering[index] = vehicle.get_control().steer
+
+    def change_longitudinal_PID(self, args_longitudinal, index=None):
+        """Changes the parameters of the longitudinal controllers. If no index is given, all of them are changed"""
+        self._lon_gains[slice(None) if index is None else index] = _pid_gains(**args_longitudinal)
+
+    def change_lateral_PID(self, args_lateral, index=None):
+        """Changes the parameters of the lateral controllers. If no index is given, all of them are changed"""
+        self._lat_gains[slice(None) if index is None else index] = _pid_gains(**args_lateral)
+
+    def set_offset(self, offset, index=None):
+        """Changes the offset. If no index is given, all of them are changed"""
+        self._offset[slice(None) if index is None else index] = offset
+
+    @profiled('controller_bank.run_step')
+    def run_step(self, vehicles, target_speeds, waypoints):
+        """
+        Execute one step of control of all the vehicles of the bank.
+
+            :param vehicles: list of actors, one per slot of the bank
+            :param target_speeds: desired vehicle speeds, in Km/h
+            :param waypoints: target waypoints, one per slot of the bank
+            :return: list of carla.VehicleControl
+        """
+        current_speeds = np.empty(self.size, dtype=np.float64)
+        ego_locations = np.empty((self.size, 2), dtype=np.float64)
+        ego_forwards = np.empty((self.size, 2), dtype=np.float64)
+        target_locations = np.empty((self.size, 2), dtype=np.float64)
+
+        for i, (vehicle, waypoint) in enumerate(zip(vehicles, waypoints)):
+            current_speeds[i] = get_speed(vehicle)
+            v_tran = vehicle.get_transform()
+            v_vec = v_tran.get_forward_vector()
+            ego_locations[i] = (v_tran.location.x, v_tran.location.y)
+            ego_forwards[i] = (v_vec.x, v_vec.y)
+
+            w_tran = waypoint.transform
+            w_loc = w_tran.location
+            if self._offset[i] != 0:
+                # Displace the wp to the side
+                r_vec = w_tran.get_right_vector()
+                target_locations[i] = (w_loc.x + self._offset[i] * r_vec.x, w_loc.y + self._offset[i] * r_vec.y)
+            else:
+                target_locations[i] = (w_loc.x, w_loc.y)
+
+        throttle, brake, steer = self.pid_control(
+            target_speeds, current_speeds, ego_locations, ego_forwards, target_locations)
+
+        controls = []
+        for i in range(self.size):
+            control = carla.VehicleControl()
+            control.throttle = float(throttle[i])
+            control.brake = float(brake[i])
+            control.steer = float(steer[i])
+            control.hand_brake = False
+            control.manual_gear_shift = False
+            controls.append(control)
+
+        return controls
+
+    def pid_control(self, target_speeds, current_speeds, ego_locations, ego_forwards, target_locations):
+        """
+        Estimate the throttle, brake and steering of all the vehicles based on the PID equations.
+        The target locations are expected to already include the lateral offset.
+
+            :param target_speeds: array (N,) of desired speeds, in Km/h
+            :param current_speeds: array (N,) of current speeds, in Km/h
+            :param ego_locations: array (N, 2) with the x, y position of the vehicles
+            :param ego_forwards: array (N, 2) with the x, y components of the vehicles' forward vectors
+            :param target_locations: array (N, 2) with the x, y position of the targets
+            :return: tuple of arrays (N,) with the throttle, brake and steering
+        """
+        ego_locations = np.asarray(ego_locations, dtype=np.float64)
+        ego_forwards = np.asarray(ego_forwards, dtype=np.float64)
+        target_locations = np.asarray(target_locations, dtype=np.float64)
+
+        # Longitudinal error
+        lon_error = np.asarray(target_speeds, dtype=np.float64) - np.asarray(current_speeds, dtype=np.float64)
+
+        # Lateral error: signed angle between the forward vector and the vehicle-target vector
+        w_vec = target_locations - ego_locations
+        wv_linalg = np.sqrt(np.einsum('ij,ij->i', w_vec, w_vec)) * \
+            np.sqrt(np.einsum('ij,ij->i', ego_forwards, ego_forwards))
+        wv_dot = np.einsum('ij,ij->i', w_vec, ego_forwards)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lat_error = np.arccos(np.clip(wv_dot / wv_linalg, -1.0, 1.0))
+        lat_error[wv_linalg == 0] = 1.0
+        cross = ego_forwards[:, 0] * w_vec[:, 1] - ego_forwards[:, 1] * w_vec[:, 0]
+        lat_error[cross < 0] *= -1.0
+
+        # Update the ring buffers
+        self._lon_buffer[self._rows, self._head] = lon_error
+        self._lat_buffer[self._rows, self._head] = lat_error
+        self._head = (self._head + 1) % self._buffer_length
+        self._count = np.minimum(self._count + 1, self._buffer_length)
+
+        acceleration = self._pid_terms(self._lon_buffer, self._lon_gains, lon_error)
+        current_steering = self._pid_terms(self._lat_buffer, self._lat_gains, lat_error)
+
+        throttle = np.where(acceleration >= 0.0, np.minimum(acceleration, self.max_throt), 0.0)
+        brake = np.where(acceleration >= 0.0, 0.0, np.minimum(-acceleration, self.max_brake))
+
+        # Steering regulation: changes cannot happen abruptly, can't steer too much.
+        steering = np.clip(current_steering, self.past_steering - 0.1, self.past_steering + 0.1)
+        steering = np.clip(steering, -self.max_steer, self.max_steer)
+        self.past_steering = steering
+
+        return throttle, brake, steering
+
+    def _pid_terms(self, buffer, gains, error):
+        """Computes the clipped output of the PID equations, with the buffers already updated"""
+        k_p, k_i, k_d, dt = gains[:, 0], gains[:, 1], gains[:, 2], gains[:, 3]
+
+        last = buffer[self._rows, (self._head - 1) % self._buffer_length]
+        previous = buffer[self._rows, (self._head - 2) % self._buffer_length]
+        active = self._count >= 2
+
+        _de = np.where(active, (last - previous) / dt, 0.0)
+        _ie = np.where(active, buffer.sum(axis=1) * dt, 0.0)
+
+        return np.clip((k_p * error) + (k_d * _de) + (k_i * _ie), -1.0, 1.0)
+
+
+def _pid_gains(K_P=1.0, K_I=0.0, K_D=0.0, dt=0.03):
+    """Packs the PID parameters, using the same defaults as the PID controllers"""
+    return (K_P, K_I, K_D, dt)
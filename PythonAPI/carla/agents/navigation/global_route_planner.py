@@ -15,6 +15,7 @@ import networkx as nx
 import carla
 from agents.navigation.local_planner import RoadOption
 from agents.tools.misc import vector
+from agents.tools.profiling import profiled
 
 class GlobalRoutePlanner(object):
     """
@@ -28,6 +29,7 @@ class GlobalRoutePlanner(object):
         self._graph = None
         self._id_map = None
         self._road_id_to_edge = None
+        self._lane_samples = dict()  # Map with structure {(n1, n2): (waypoints, locations, distances), ... }
 
         self._intersection_end_node = -1
         self._previous_decision = RoadOption.VOID
@@ -38,6 +40,7 @@ class GlobalRoutePlanner(object):
         self._find_loose_ends()
         self._lane_change_link()
 
+    @profiled('global_planner.trace_route')
     def trace_route(self, origin, destination):
         """
         This method returns list of (carla.Waypoint, RoadOption)
@@ -81,6 +84,59 @@ class GlobalRoutePlanner(object):
 
         return route_trace
 
+    def get_lane_samples(self, waypoint):
+        """
+        Returns the waypoints sampled along the lane segment of the graph that contains a waypoint,
+        ordered in the driving direction, together with their locations and the distance
+        along the segment. They are computed once per segment and cached.
+
+            :param waypoint (carla.Waypoint): waypoint of the lane
+            :return: tuple (list of carla.Waypoint, array (N, 3) of locations, array (N,) of distances),
+                or None if the lane is not part of the graph
+        """
+        edge = self._get_edge(waypoint)
+        if edge is None:
+            return None
+
+        samples = self._lane_samples.get(edge)
+        if samples is None:
+            edge_data = self._graph.edges[edge]
+            waypoints = [edge_data['entry_waypoint']] + edge_data['path']
+            if edge_data['exit_waypoint'] is not waypoints[-1]:
+                waypoints.append(edge_data['exit_waypoint'])
+            locations = np.array([
+                (w.transform.location.x, w.transform.location.y, w.transform.location.z) for w in waypoints])
+            distances = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(locations, axis=0), axis=1))))
+            samples = self._lane_samples[edge] = (waypoints, locations, distances)
+        return samples
+
+    def get_side_lane_samples(self, waypoint, road_option):
+        """
+        Returns the samples (see get_lane_samples) of the lane segment reached from the segment of a
+        waypoint through a lane change link of the graph.
+
+            :param waypoint (carla.Waypoint): waypoint of the lane
+            :param road_option (RoadOption): RoadOption.CHANGELANELEFT or RoadOption.CHANGELANERIGHT
+            :return: samples of the side lane, or None if the graph has no such link
+        """
+        edge = self._get_edge(waypoint)
+        if edge is None:
+            return None
+        for _, _, data in self._graph.out_edges(edge[0], data=True):
+            if data['type'] == road_option:
+                return self.get_lane_samples(data['exit_waypoint'])
+        return None
+
+    def _get_edge(self, waypoint):
+        """
+        Returns the edge of the graph of the lane segment of a waypoint, or None
+        """
+        try:
+            edge = self._road_id_to_edge[waypoint.road_id][waypoint.section_id][waypoint.lane_id]
+        except KeyError:
+            return None
+        return edge if self._graph.has_edge(*edge) else None
+
     def _build_topology(self):
         """
         This function retrieves topology from the server as a list of
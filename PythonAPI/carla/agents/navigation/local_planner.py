@@ -7,11 +7,19 @@
 
 from enum import IntEnum
 from collections import deque
-import random
+from itertools import islice
+import weakref
+import numpy as np
 
 import carla
 from agents.navigation.controller import VehiclePIDController
-from agents.tools.misc import draw_waypoints, get_speed
+from agents.tools.map_cache import CachedMap
+from agents.tools.misc import draw_waypoints, get_speed, random_choice
+from agents.tools.profiling import profiled
+
+# Road options of the branches of each junction, shared by all the planners of the same map instance
+# and dropped with it. Structure {map: {(junction_id, road_id, lane_id, branches): [RoadOption, ...]}}
+_junction_options_cache = weakref.WeakKeyDictionary()
 
 
 class RoadOption(IntEnum):
@@ -28,6 +36,69 @@ class RoadOption(IntEnum):
     CHANGELANERIGHT = 6
 
 
+class _LocationBuffer(object):
+    """
+    Growable array with the locations of the waypoints in the local planner's queue,
+    kept aligned with it so that distance checks over the plan can be vectorized.
+    """
+
+    def __init__(self, capacity=128):
+        self._data = np.empty((capacity, 3), dtype=np.float64)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def append(self, location):
+        """Adds a carla.Location at the end of the buffer"""
+        if self._end == len(self._data):
+            self._reserve(1)
+        self._data[self._end] = (location.x, location.y, location.z)
+        self._end += 1
+
+    def popleft(self, num_elements):
+        """Removes the given amount of elements from the front of the buffer"""
+        self._start = min(self._start + num_elements, self._end)
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def replace_front(self, num_elements, locations):
+        """Replaces the given amount of elements at the front of the buffer by a list of carla.Location"""
+        start = self._start + min(num_elements, len(self))
+        if start < len(locations):
+            # Not enough room before the kept elements, move them back leaving some for later calls
+            size = self._end - start
+            offset = 2 * len(locations)
+            data = np.empty((max(len(self._data), offset + size), 3), dtype=np.float64)
+            data[offset:offset + size] = self._data[start:self._end]
+            self._data = data
+            start = offset
+            self._end = offset + size
+        self._start = start - len(locations)
+        self._data[self._start:start] = [(l.x, l.y, l.z) for l in locations]
+
+    def clear(self):
+        """Removes all the elements"""
+        self._start = self._end = 0
+
+    def window(self, begin, end):
+        """Returns a view of the elements between positions [begin, end)"""
+        return self._data[self._start + begin:min(self._start + end, self._end)]
+
+    def _reserve(self, num_elements):
+        """Makes room for new elements, compacting the buffer and growing it if needed"""
+        size = len(self)
+        capacity = len(self._data)
+        if size + num_elements > capacity // 2:
+            capacity = max(2 * capacity, size + num_elements)
+        data = np.empty((capacity, 3), dtype=np.float64)
+        data[:size] = self._data[self._start:self._end]
+        self._data = data
+        self._start = 0
+        self._end = size
+
+
 class LocalPlanner(object):
     """
     LocalPlanner implements the basic behavior of following a
@@ -53,15 +124,19 @@ class LocalPlanner(object):
             max_brake: maximum brake applied to the vehicle
             max_steering: maximum steering applied to the vehicle
             offset: distance between the route waypoints and the center of the lane
+            waypoints_per_tick: maximum amount of random waypoints added to the queue at each step
+            random_generator: random.Random or numpy.random.Generator used for the random choices
+                at junctions. If not given, the global random module is used
         :param map_inst: carla.Map instance to avoid the expensive call of getting it.
+            A CachedMap can be used instead, to share the waypoint queries between agents.
         """
         self._vehicle = vehicle
         self._world = self._vehicle.get_world()
         if map_inst:
-            if isinstance(map_inst, carla.Map):
+            if isinstance(map_inst, (carla.Map, CachedMap)):
                 self._map = map_inst
             else:
-                print("Warning: Ignoring the given map as it is not a 'carla.Map'")
+                print("Warning: Ignoring the given map as it is not a 'carla.Map' or 'CachedMap'")
                 self._map = self._world.get_map()
         else:
             self._map = self._world.get_map()
@@ -71,8 +146,12 @@ class LocalPlanner(object):
         self.target_road_option = None
 
         self._waypoints_queue = deque(maxlen=10000)
+        self._waypoints_locations = _LocationBuffer()
+        self._purge_window = 16
         self._min_waypoint_queue_length = 100
+        self._waypoints_per_tick = 10
         self._stop_waypoint_creation = False
+        self._pending_plan = None  # (future, stop_waypoint_creation, clean_queue) of a plan being computed
 
         # Base parameters
         self._dt = 1.0 / 20.0
@@ -87,6 +166,7 @@ class LocalPlanner(object):
         self._base_min_distance = 3.0
         self._distance_ratio = 0.5
         self._follow_speed_limits = False
+        self._random_generator = None
 
         # Overload parameters
         if opt_dict:
@@ -114,6 +194,12 @@ class LocalPlanner(object):
                 self._distance_ratio = opt_dict['distance_ratio']
             if 'follow_speed_limits' in opt_dict:
                 self._follow_speed_limits = opt_dict['follow_speed_limits']
+            if 'waypoints_per_tick' in opt_dict:
+                self._waypoints_per_tick = opt_dict['waypoints_per_tick']
+            if 'random_generator' in opt_dict:
+                self._random_generator = opt_dict['random_generator']
+
+        self._junction_options = _get_junction_options(self._map)
 
         # initializing controller
         self._init_controller()
@@ -136,6 +222,7 @@ class LocalPlanner(object):
         current_waypoint = self._map.get_waypoint(self._vehicle.get_location())
         self.target_waypoint, self.target_road_option = (current_waypoint, RoadOption.LANEFOLLOW)
         self._waypoints_queue.append((self.target_waypoint, self.target_road_option))
+        self._waypoints_locations.append(self.target_waypoint.transform.location)
 
     def set_speed(self, speed):
         """
@@ -181,13 +268,31 @@ class LocalPlanner(object):
                 road_option = RoadOption.LANEFOLLOW
             else:
                 # random choice between the possible options
-                road_options_list = _retrieve_options(
-                    next_waypoints, last_waypoint)
-                road_option = random.choice(road_options_list)
+                road_options_list = self._get_junction_options(next_waypoints, last_waypoint)
+                road_option = random_choice(road_options_list, self._random_generator)
                 next_waypoint = next_waypoints[road_options_list.index(
                     road_option)]
 
             self._waypoints_queue.append((next_waypoint, road_option))
+            self._waypoints_locations.append(next_waypoint.transform.location)
+
+    def _get_junction_options(self, next_waypoints, last_waypoint):
+        """
+        Returns the road options of the branches starting at last_waypoint. These are cached per
+        junction and incoming lane, as computing them requires querying the map for every branch.
+
+        :param next_waypoints: list with the possible target waypoints
+        :param last_waypoint: current active waypoint
+        :return: list of RoadOption enums, one per element of next_waypoints
+        """
+        branches = tuple((w.road_id, w.section_id, w.lane_id) for w in next_waypoints)
+        key = (next_waypoints[0].junction_id, last_waypoint.road_id, last_waypoint.lane_id, branches)
+
+        road_options_list = self._junction_options.get(key)
+        if road_options_list is None:
+            road_options_list = _retrieve_options(next_waypoints, last_waypoint)
+            self._junction_options[key] = road_options_list
+        return road_options_list
 
     def set_global_plan(self, current_plan, stop_waypoint_creation=True, clean_queue=True):
         """
@@ -200,8 +305,10 @@ class LocalPlanner(object):
         :param clean_queue: bool
         :return:
         """
+        self._pending_plan = None
         if clean_queue:
             self._waypoints_queue.clear()
+            self._waypoints_locations.clear()
 
         # Remake the waypoints queue if the new plan has a higher length than the queue
         new_plan_length = len(current_plan) + len(self._waypoints_queue)
@@ -213,13 +320,119 @@ class LocalPlanner(object):
 
         for elem in current_plan:
             self._waypoints_queue.append(elem)
+            self._waypoints_locations.append(elem[0].transform.location)
 
         self._stop_waypoint_creation = stop_waypoint_creation
 
+    def set_global_plan_async(self, future_plan, stop_waypoint_creation=True, clean_queue=True):
+        """
+        Adds a plan that is still being computed, such as the future returned by a RoutePlanningService.
+        The current plan is followed until the new one is ready, and then swapped at the beginning of
+        a step. The waypoints of the new plan left behind by the vehicle in the meantime are skipped.
+        Any later call to set_global_plan discards it.
+
+        :param future_plan: concurrent.futures.Future with a list of (carla.Waypoint, RoadOption)
+        :param stop_waypoint_creation: bool
+        :param clean_queue: bool
+        :return:
+        """
+        if self._pending_plan is not None:
+            self._pending_plan[0].cancel()
+        self._pending_plan = (future_plan, stop_waypoint_creation, clean_queue)
+
+    def has_pending_plan(self):
+        """Returns whether a plan given to set_global_plan_async has not been swapped in yet"""
+        return self._pending_plan is not None
+
+    def _swap_pending_plan(self):
+        future_plan, stop_waypoint_creation, clean_queue = self._pending_plan
+        self._pending_plan = None
+        try:
+            plan = future_plan.result()
+        except Exception as error:  # pylint: disable=broad-except
+            print("Warning: Ignoring the plan as it could not be computed: {}".format(error))
+            return
+
+        if clean_queue and plan:
+            # Skip the waypoints the vehicle has already passed while the plan was computed
+            veh_location = self._vehicle.get_location()
+            head = plan[:self._purge_window * 4]
+            diff = np.array([(w.transform.location.x, w.transform.location.y, w.transform.location.z)
+                             for w, _ in head]) - (veh_location.x, veh_location.y, veh_location.z)
+            plan = plan[int(np.argmin(np.einsum('ij,ij->i', diff, diff))):]
+
+        self.set_global_plan(plan, stop_waypoint_creation, clean_queue)
+
+    def splice_plan(self, current_plan, rejoin_distance=0.0):
+        """
+        Replaces the beginning of the plan with a new one, such as a lane change maneuver, without
+        computing the route again. Only a window at the front of the queue, as long as the new plan
+        and the rejoin distance, is searched and replaced:
+            - if the new plan ends on the queued route, the queue is kept after that point.
+            - otherwise, if it ends next to it, as after a lane change, the vehicle moves back to the
+              queued route, joining it 'rejoin_distance' meters later.
+        If the new plan leaves the queued route, the whole queue is replaced.
+
+        :param current_plan: list of (carla.Waypoint, RoadOption)
+        :param rejoin_distance: length of the maneuver back to the queued route
+        :return:
+        """
+        end_wp = current_plan[-1][0]
+        end_loc = end_wp.transform.location
+        plan_locations = np.array([(w.transform.location.x, w.transform.location.y, w.transform.location.z)
+                                   for w, _ in current_plan])
+        plan_length = np.linalg.norm(np.diff(plan_locations, axis=0), axis=1).sum()
+
+        window_size = 2 * int(np.ceil((plan_length + rejoin_distance) / self._sampling_radius)) + 2
+        window = self._waypoints_locations.window(0, window_size)
+        head = list(islice(self._waypoints_queue, len(window)))
+        diff = window - (end_loc.x, end_loc.y, end_loc.z)
+        distances = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+        num_replaced = None
+        on_lane = [i for i, (w, _) in enumerate(head) if distances[i] < self._sampling_radius
+                   and w.road_id == end_wp.road_id and w.lane_id == end_wp.lane_id]
+        if on_lane:
+            num_replaced = min(on_lane, key=lambda i: distances[i]) + 1
+        elif head:
+            closest = int(np.argmin(distances))
+            if distances[closest] < end_wp.lane_width + self._sampling_radius:
+                # Join the queued route rejoin_distance after the waypoint next to the end of the plan
+                steps = np.linalg.norm(np.diff(window[closest:], axis=0), axis=1)
+                traveled = np.concatenate(([0.0], np.cumsum(steps)))
+                rejoin = closest + int(np.searchsorted(traveled, rejoin_distance))
+                if rejoin >= len(head) and len(head) == len(self._waypoints_queue):
+                    # The route ends before, join it at its last waypoint if it is still ahead
+                    rejoin = len(head) - 1 if closest < len(head) - 1 else len(head)
+                if rejoin < len(head):
+                    change_options = [o for _, o in current_plan
+                                      if o in (RoadOption.CHANGELANELEFT, RoadOption.CHANGELANERIGHT)]
+                    option = RoadOption.LANEFOLLOW
+                    if change_options:
+                        option = RoadOption.CHANGELANERIGHT if change_options[-1] == RoadOption.CHANGELANELEFT \
+                            else RoadOption.CHANGELANELEFT
+                    current_plan = current_plan + [(head[rejoin][0], option)]
+                    num_replaced = rejoin + 1
+
+        if num_replaced is None:
+            pending_plan = self._pending_plan
+            self.set_global_plan(current_plan, self._stop_waypoint_creation)
+            self._pending_plan = pending_plan
+            return
+
+        if len(self._waypoints_queue) - num_replaced + len(current_plan) > self._waypoints_queue.maxlen:
+            self._waypoints_queue = deque(self._waypoints_queue, maxlen=2 * self._waypoints_queue.maxlen
+                                          + len(current_plan))
+        for _ in range(num_replaced):
+            self._waypoints_queue.popleft()
+        self._waypoints_queue.extendleft(reversed(current_plan))
+        self._waypoints_locations.replace_front(num_replaced, [w.transform.location for w, _ in current_plan])
+
     def set_offset(self, offset):
         """Sets an offset for the vehicle"""
         self._vehicle_controller.set_offset(offset)
 
+    @profiled('local_planner.run_step')
     def run_step(self, debug=False):
         """
         Execute one step of local planning which involves running the longitudinal and lateral PID controllers to
@@ -231,31 +444,25 @@ class LocalPlanner(object):
         if self._follow_speed_limits:
             self._target_speed = self._vehicle.get_speed_limit()
 
-        # Add more waypoints too few in the horizon
+        if self._pending_plan is not None and self._pending_plan[0].done():
+            self._swap_pending_plan()
+
+        # Add more waypoints too few in the horizon. Only a few are added each step so that
+        # the cost of extending the horizon is spread over several ticks
         if not self._stop_waypoint_creation and len(self._waypoints_queue) < self._min_waypoint_queue_length:
-            self._compute_next_waypoints(k=self._min_waypoint_queue_length)
+            missing = self._min_waypoint_queue_length - len(self._waypoints_queue)
+            self._compute_next_waypoints(k=min(missing, self._waypoints_per_tick))
 
         # Purge the queue of obsolete waypoints
         veh_location = self._vehicle.get_location()
         vehicle_speed = get_speed(self._vehicle) / 3.6
         self._min_distance = self._base_min_distance + self._distance_ratio * vehicle_speed
 
-        num_waypoint_removed = 0
-        for waypoint, _ in self._waypoints_queue:
-
-            if len(self._waypoints_queue) - num_waypoint_removed == 1:
-                min_distance = 1  # Don't remove the last waypoint until very close by
-            else:
-                min_distance = self._min_distance
-
-            if veh_location.distance(waypoint.transform.location) < min_distance:
-                num_waypoint_removed += 1
-            else:
-                break
-
+        num_waypoint_removed = self._get_num_obsolete_waypoints(veh_location)
         if num_waypoint_removed > 0:
             for _ in range(num_waypoint_removed):
                 self._waypoints_queue.popleft()
+            self._waypoints_locations.popleft(num_waypoint_removed)
 
         # Get the target waypoint and move using the PID controllers. Stop if no target waypoint
         if len(self._waypoints_queue) == 0:
@@ -274,6 +481,38 @@ class LocalPlanner(object):
 
         return control
 
+    def _get_num_obsolete_waypoints(self, veh_location):
+        """
+        Returns the amount of waypoints at the front of the queue that are closer to the vehicle than
+        the minimum distance. The distances are checked in windows of '_purge_window' waypoints at a time.
+
+        :param veh_location: current location of the vehicle
+        :return: amount of waypoints to remove
+        """
+        # Both structures are kept aligned, but never read past the end of any of them
+        queue_length = min(len(self._waypoints_queue), len(self._waypoints_locations))
+        veh_array = np.array([veh_location.x, veh_location.y, veh_location.z])
+
+        num_waypoint_removed = 0
+        while num_waypoint_removed < queue_length:
+            window = self._waypoints_locations.window(
+                num_waypoint_removed, min(num_waypoint_removed + self._purge_window, queue_length))
+            if len(window) == 0:
+                break
+            diff = window - veh_array
+            distances = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+            min_distances = np.full(len(window), self._min_distance)
+            if num_waypoint_removed + len(window) == queue_length:
+                min_distances[-1] = 1  # Don't remove the last waypoint until very close by
+
+            far_waypoints = np.flatnonzero(distances >= min_distances)
+            if far_waypoints.size > 0:
+                return num_waypoint_removed + int(far_waypoints[0])
+            num_waypoint_removed += len(window)
+
+        return num_waypoint_removed
+
     def get_incoming_waypoint_and_direction(self, steps=3):
         """
         Returns direction and waypoint at a distance ahead defined by the user.
@@ -303,6 +542,20 @@ class LocalPlanner(object):
         return len(self._waypoints_queue) == 0
 
 
+def _get_junction_options(carla_map):
+    """
+    Returns the cache of the road options of the junctions of a map (see _junction_options_cache).
+
+    :param carla_map: carla.Map or CachedMap
+    :return: dictionary {(junction_id, road_id, lane_id, branches): [RoadOption, ...]}
+    """
+    try:
+        return _junction_options_cache.setdefault(carla_map, {})
+    except TypeError:
+        # The map can not be weakly referenced, so the cache is only used by this planner
+        return {}
+
+
 def _retrieve_options(list_waypoints, current_waypoint):
     """
     Compute the type of connection between the current active waypoint and the multiple waypoints present in
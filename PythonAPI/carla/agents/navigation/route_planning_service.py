@@ -0,0 +1,68 @@
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides RoutePlanningService, which computes routes in a background thread.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+
+class RoutePlanningService(object):
+    """
+    Background worker holding a GlobalRoutePlanner shared by several agents. Route requests
+    return a concurrent.futures.Future, so that the control loop keeps running while the
+    route is computed. The planner keeps state between calls to trace_route, so requests are
+    served one at a time, and synchronous calls through this service wait for the worker.
+
+    A thread is used instead of a process pool as the planner and the waypoints it returns
+    reference the client-side map, which can not be sent to other processes.
+    """
+
+    def __init__(self, global_planner):
+        """
+            :param global_planner: GlobalRoutePlanner used to compute the routes
+        """
+        self._global_planner = global_planner
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    @property
+    def global_planner(self):
+        """The GlobalRoutePlanner of the service"""
+        return self._global_planner
+
+    def submit(self, origin, destination):
+        """
+        Requests a route, computed in the background.
+
+            :param origin (carla.Location): starting location of the route
+            :param destination (carla.Location): final location of the route
+            :return: concurrent.futures.Future with the list of (carla.Waypoint, RoadOption)
+        """
+        return self._executor.submit(self.trace_route, origin, destination)
+
+    def trace_route(self, origin, destination):
+        """
+        Computes a route in the calling thread, waiting for the request being served, if any.
+
+            :param origin (carla.Location): starting location of the route
+            :param destination (carla.Location): final location of the route
+            :return: list of (carla.Waypoint, RoadOption)
+        """
+        with self._lock:
+            return self._global_planner.trace_route(origin, destination)
+
+    def shutdown(self, wait=True):
+        """Stops the worker, after serving the pending requests if `wait` is True"""
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,111 @@
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides CachedMap, a memoizing wrapper of carla.Map meant to be shared by all the agents
+of a simulation. It can be given to the agents and the planners as their `map_inst`.
+"""
+
+from collections import OrderedDict
+import threading
+
+import carla
+
+
+class CachedMap(object):
+    """
+    Wrapper of carla.Map that memoizes the results of get_waypoint. Query locations are
+    quantized to a grid of `resolution` meters, so queries falling in the same cell reuse
+    the waypoint of the first one. The cache keeps the `max_size` most recently used entries.
+    All the other attributes are forwarded to the wrapped map.
+
+    The cache can be shared between threads, e.g. with a RoutePlanningService. The map is queried
+    outside of the lock, so two threads missing the same cell at once may both query it.
+    """
+
+    def __init__(self, carla_map, resolution=0.1, max_size=10000):
+        """
+            :param carla_map: carla.Map to wrap
+            :param resolution: size in meters of the quantization grid of the query locations
+            :param max_size: maximum number of cached queries
+        """
+        self._map = carla_map
+        self._resolution = resolution
+        self._max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        if name == '_map':
+            raise AttributeError(name)
+        return getattr(self._map, name)
+
+    @property
+    def map(self):
+        """The wrapped carla.Map"""
+        return self._map
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=carla.LaneType.Driving):
+        """
+        Memoized carla.Map.get_waypoint.
+
+            :param location: carla.Location to query
+            :param project_to_road: if True, the waypoint of the closest lane is returned
+            :param lane_type: types of lane the waypoint can belong to
+            :return: carla.Waypoint, or None if no waypoint was found
+        """
+        key = (self._quantize(location), project_to_road, lane_type)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+
+        waypoint = self._map.get_waypoint(location, project_to_road=project_to_road, lane_type=lane_type)
+        with self._lock:
+            self._cache[key] = waypoint
+            self._cache.move_to_end(key)
+            if len(self._cache) > self._max_size:
+                self._cache.popitem(last=False)
+        return waypoint
+
+    def get_lane(self, location, lane_type=carla.LaneType.Driving):
+        """
+        Returns the attributes of the lane closest to a location.
+
+            :param location: carla.Location to query
+            :param lane_type: types of lane to consider
+            :return: tuple (road_id, section_id, lane_id, lane_width, is_junction)
+        """
+        waypoint = self.get_waypoint(location, lane_type=lane_type)
+        return (waypoint.road_id, waypoint.section_id, waypoint.lane_id, waypoint.lane_width, waypoint.is_junction)
+
+    def stats(self):
+        """Returns a dictionary with the hits, misses, hit rate and size of the cache"""
+        with self._lock:
+            queries = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / queries if queries else 0.0,
+                'size': len(self._cache)
+            }
+
+    def clear(self):
+        """Empties the cache and resets the statistics"""
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _quantize(self, location):
+        resolution = self._resolution
+        return (int(round(location.x / resolution)),
+                int(round(location.y / resolution)),
+                int(round(location.z / resolution)))
@@ -9,9 +9,12 @@
 """ Module with auxiliary functions. """
 
 import math
+import random
 import numpy as np
 import carla
 
+_EPSILON = np.finfo(float).eps
+
 def draw_waypoints(world, waypoints, z=0.5):
     """
     Draw a list of waypoints at a certain height given in z.
@@ -75,11 +78,9 @@ def is_within_distance(target_transform, reference_transform, max_distance, angl
     :param angle_interval: only locations between [min, max] angles will be considered. This isn't checked by default.
     :return: boolean
     """
-    target_vector = np.array([
-        target_transform.location.x - reference_transform.location.x,
-        target_transform.location.y - reference_transform.location.y
-    ])
-    norm_target = np.linalg.norm(target_vector)
+    target_x = target_transform.location.x - reference_transform.location.x
+    target_y = target_transform.location.y - reference_transform.location.y
+    norm_target = math.sqrt(target_x * target_x + target_y * target_y)
 
     # If the vector is too short, we can simply stop here
     if norm_target < 0.001:
@@ -97,8 +98,8 @@ def is_within_distance(target_transform, reference_transform, max_distance, angl
     max_angle = angle_interval[1]
 
     fwd = reference_transform.get_forward_vector()
-    forward_vector = np.array([fwd.x, fwd.y])
-    angle = math.degrees(math.acos(np.clip(np.dot(forward_vector, target_vector) / norm_target, -1., 1.)))
+    cos_angle = (fwd.x * target_x + fwd.y * target_y) / norm_target
+    angle = math.degrees(math.acos(max(-1., min(1., cos_angle))))
 
     return min_angle < angle < max_angle
 
@@ -112,11 +113,16 @@ def compute_magnitude_angle(target_location, current_location, orientation):
         :param orientation: orientation of the reference object
         :return: a tuple composed by the distance to the object and the angle between both objects
     """
-    target_vector = np.array([target_location.x - current_location.x, target_location.y - current_location.y])
-    norm_target = np.linalg.norm(target_vector)
+    target_x = target_location.x - current_location.x
+    target_y = target_location.y - current_location.y
+    norm_target = math.sqrt(target_x * target_x + target_y * target_y)
+
+    if norm_target == 0:
+        return (norm_target, float('nan'))
 
-    forward_vector = np.array([math.cos(math.radians(orientation)), math.sin(math.radians(orientation))])
-    d_angle = math.degrees(math.acos(np.clip(np.dot(forward_vector, target_vector) / norm_target, -1., 1.)))
+    orientation = math.radians(orientation)
+    cos_angle = (math.cos(orientation) * target_x + math.sin(orientation) * target_y) / norm_target
+    d_angle = math.degrees(math.acos(max(-1., min(1., cos_angle))))
 
     return (norm_target, d_angle)
 
@@ -144,7 +150,7 @@ def vector(location_1, location_2):
     x = location_2.x - location_1.x
     y = location_2.y - location_1.y
     z = location_2.z - location_1.z
-    norm = np.linalg.norm([x, y, z]) + np.finfo(float).eps
+    norm = math.sqrt(x * x + y * y + z * z) + _EPSILON
 
     return [x / norm, y / norm, z / norm]
 
@@ -158,10 +164,134 @@ def compute_distance(location_1, location_2):
     x = location_2.x - location_1.x
     y = location_2.y - location_1.y
     z = location_2.z - location_1.z
-    norm = np.linalg.norm([x, y, z]) + np.finfo(float).eps
+    norm = math.sqrt(x * x + y * y + z * z) + _EPSILON
     return norm
 
 
+def compute_corridor_intervals(positions, velocities, corridor_start, corridor_end, half_width, horizon):
+    """
+    Rolls forward a set of positions at constant velocity, computing when each of them is inside
+    a straight corridor within a time horizon. Positions and velocities are expressed in the frame
+    of the reference, with x pointing forward, and the corridor spans [corridor_start, corridor_end]
+    along x and [-half_width, half_width] along y.
+
+        :param positions: array (N, 2) of positions relative to the reference
+        :param velocities: array (N, 2) of velocities relative to the reference
+        :param corridor_start: start of the corridor along x
+        :param corridor_end: end of the corridor along x
+        :param half_width: half of the width of the corridor
+        :param horizon: time horizon in seconds
+        :return: tuple with the arrays (N,) of times at which each position enters and exits the
+            corridor. Positions never inside of it have an entry time later than the exit time.
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    velocities = np.asarray(velocities, dtype=np.float64).reshape(-1, 2)
+    lower = np.array([corridor_start, -half_width])
+    upper = np.array([corridor_end, half_width])
+
+    # Interval of each axis, either always or never inside if there is no motion along it
+    moving = velocities != 0.0
+    inside = (positions >= lower) & (positions <= upper)
+    speeds = np.where(moving, velocities, 1.0)
+    to_lower = (lower - positions) / speeds
+    to_upper = (upper - positions) / speeds
+    enter = np.where(moving, np.minimum(to_lower, to_upper), np.where(inside, -np.inf, np.inf))
+    exit_ = np.where(moving, np.maximum(to_lower, to_upper), np.where(inside, np.inf, -np.inf))
+
+    return np.maximum(enter.max(axis=1), 0.0), np.minimum(exit_.min(axis=1), horizon)
+
+
+def locations_to_array(locations):
+    """
+    Converts an iterable of carla.Location (or any object with x, y, z attributes)
+    into a numpy array of shape (N, 3), to be used by the batch functions.
+
+        :param locations: iterable of locations
+    """
+    return np.array([(l.x, l.y, l.z) for l in locations], dtype=np.float64).reshape(-1, 3)
+
+
+def is_within_distance_batch(target_locations, reference_transform, max_distance, angle_interval=None):
+    """
+    Batch version of is_within_distance, checking N target locations against one reference.
+
+    :param target_locations: array (N, 2) or (N, 3) with the location of the target objects
+    :param reference_transform: location of the reference object
+    :param max_distance: maximum allowed distance
+    :param angle_interval: only locations between [min, max] angles will be considered. This isn't checked by default.
+    :return: boolean array (N,)
+    """
+    target_vectors = np.asarray(target_locations, dtype=np.float64)[:, :2] - \
+        (reference_transform.location.x, reference_transform.location.y)
+    norm_target = np.sqrt(np.einsum('ij,ij->i', target_vectors, target_vectors))
+
+    within = norm_target <= max_distance
+    if angle_interval:
+        fwd = reference_transform.get_forward_vector()
+        cos_angle = np.divide(target_vectors @ (fwd.x, fwd.y), norm_target,
+                              out=np.zeros_like(norm_target), where=norm_target > 0)
+        angle = np.degrees(np.arccos(np.clip(cos_angle, -1., 1.)))
+        within &= (angle_interval[0] < angle) & (angle < angle_interval[1])
+
+    # If the vector is too short, the location is always considered within distance
+    return within | (norm_target < 0.001)
+
+
+def compute_magnitude_angle_batch(target_locations, current_location, orientation):
+    """
+    Batch version of compute_magnitude_angle, for N target locations against one reference.
+
+        :param target_locations: array (N, 2) or (N, 3) with the location of the target objects
+        :param current_location: location of the reference object
+        :param orientation: orientation of the reference object
+        :return: a tuple composed by the arrays (N,) of distances and angles
+    """
+    target_vectors = np.asarray(target_locations, dtype=np.float64)[:, :2] - (current_location.x, current_location.y)
+    norm_target = np.sqrt(np.einsum('ij,ij->i', target_vectors, target_vectors))
+
+    orientation = math.radians(orientation)
+    cos_angle = target_vectors @ (math.cos(orientation), math.sin(orientation))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d_angle = np.degrees(np.arccos(np.clip(cos_angle / norm_target, -1., 1.)))
+
+    return (norm_target, d_angle)
+
+
+def distance_vehicle_batch(waypoint_locations, vehicle_transform):
+    """
+    Batch version of distance_vehicle, returning the 2D distance from N waypoints to a vehicle
+
+        :param waypoint_locations: array (N, 2) or (N, 3) with the location of the waypoints
+        :param vehicle_transform: transform of the target vehicle
+    """
+    loc = vehicle_transform.location
+    diff = np.asarray(waypoint_locations, dtype=np.float64)[:, :2] - (loc.x, loc.y)
+    return np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+
+def vector_batch(location_1, locations_2):
+    """
+    Batch version of vector, returning the unit vectors from location_1 to N locations
+
+        :param location_1: carla.Location object
+        :param locations_2: array (N, 3) with the target locations
+    """
+    diff = np.asarray(locations_2, dtype=np.float64) - (location_1.x, location_1.y, location_1.z)
+    norm = np.sqrt(np.einsum('ij,ij->i', diff, diff)) + _EPSILON
+    return diff / norm[:, np.newaxis]
+
+
+def compute_distance_batch(location_1, locations_2):
+    """
+    Batch version of compute_distance, returning the euclidean distance from location_1 to N 3D points
+
+        :param location_1: 3D point
+        :param locations_2: array (N, 3) with the target points
+    """
+    diff = np.asarray(locations_2, dtype=np.float64) - (location_1.x, location_1.y, location_1.z)
+    return np.sqrt(np.einsum('ij,ij->i', diff, diff)) + _EPSILON
+
+
 def positive(num):
     """
     Return the given number if positive, else 0
@@ -169,3 +299,40 @@ def positive(num):
         :param num: value to check
     """
     return num if num > 0.0 else 0.0
+
+
+def random_choice(sequence, random_generator=None):
+    """
+    Return a random element of a non-empty sequence.
+
+        :param sequence: sequence from which the element is chosen
+        :param random_generator: random.Random or numpy.random.Generator used for the choice.
+            If None, the global random module is used
+    """
+    if random_generator is None:
+        random_generator = random
+    if isinstance(random_generator, np.random.Generator):
+        return sequence[int(random_generator.integers(len(sequence)))]
+    return random_generator.choice(sequence)
+
+
+def split_random_generators(seed, num_generators, use_numpy=False):
+    """
+    Creates independent random generators from a single seed, one per agent of a fleet.
+    The generators are derived using numpy's SeedSequence, so that their streams don't overlap
+    and the results are reproducible regardless of the order in which the agents run.
+
+        :param seed: seed of the fleet
+        :param num_generators: number of generators to create
+        :param use_numpy: if True, numpy.random.Generator are returned instead of random.Random
+        :return: list of random generators
+    """
+    children = np.random.SeedSequence(seed).spawn(num_generators)
+    if use_numpy:
+        return [np.random.default_rng(child) for child in children]
+
+    generators = []
+    for child in children:
+        state = child.generate_state(4, dtype=np.uint32)
+        generators.append(random.Random(int.from_bytes(state.tobytes(), 'little')))
+    return generators
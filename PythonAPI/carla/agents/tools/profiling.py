@@ -0,0 +1,286 @@
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Opt-in profiling of the agents. Phases are timed with the `profiled` decorator or the
+`profile_phase` context manager and recorded per agent, identified by the vehicle they control.
+Phases whose name starts with 'server.' are calls to the simulator, and are also counted as
+server round trips. Nothing is recorded until `enable` is called, and the disabled path
+costs a single attribute check.
+
+Usage:
+    from agents.tools import profiling
+    profiling.enable()
+    reporter = profiling.TickReporter(top=5)
+    while True:
+        world.tick()
+        for agent in agents:
+            vehicle.apply_control(agent.run_step())
+        reporter.tick()
+"""
+
+import functools
+import math
+import sys
+import time
+
+SERVER_PREFIX = 'server.'
+
+
+class Histogram(object):
+    """
+    Histogram of durations, with buckets whose upper bounds are powers of two microseconds.
+    """
+
+    NUM_BUCKETS = 32
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.buckets = [0] * self.NUM_BUCKETS
+
+    def add(self, seconds):
+        """Adds a duration, in seconds"""
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        _, exponent = math.frexp(seconds * 1e6)
+        self.buckets[min(max(exponent, 0), self.NUM_BUCKETS - 1)] += 1
+
+    def mean(self):
+        """Mean duration, in seconds"""
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        """
+        Approximate percentile, as the upper bound of the bucket that contains it, in seconds
+        """
+        if self.count == 0:
+            return 0.0
+        threshold = percent / 100.0 * self.count
+        accumulated = 0
+        for i, count in enumerate(self.buckets):
+            accumulated += count
+            if accumulated >= threshold:
+                return min(2.0 ** i * 1e-6, self.max)
+        return self.max
+
+
+class ProfileRegistry(object):
+    """
+    Stores a histogram per agent and phase, plus the durations of the current tick.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}  # {(owner, phase): Histogram}
+        self.tick_count = 0
+        self._tick = {}  # {(owner, phase): [seconds, calls]}
+
+    def record(self, owner, phase, seconds):
+        """
+        Records the duration of a phase.
+            :param owner: id of the agent, or None for shared components
+            :param phase: name of the phase
+            :param seconds: duration of the phase
+        """
+        key = (owner, phase)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.add(seconds)
+
+        entry = self._tick.get(key)
+        if entry is None:
+            self._tick[key] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def count_round_trips(self, owner, calls=1):
+        """Counts calls to the server that are not timed as a phase"""
+        key = (owner, SERVER_PREFIX + 'untimed')
+        entry = self._tick.get(key)
+        if entry is None:
+            self._tick[key] = [0.0, calls]
+        else:
+            entry[1] += calls
+
+    def end_tick(self):
+        """
+        Closes the current tick.
+            :return: list of (owner, phase, seconds, calls) of the tick, sorted by decreasing duration
+        """
+        entries = [(owner, phase, seconds, calls) for (owner, phase), (seconds, calls) in self._tick.items()]
+        entries.sort(key=lambda entry: entry[2], reverse=True)
+        self._tick = {}
+        self.tick_count += 1
+        return entries
+
+    def reset(self):
+        """Removes all the recorded data"""
+        self.histograms = {}
+        self.tick_count = 0
+        self._tick = {}
+
+
+_registry = ProfileRegistry()
+
+
+def get_registry():
+    """Returns the global profile registry"""
+    return _registry
+
+
+def enable(active=True):
+    """(De)activates the profiling of the agents"""
+    _registry.enabled = active
+
+
+def disable():
+    """Deactivates the profiling of the agents"""
+    _registry.enabled = False
+
+
+def is_enabled():
+    """Returns whether the profiling is active"""
+    return _registry.enabled
+
+
+def _owner_key(owner):
+    if owner is None:
+        return None
+    return getattr(owner, 'id', owner)
+
+
+def profiled(phase):
+    """
+    Decorator timing a method as a phase. The agent is identified by the `_vehicle`
+    attribute of the instance, if any.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            if not _registry.enabled:
+                return function(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(self, *args, **kwargs)
+            finally:
+                _registry.record(_owner_key(getattr(self, '_vehicle', None)), phase, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class _Phase(object):
+    __slots__ = ('_owner', '_phase', '_start')
+
+    def __init__(self, owner, phase):
+        self._owner = owner
+        self._phase = phase
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        _registry.record(_owner_key(self._owner), self._phase, time.perf_counter() - self._start)
+
+
+class _NullPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def profile_phase(owner, phase):
+    """
+    Context manager timing a block of code as a phase.
+        :param owner: vehicle of the agent, or None for shared components
+        :param phase: name of the phase, prefixed with 'server.' for calls to the simulator
+    """
+    if not _registry.enabled:
+        return _NULL_PHASE
+    return _Phase(owner, phase)
+
+
+def count_round_trips(owner, calls=1):
+    """Counts calls to the server made outside of a 'server.' phase"""
+    if _registry.enabled:
+        _registry.count_round_trips(_owner_key(owner), calls)
+
+
+def _owner_name(owner):
+    return 'shared' if owner is None else 'agent {}'.format(owner)
+
+
+class TickReporter(object):
+    """
+    Prints the phases that took the most time during each tick, and the server round
+    trips of each agent.
+    """
+
+    def __init__(self, registry=None, top=5, stream=None, min_duration=0.0):
+        """
+            :param registry: ProfileRegistry to report, by default the global one
+            :param top: number of phases printed per tick
+            :param stream: output stream, by default sys.stdout
+            :param min_duration: ticks whose slowest phase is below this duration, in seconds, are not printed
+        """
+        self._registry = registry if registry is not None else _registry
+        self._top = top
+        self._stream = stream
+        self._min_duration = min_duration
+
+    def tick(self):
+        """
+        Closes the tick of the registry and prints its top offenders.
+            :return: list of (owner, phase, seconds, calls) of the tick
+        """
+        tick = self._registry.tick_count
+        entries = self._registry.end_tick()
+        if not entries or entries[0][2] < self._min_duration:
+            return entries
+
+        stream = self._stream if self._stream is not None else sys.stdout
+        stream.write('[tick {}] top phases:\n'.format(tick))
+        for owner, phase, seconds, calls in entries[:self._top]:
+            stream.write('  {:<12} {:<32} {:9.3f} ms ({} calls)\n'.format(
+                _owner_name(owner), phase, seconds * 1e3, calls))
+
+        round_trips = {}
+        for owner, phase, _, calls in entries:
+            if phase.startswith(SERVER_PREFIX):
+                round_trips[owner] = round_trips.get(owner, 0) + calls
+        if round_trips:
+            stream.write('  server round trips: {}\n'.format(', '.join(
+                '{}: {}'.format(_owner_name(owner), calls) for owner, calls in sorted(
+                    round_trips.items(), key=lambda item: item[1], reverse=True))))
+        return entries
+
+    def summary(self):
+        """
+        Returns a table with the cumulated histograms, sorted by decreasing total time.
+        """
+        lines = ['{:<12} {:<32} {:>8} {:>11} {:>11} {:>11} {:>11}'.format(
+            'owner', 'phase', 'calls', 'total ms', 'mean ms', 'p95 ms', 'max ms')]
+        items = sorted(self._registry.histograms.items(), key=lambda item: item[1].total, reverse=True)
+        for (owner, phase), histogram in items:
+            lines.append('{:<12} {:<32} {:>8} {:>11.3f} {:>11.3f} {:>11.3f} {:>11.3f}'.format(
+                _owner_name(owner), phase, histogram.count, histogram.total * 1e3,
+                histogram.mean() * 1e3, histogram.percentile(95) * 1e3, histogram.max * 1e3))
+        return '\n'.join(lines)
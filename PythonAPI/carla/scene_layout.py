@@ -18,26 +18,97 @@ except IndexError:
     pass
 
 import carla
+import hashlib
+import json
+import math
 import random
 
+import numpy as np
 
-def get_scene_layout(carla_map):
+
+def get_scene_layout(carla_map, precision=0.05, cache_dir=None):
     """
     Function to extract the full scene layout to be used as a full scene description to be
     given to the user
+    :param carla_map: carla.Map to describe
+    :param precision: distance in meters between consecutive waypoints of a lane
+    :param cache_dir: if given, directory where the layout is cached, so that it is only computed once per map
     :return: a dictionary describing the scene.
     """
+    layout = get_scene_layout_arrays(carla_map, precision, cache_dir)
+
+    ids = layout["ids"].tolist()
+    road_ids = layout["road_ids"].tolist()
+    lane_ids = layout["lane_ids"].tolist()
+    positions = layout["positions"].tolist()
+    orientations = layout["orientations"].tolist()
+    left_margins = layout["left_margins"].tolist()
+    right_margins = layout["right_margins"].tolist()
+
+    def _link(index):
+        return ids[index] if index >= 0 else -1
+
+    waypoints_graph = dict()
+    for i, (next_i, left_i, right_i) in enumerate(zip(
+            layout["next"].tolist(), layout["left"].tolist(), layout["right"].tolist())):
+        waypoints_graph[ids[i]] = {
+            "road_id": road_ids[i],
+            "lane_id": lane_ids[i],
+            "position": positions[i],
+            "orientation": orientations[i],
+            "left_margin_position": left_margins[i],
+            "right_margin_position": right_margins[i],
+            "next_waypoint_id": _link(next_i),
+            "left_lane_waypoint_id": _link(left_i),
+            "right_lane_waypoint_id": _link(right_i)
+        }
+
+    return waypoints_graph
+
+
+def get_scene_layout_arrays(carla_map, precision=0.05, cache_dir=None):
+    """
+    Columnar version of get_scene_layout, where each waypoint of the layout is a row of the arrays.
+    Links between waypoints are stored as row indices, -1 meaning no link.
+    :param carla_map: carla.Map to describe
+    :param precision: distance in meters between consecutive waypoints of a lane
+    :param cache_dir: if given, directory where the layout is cached, so that it is only computed once per map
+    :return: a dictionary of numpy arrays with the following keys:
+        ids (N,): waypoint ids
+        road_ids, lane_ids (N,): road and lane of the waypoints
+        locations (N, 3): x, y, z of the waypoints
+        positions, left_margins, right_margins (N, 3): latitude, longitude and altitude
+            of the waypoints and of their lane margins
+        orientations (N, 3): roll, pitch and yaw of the waypoints
+        next, left, right (N,): index of the next waypoint of the lane and of the waypoints
+            of the left and right lanes
+    """
+    cache_file = None
+    if cache_dir is not None:
+        opendrive = carla_map.to_opendrive()
+        digest = hashlib.md5('{}:{}'.format(precision, opendrive).encode('utf-8')).hexdigest()
+        map_name = os.path.basename(carla_map.name)
+        cache_file = os.path.join(cache_dir, '{}_{}.npz'.format(map_name, digest))
+        if os.path.isfile(cache_file):
+            with np.load(cache_file) as data:
+                return {key: data[key] for key in data.files}
+
+    layout = _compute_scene_layout_arrays(carla_map, precision)
 
-    def _lateral_shift(transform, shift):
-        transform.rotation.yaw += 90
-        return transform.location + shift * transform.get_forward_vector()
+    if cache_file is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        np.savez_compressed(cache_file, **layout)
 
+    return layout
+
+
+def _compute_scene_layout_arrays(carla_map, precision):
     topology = [x[0] for x in carla_map.get_topology()]
     topology = sorted(topology, key=lambda w: w.transform.location.z)
 
     # A road contains a list of lanes, a each lane contains a list of waypoints
     map_dict = dict()
-    precision = 0.05
     for waypoint in topology:
         waypoints = [waypoint]
         nxt = waypoint.next(precision)
@@ -51,71 +122,161 @@ def get_scene_layout(carla_map):
                 else:
                     break
 
-        left_marking = [_lateral_shift(w.transform, -w.lane_width * 0.5) for w in waypoints]
-        right_marking = [_lateral_shift(w.transform, w.lane_width * 0.5) for w in waypoints]
-
-        lane = {
-            "waypoints": waypoints,
-            "left_marking": left_marking,
-            "right_marking": right_marking
-        }
-
         if map_dict.get(waypoint.road_id) is None:
             map_dict[waypoint.road_id] = {}
-        map_dict[waypoint.road_id][waypoint.lane_id] = lane
+        map_dict[waypoint.road_id][waypoint.lane_id] = waypoints
 
-    # Generate waypoints graph
-    waypoints_graph = dict()
+    # Index of the first waypoint of each lane
+    lane_start = dict()
+    num_waypoints = 0
     for road_key in map_dict:
         for lane_key in map_dict[road_key]:
-            # List of waypoints
-            lane = map_dict[road_key][lane_key]
-
-            for i in range(0, len(lane["waypoints"])):
-                next_ids = [w.id for w in lane["waypoints"][i + 1:len(lane["waypoints"])]]
-
-                # Get left and right lane keys
-                left_lane_key = lane_key - 1 if lane_key - 1 != 0 else lane_key - 2
-                right_lane_key = lane_key + 1 if lane_key + 1 != 0 else lane_key + 2
-
-                # Get left and right waypoint ids only if they are valid
-                left_lane_waypoint_id = -1
-                if left_lane_key in map_dict[road_key]:
-                    left_lane_waypoints = map_dict[road_key][left_lane_key]["waypoints"]
-                    if i < len(left_lane_waypoints):
-                        left_lane_waypoint_id = left_lane_waypoints[i].id
-
-                right_lane_waypoint_id = -1
-                if right_lane_key in map_dict[road_key]:
-                    right_lane_waypoints = map_dict[road_key][right_lane_key]["waypoints"]
-                    if i < len(right_lane_waypoints):
-                        right_lane_waypoint_id = right_lane_waypoints[i].id
-
-                # Get left and right margins (aka markings)
-                lm = carla_map.transform_to_geolocation(lane["left_marking"][i])
-                rm = carla_map.transform_to_geolocation(lane["right_marking"][i])
-
-                # Waypoint Position
-                wl = carla_map.transform_to_geolocation(lane["waypoints"][i].transform.location)
-
-                # Waypoint Orientation
-                wo = lane["waypoints"][i].transform.rotation
-
-                # Waypoint dict
-                waypoint_dict = {
-                    "road_id": road_key,
-                    "lane_id": lane_key,
-                    "position": [wl.latitude, wl.longitude, wl.altitude],
-                    "orientation": [wo.roll, wo.pitch, wo.yaw],
-                    "left_margin_position": [lm.latitude, lm.longitude, lm.altitude],
-                    "right_margin_position": [rm.latitude, rm.longitude, rm.altitude],
-                    "next_waypoints_ids": next_ids,
-                    "left_lane_waypoint_id": left_lane_waypoint_id,
-                    "right_lane_waypoint_id": right_lane_waypoint_id
-                }
-                waypoints_graph[map_dict[road_key][lane_key]["waypoints"][i].id] = waypoint_dict
+            lane_start[(road_key, lane_key)] = num_waypoints
+            num_waypoints += len(map_dict[road_key][lane_key])
 
-    return waypoints_graph
+    ids = np.empty(num_waypoints, dtype=np.uint64)
+    road_ids = np.empty(num_waypoints, dtype=np.int64)
+    lane_ids = np.empty(num_waypoints, dtype=np.int64)
+    transforms = np.empty((num_waypoints, 7), dtype=np.float64)  # x, y, z, roll, pitch, yaw, lane width
+    next_index = np.full(num_waypoints, -1, dtype=np.int64)
+    left_index = np.full(num_waypoints, -1, dtype=np.int64)
+    right_index = np.full(num_waypoints, -1, dtype=np.int64)
+
+    for road_key in map_dict:
+        for lane_key in map_dict[road_key]:
+            waypoints = map_dict[road_key][lane_key]
+            start = lane_start[(road_key, lane_key)]
+            end = start + len(waypoints)
+
+            for i, w in enumerate(waypoints):
+                t = w.transform
+                ids[start + i] = w.id
+                transforms[start + i] = (t.location.x, t.location.y, t.location.z,
+                                         t.rotation.roll, t.rotation.pitch, t.rotation.yaw, w.lane_width)
+            road_ids[start:end] = road_key
+            lane_ids[start:end] = lane_key
+            next_index[start:end - 1] = np.arange(start + 1, end)
+
+            # Get left and right waypoints only if they are valid
+            left_lane_key = lane_key - 1 if lane_key - 1 != 0 else lane_key - 2
+            right_lane_key = lane_key + 1 if lane_key + 1 != 0 else lane_key + 2
+            for side_key, side_index in ((left_lane_key, left_index), (right_lane_key, right_index)):
+                if side_key in map_dict[road_key]:
+                    side_start = lane_start[(road_key, side_key)]
+                    count = min(len(waypoints), len(map_dict[road_key][side_key]))
+                    side_index[start:start + count] = np.arange(side_start, side_start + count)
+
+    # Left and right margins (aka markings), displaced along the lateral vector of the waypoints
+    locations = transforms[:, 0:3]
+    pitch = np.radians(transforms[:, 4])
+    lateral_yaw = np.radians(transforms[:, 5] + 90)
+    lateral = np.stack([np.cos(lateral_yaw) * np.cos(pitch),
+                        np.sin(lateral_yaw) * np.cos(pitch),
+                        np.sin(pitch)], axis=1)
+    shift = (0.5 * transforms[:, 6])[:, np.newaxis] * lateral
+
+    geo_reference = GeoReference(carla_map)
+    geolocations = geo_reference.transform(np.stack([locations, locations - shift, locations + shift]))
+
+    return {
+        "ids": ids,
+        "road_ids": road_ids,
+        "lane_ids": lane_ids,
+        "locations": locations.copy(),
+        "positions": geolocations[0],
+        "left_margins": geolocations[1],
+        "right_margins": geolocations[2],
+        "orientations": transforms[:, 3:6].copy(),
+        "next": next_index,
+        "left": left_index,
+        "right": right_index
+    }
+
+
+class GeoReference(object):
+    """
+    Vectorized equivalent of carla.Map.transform_to_geolocation, converting many locations
+    to latitude, longitude and altitude at once using the geo-reference of the map.
+    """
+
+    EARTH_RADIUS_EQUA = 6378137.0
+
+    def __init__(self, carla_map):
+        origin = carla_map.transform_to_geolocation(carla.Location(0.0, 0.0, 0.0))
+        self.latitude = origin.latitude
+        self.longitude = origin.longitude
+        self.altitude = origin.altitude
+
+        # Mercator coordinates of the origin of the map
+        self._scale = math.cos(math.radians(self.latitude))
+        self._mx = self._scale * math.radians(self.longitude) * self.EARTH_RADIUS_EQUA
+        self._my = self._scale * self.EARTH_RADIUS_EQUA * math.log(
+            math.tan((90.0 + self.latitude) * math.pi / 360.0))
+
+    def transform(self, locations):
+        """
+        Converts locations to geolocations.
+        :param locations: array (..., 3) with x, y, z coordinates
+        :return: array (..., 3) with latitude, longitude and altitude
+        """
+        locations = np.asarray(locations, dtype=np.float64)
+        radius = self.EARTH_RADIUS_EQUA * self._scale
+
+        # The y axis is inverted to have increasing latitudes northward
+        mx = self._mx + locations[..., 0]
+        my = self._my - locations[..., 1]
+
+        geolocations = np.empty(locations.shape, dtype=np.float64)
+        geolocations[..., 0] = 360.0 * np.arctan(np.exp(my / radius)) / math.pi - 90.0
+        geolocations[..., 1] = mx * 180.0 / (math.pi * radius)
+        geolocations[..., 2] = self.altitude + locations[..., 2]
+        return geolocations
+
+    def inverse_transform(self, geolocations):
+        """
+        Converts geolocations back to locations.
+        :param geolocations: array (..., 3) with latitude, longitude and altitude
+        :return: array (..., 3) with x, y, z coordinates
+        """
+        geolocations = np.asarray(geolocations, dtype=np.float64)
+        radius = self.EARTH_RADIUS_EQUA * self._scale
+
+        mx = geolocations[..., 1] * math.pi * radius / 180.0
+        my = radius * np.log(np.tan((90.0 + geolocations[..., 0]) * math.pi / 360.0))
+
+        locations = np.empty(geolocations.shape, dtype=np.float64)
+        locations[..., 0] = mx - self._mx
+        locations[..., 1] = self._my - my
+        locations[..., 2] = geolocations[..., 2] - self.altitude
+        return locations
+
+
+
+def _split_actors(actors):
+    """
+    Splits the actors by type: vehicles, traffic lights, speed limits, walkers, stops and static props
+    """
+    vehicles = []
+    traffic_lights = []
+    speed_limits = []
+    walkers = []
+    stops = []
+    static_obstacles = []
+    for actor in actors:
+        if 'vehicle' in actor.type_id:
+            vehicles.append(actor)
+        elif 'traffic_light' in actor.type_id:
+            traffic_lights.append(actor)
+        elif 'speed_limit' in actor.type_id:
+            speed_limits.append(actor)
+        elif 'walker' in actor.type_id:
+            walkers.append(actor)
+        elif 'stop' in actor.type_id:
+            stops.append(actor)
+        elif 'static.prop' in actor.type_id:
+            static_obstacles.append(actor)
+
+    return (vehicles, traffic_lights, speed_limits, walkers, stops, static_obstacles)
 
 
 def get_dynamic_objects(carla_world, carla_map):
@@ -145,30 +306,6 @@ def get_dynamic_objects(carla_world, carla_map):
         corners = [carla_map.transform_to_geolocation(p) for p in corners]
         return corners
 
-    def _split_actors(actors):
-        vehicles = []
-        traffic_lights = []
-        speed_limits = []
-        walkers = []
-        stops = []
-        static_obstacles = []
-        for actor in actors:
-            if 'vehicle' in actor.type_id:
-                vehicles.append(actor)
-            elif 'traffic_light' in actor.type_id:
-                traffic_lights.append(actor)
-            elif 'speed_limit' in actor.type_id:
-                speed_limits.append(actor)
-            elif 'walker' in actor.type_id:
-                walkers.append(actor)
-            elif 'stop' in actor.type_id:
-                stops.append(actor)
-            elif 'static.prop' in actor.type_id:
-                static_obstacles.append(actor)
-
-
-        return (vehicles, traffic_lights, speed_limits, walkers, stops, static_obstacles)
-
     # Public functions
     def get_stop_signals(stops):
         stop_signals_dict = dict()
@@ -282,3 +419,766 @@ def get_dynamic_objects(carla_world, carla_map):
         'speed_limits': get_speed_limits(speed_limits),
         'static_obstacles': get_static_obstacles(static_obstacles)
     }
+
+
+def _get_transforms_array(actors):
+    """Returns an array (N, 6) with the location and rotation (pitch, yaw, roll) of the actors"""
+    transforms = []
+    for actor in actors:
+        t = actor.get_transform()
+        transforms.append((t.location.x, t.location.y, t.location.z,
+                           t.rotation.pitch, t.rotation.yaw, t.rotation.roll))
+    return np.array(transforms, dtype=np.float64).reshape(-1, 6)
+
+
+def _transform_points(transforms, points):
+    """
+    Vectorized equivalent of carla.Transform.transform.
+    :param transforms: array (N, 6) as returned by _get_transforms_array
+    :param points: array (N, K, 3) of points local to each of the transforms
+    :return: array (N, K, 3) with the points in world coordinates
+    """
+    pitch, yaw, roll = [np.radians(transforms[:, i])[:, np.newaxis] for i in (3, 4, 5)]
+    cy, sy = np.cos(yaw), np.sin(yaw)
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cr, sr = np.cos(roll), np.sin(roll)
+    x, y, z = points[..., 0], points[..., 1], points[..., 2]
+
+    world = np.empty(points.shape, dtype=np.float64)
+    world[..., 0] = x * (cp * cy) + y * (cy * sp * sr - sy * cr) + z * (-cy * sp * cr - sy * sr)
+    world[..., 1] = x * (cp * sy) + y * (sy * sp * sr + cy * cr) + z * (-sy * sp * cr + cy * sr)
+    world[..., 2] = x * sp + y * (-cp * sr) + z * (cp * cr)
+    world += transforms[:, np.newaxis, 0:3]
+    return world
+
+
+def _box_corners(extents, centers=None, closed=False):
+    """
+    Returns an array (N, 4, 3), or (N, 5, 3) if closed, with the corners of the boxes
+    of the given extents (N, 3), optionally displaced to the given centers (N, 3)
+    """
+    signs = [(-1, -1), (1, -1), (1, 1), (-1, 1)] + ([(-1, -1)] if closed else [])
+    corners = np.zeros((len(extents), len(signs), 3), dtype=np.float64)
+    for i, (sign_x, sign_y) in enumerate(signs):
+        corners[:, i, 0] = sign_x * extents[:, 0]
+        corners[:, i, 1] = sign_y * extents[:, 1]
+    if centers is not None:
+        corners += centers[:, np.newaxis, :]
+    return corners
+
+
+def _lon_lat_alt(geolocations):
+    """Converts an array (K, 3) of geolocations to the [[lon, lat, alt], ...] format used for the volumes"""
+    return [[g[1], g[0], g[2]] for g in geolocations.tolist()]
+
+
+def _lat_lon_alt(volumes):
+    """Converts volumes in the [[lon, lat, alt], ...] format back to an array (..., 3) of geolocations"""
+    return np.asarray(volumes, dtype=np.float64)[..., [1, 0, 2]]
+
+
+class SceneLayoutTracker(object):
+    """
+    Stateful version of get_dynamic_objects, meant to be called once per frame.
+
+    Stop signs, speed limits, static props and the location and trigger volume of the traffic
+    lights are computed once, the first time the actor is seen. Each tick returns only the
+    differences with the previous one: new or moved vehicles and walkers, traffic lights that
+    changed their state, new static items and the ids of the removed actors. The full state, with
+    the same format as get_dynamic_objects, is available through get_dynamic_objects().
+    Geolocations are computed in bulk with a GeoReference.
+    """
+
+    CATEGORIES = ('vehicles', 'walkers', 'traffic_lights', 'stop_signs', 'speed_limits', 'static_obstacles')
+
+    def __init__(self, carla_world, carla_map):
+        self._world = carla_world
+        self._map = carla_map
+        self._geo_reference = GeoReference(carla_map)
+
+        self._objects = {category: {} for category in self.CATEGORIES}
+        self._hero_vehicle = None
+        self._hero = None
+
+        self._transforms = {'vehicles': {}, 'walkers': {}}  # {category: {id: (x, y, z, pitch, yaw, roll)}}
+        self._extents = {}  # {id: (x, y, z)}
+
+    @property
+    def geo_reference(self):
+        """The GeoReference used to compute the geolocations"""
+        return self._geo_reference
+
+    def get_dynamic_objects(self):
+        """
+        Returns the full description of the dynamic objects, as of the last tick. The result is a
+        snapshot, later ticks do not change it.
+        """
+        objects = {category: dict(items) for category, items in self._objects.items()}
+        objects['hero_vehicle'] = self._hero_vehicle
+        return objects
+
+    def tick(self):
+        """
+        Updates the state of the scene.
+        :return: a dictionary with the items that changed since the previous tick, following the
+            format of get_dynamic_objects, plus 'added' and 'removed' entries with the ids of the
+            new and removed actors per category.
+        """
+        actors = self._world.get_actors()
+        split = dict(zip(
+            ('vehicles', 'traffic_lights', 'speed_limits', 'walkers', 'stop_signs', 'static_obstacles'),
+            _split_actors(actors)))
+
+        delta = {}
+        added = {}
+        removed = {}
+        for category in self.CATEGORIES:
+            current = split[category]
+            current_ids = set(actor.id for actor in current)
+            added[category] = [actor.id for actor in current if actor.id not in self._objects[category]]
+            removed[category] = [actor_id for actor_id in self._objects[category] if actor_id not in current_ids]
+            for actor_id in removed[category]:
+                del self._objects[category][actor_id]
+                self._extents.pop(actor_id, None)
+                if category in self._transforms:
+                    self._transforms[category].pop(actor_id, None)
+
+            if category in ('vehicles', 'walkers'):
+                delta[category] = self._update_moving_actors(category, current)
+            elif category == 'traffic_lights':
+                delta[category] = self._update_traffic_lights(current)
+            else:
+                new_actors = [actor for actor in current if actor.id not in self._objects[category]]
+                delta[category] = self._update_static_items(category, new_actors)
+
+        delta['hero_vehicle'] = self._update_hero_vehicle(split['vehicles'])
+        delta['added'] = added
+        delta['removed'] = removed
+        return delta
+
+    def _update_moving_actors(self, category, actors):
+        if not actors:
+            return {}
+
+        transforms = _get_transforms_array(actors)
+        cached = self._transforms[category]
+
+        changed = [i for i, actor in enumerate(actors) if cached.get(actor.id) != tuple(transforms[i])]
+        if not changed:
+            return {}
+        actors = [actors[i] for i in changed]
+        transforms = transforms[changed]
+
+        extents = []
+        for actor in actors:
+            if actor.id not in self._extents:
+                bb = actor.bounding_box.extent
+                self._extents[actor.id] = (bb.x, bb.y, bb.z)
+            extents.append(self._extents[actor.id])
+
+        corners = _transform_points(transforms, _box_corners(np.array(extents, dtype=np.float64)))
+        positions = self._geo_reference.transform(transforms[:, 0:3])
+        corners = self._geo_reference.transform(corners)
+
+        delta = {}
+        for i, actor in enumerate(actors):
+            pitch, yaw, roll = transforms[i, 3:6].tolist()
+            actor_dict = {
+                "id": actor.id,
+                "position": positions[i].tolist(),
+                "orientation": [roll, pitch, yaw],
+                "bounding_box": _lon_lat_alt(corners[i])
+            }
+            cached[actor.id] = tuple(transforms[i])
+            self._objects[category][actor.id] = actor_dict
+            delta[actor.id] = actor_dict
+        return delta
+
+    def _update_traffic_lights(self, traffic_lights):
+        new_lights = [tl for tl in traffic_lights if tl.id not in self._objects['traffic_lights']]
+        delta = self._update_static_items('traffic_lights', new_lights)
+
+        for traffic_light in traffic_lights:
+            tl_dict = self._objects['traffic_lights'][traffic_light.id]
+            state = int(traffic_light.state)
+            if tl_dict["state"] != state:
+                # Replaced instead of updated, as the previous one may be part of a snapshot
+                tl_dict = dict(tl_dict, state=state)
+                self._objects['traffic_lights'][traffic_light.id] = tl_dict
+                delta[traffic_light.id] = tl_dict
+        return delta
+
+    def _update_static_items(self, category, actors):
+        if not actors:
+            return {}
+
+        transforms = _get_transforms_array(actors)
+        positions = self._geo_reference.transform(transforms[:, 0:3])
+
+        volumes = None
+        if category in ('traffic_lights', 'stop_signs'):
+            extents = []
+            centers = []
+            for actor in actors:
+                volume = actor.trigger_volume
+                extents.append((volume.extent.x, volume.extent.y, volume.extent.z))
+                centers.append((volume.location.x, volume.location.y, volume.location.z))
+            corners = _box_corners(np.array(extents), np.array(centers), closed=True)
+            volumes = self._geo_reference.transform(_transform_points(transforms, corners))
+
+        delta = {}
+        for i, actor in enumerate(actors):
+            item_dict = {
+                "id": actor.id,
+                "position": positions[i].tolist()
+            }
+            if category == 'traffic_lights':
+                item_dict["state"] = int(actor.state)
+            if volumes is not None:
+                item_dict["trigger_volume"] = _lon_lat_alt(volumes[i])
+            if category == 'speed_limits':
+                item_dict["speed"] = int(actor.type_id.split('.')[2])
+
+            self._objects[category][actor.id] = item_dict
+            delta[actor.id] = item_dict
+        return delta
+
+    def _update_hero_vehicle(self, vehicles):
+        heroes = [v for v in vehicles if v.attributes.get('role_name') == 'hero']
+        if self._hero is None or self._hero.id not in [v.id for v in heroes]:
+            self._hero = None if len(heroes) == 0 else random.choice(heroes)
+
+        if self._hero is None:
+            self._hero_vehicle = None
+            return None
+
+        hero_dict = self._objects['vehicles'][self._hero.id]
+        hero_waypoint = self._map.get_waypoint(self._hero.get_location())
+        self._hero_vehicle = {
+            "id": self._hero.id,
+            "position": hero_dict["position"],
+            "road_id": hero_waypoint.road_id,
+            "lane_id": hero_waypoint.lane_id
+        }
+        return self._hero_vehicle
+
+
+class SceneLayoutWriter(object):
+    """
+    Exports the scene layout and the dynamic objects of a recording to a directory of
+    columnar files, as a compact alternative to JSON-encoding the dictionaries of
+    get_scene_layout and get_dynamic_objects every frame.
+
+    The static layout, as returned by get_scene_layout_arrays, is written once. The dynamic
+    objects are buffered and appended every `chunk_frames` frames as a new segment of .npy
+    files, one per column, so that they can be memory-mapped by SceneLayoutReader. The dynamic
+    objects are computed by a SceneLayoutTracker, so actors that did not move are not transformed
+    again.
+
+    Tables written every frame:
+        vehicles, walkers: frame, id, position, orientation (roll, pitch, yaw), bounding_box (4, 3)
+        traffic_light_states: frame, id, state
+        hero_vehicle: frame, id, position, road_id, lane_id
+    Tables written the first frame an actor is seen:
+        traffic_lights, stop_signs: frame, id, position, trigger_volume (5, 3)
+        speed_limits: frame, id, position, speed
+        static_obstacles: frame, id, position
+
+    All geolocations are stored as latitude, longitude and altitude.
+    """
+
+    TABLES = {
+        'vehicles': ('frame', 'id', 'position', 'orientation', 'bounding_box'),
+        'walkers': ('frame', 'id', 'position', 'orientation', 'bounding_box'),
+        'traffic_light_states': ('frame', 'id', 'state'),
+        'hero_vehicle': ('frame', 'id', 'position', 'road_id', 'lane_id'),
+        'traffic_lights': ('frame', 'id', 'position', 'trigger_volume'),
+        'stop_signs': ('frame', 'id', 'position', 'trigger_volume'),
+        'speed_limits': ('frame', 'id', 'position', 'speed'),
+        'static_obstacles': ('frame', 'id', 'position'),
+    }
+
+    COLUMN_TYPES = {
+        'frame': np.int64,
+        'id': np.int64,
+        'state': np.int8,
+        'road_id': np.int64,
+        'lane_id': np.int64,
+        'speed': np.int32,
+    }
+
+    def __init__(self, path, carla_world, carla_map, chunk_frames=100, precision=0.05):
+        """
+        :param path: output directory, created if needed
+        :param carla_world: carla.World to record
+        :param carla_map: carla.Map of the world
+        :param chunk_frames: number of frames buffered in memory before writing a segment
+        :param precision: distance in meters between the waypoints of the static layout
+        """
+        self._path = path
+        self._world = carla_world
+        self._chunk_frames = chunk_frames
+        self._tracker = SceneLayoutTracker(carla_world, carla_map)
+        self._geo_reference = self._tracker.geo_reference
+
+        self._buffers = {table: {column: [] for column in columns} for table, columns in self.TABLES.items()}
+        self._buffered_frames = []
+        self._segments = {table: [] for table in self.TABLES}
+
+        for table in self.TABLES:
+            if not os.path.isdir(os.path.join(path, table)):
+                os.makedirs(os.path.join(path, table))
+        layout_path = os.path.join(path, 'layout')
+        if not os.path.isdir(layout_path):
+            os.makedirs(layout_path)
+        for key, array in get_scene_layout_arrays(carla_map, precision).items():
+            np.save(os.path.join(layout_path, key + '.npy'), array)
+
+        self._meta = {
+            'map_name': carla_map.name,
+            'geo_reference': [self._geo_reference.latitude,
+                              self._geo_reference.longitude,
+                              self._geo_reference.altitude],
+            'precision': precision,
+            'segments': self._segments
+        }
+        self._write_meta()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write_frame(self, frame=None):
+        """
+        Records the current state of the dynamic objects.
+        :param frame: frame number of the state, by default the frame of the world snapshot
+        """
+        if frame is None:
+            frame = self._world.get_snapshot().frame
+
+        delta = self._tracker.tick()
+        objects = self._tracker.get_dynamic_objects()
+
+        self._append_moving_actors('vehicles', frame, list(objects['vehicles'].values()))
+        self._append_moving_actors('walkers', frame, list(objects['walkers'].values()))
+        traffic_lights = list(objects['traffic_lights'].values())
+        self._append_rows('traffic_light_states', frame, len(traffic_lights), {
+            'id': [tl['id'] for tl in traffic_lights],
+            'state': [tl['state'] for tl in traffic_lights]})
+        self._append_hero_vehicle(frame, objects['hero_vehicle'])
+
+        for table in ('traffic_lights', 'stop_signs', 'speed_limits', 'static_obstacles'):
+            self._append_static_items(table, frame, [objects[table][actor_id] for actor_id in delta['added'][table]])
+
+        self._buffered_frames.append(frame)
+        if len(self._buffered_frames) >= self._chunk_frames:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered frames as a new segment of each table.
+        """
+        if not self._buffered_frames:
+            return
+
+        for table, columns in self.TABLES.items():
+            buffers = self._buffers[table]
+            if not buffers['frame']:
+                continue
+
+            index = len(self._segments[table])
+            arrays = {column: np.concatenate(buffers[column]) for column in columns}
+            for column, array in arrays.items():
+                np.save(os.path.join(self._path, table, '{}.{:06d}.npy'.format(column, index)), array)
+                buffers[column] = []
+
+            self._segments[table].append({
+                'rows': len(arrays['frame']),
+                'first_frame': int(arrays['frame'][0]),
+                'last_frame': int(arrays['frame'][-1])
+            })
+
+        self._buffered_frames = []
+        self._write_meta()
+
+    def close(self):
+        """
+        Writes the remaining buffered frames.
+        """
+        self.flush()
+
+    def _write_meta(self):
+        # Written to a temporary file first, so that readers never see a partial index
+        meta_path = os.path.join(self._path, 'meta.json')
+        with open(meta_path + '.tmp', 'w') as fd:
+            json.dump(self._meta, fd)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def _append_rows(self, table, frame, num_rows, columns):
+        if num_rows == 0:
+            return
+        buffers = self._buffers[table]
+        buffers['frame'].append(np.full(num_rows, frame, dtype=np.int64))
+        for column, values in columns.items():
+            buffers[column].append(np.asarray(values, dtype=self.COLUMN_TYPES.get(column, np.float64)))
+
+    def _append_moving_actors(self, table, frame, actors):
+        if not actors:
+            return
+
+        self._append_rows(table, frame, len(actors), {
+            'id': [actor['id'] for actor in actors],
+            'position': [actor['position'] for actor in actors],
+            'orientation': [actor['orientation'] for actor in actors],
+            'bounding_box': _lat_lon_alt([actor['bounding_box'] for actor in actors])})
+
+    def _append_static_items(self, table, frame, items):
+        if not items:
+            return
+
+        columns = {
+            'id': [item['id'] for item in items],
+            'position': [item['position'] for item in items]
+        }
+        if table in ('traffic_lights', 'stop_signs'):
+            columns['trigger_volume'] = _lat_lon_alt([item['trigger_volume'] for item in items])
+        if table == 'speed_limits':
+            columns['speed'] = [item['speed'] for item in items]
+
+        self._append_rows(table, frame, len(items), columns)
+
+    def _append_hero_vehicle(self, frame, hero_vehicle):
+        if hero_vehicle is None:
+            return
+
+        self._append_rows('hero_vehicle', frame, 1, {
+            'id': [hero_vehicle['id']],
+            'position': [hero_vehicle['position']],
+            'road_id': [hero_vehicle['road_id']],
+            'lane_id': [hero_vehicle['lane_id']]})
+
+
+class SceneLayoutReader(object):
+    """
+    Reads the files written by SceneLayoutWriter. Arrays are memory-mapped, so only the
+    segments and columns that are accessed are loaded from disk.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        with open(os.path.join(path, 'meta.json')) as fd:
+            self._meta = json.load(fd)
+
+        self.map_name = self._meta['map_name']
+        self.geo_reference = tuple(self._meta['geo_reference'])
+        self.precision = self._meta['precision']
+        self.layout = {}
+        for filename in sorted(os.listdir(os.path.join(path, 'layout'))):
+            key = os.path.splitext(filename)[0]
+            self.layout[key] = np.load(os.path.join(path, 'layout', filename), mmap_mode='r')
+
+    @property
+    def tables(self):
+        """Names of the tables of dynamic objects"""
+        return sorted(self._meta['segments'])
+
+    def num_rows(self, table):
+        """Number of rows written to a table"""
+        return sum(segment['rows'] for segment in self._meta['segments'][table])
+
+    def segments(self, table, columns=None):
+        """
+        Iterates over the segments of a table, without concatenating them.
+        :param table: name of the table
+        :param columns: columns to load, by default all of them
+        :return: generator of dictionaries of memory-mapped arrays, one per segment
+        """
+        if columns is None:
+            columns = SceneLayoutWriter.TABLES[table]
+        for index in range(len(self._meta['segments'][table])):
+            yield {column: self._load(table, column, index) for column in columns}
+
+    def read(self, table, first_frame=None, last_frame=None, columns=None):
+        """
+        Reads the rows of a table between two frames, both included.
+        :param table: name of the table
+        :param first_frame: first frame to read, by default the first one recorded
+        :param last_frame: last frame to read, by default the last one recorded
+        :param columns: columns to read, by default all of them
+        :return: a dictionary of arrays, one per column
+        """
+        if columns is None:
+            columns = SceneLayoutWriter.TABLES[table]
+
+        parts = {column: [] for column in columns}
+        for index, segment in enumerate(self._meta['segments'][table]):
+            if first_frame is not None and segment['last_frame'] < first_frame:
+                continue
+            if last_frame is not None and segment['first_frame'] > last_frame:
+                continue
+
+            frames = self._load(table, 'frame', index)
+            begin = 0 if first_frame is None else np.searchsorted(frames, first_frame, side='left')
+            end = len(frames) if last_frame is None else np.searchsorted(frames, last_frame, side='right')
+            for column in columns:
+                parts[column].append(self._load(table, column, index)[begin:end])
+
+        result = {}
+        for column in columns:
+            if parts[column]:
+                result[column] = np.concatenate(parts[column])
+            else:
+                result[column] = np.empty(0, dtype=SceneLayoutWriter.COLUMN_TYPES.get(column, np.float64))
+        return result
+
+    def _load(self, table, column, index):
+        filename = os.path.join(self._path, table, '{}.{:06d}.npy'.format(column, index))
+        return np.load(filename, mmap_mode='r')
+
+
+class SceneLayoutIndex(object):
+    """
+    Spatial index over the waypoints of a scene layout, answering nearest point, radius and
+    k-hop neighbourhood queries without scanning the whole layout.
+
+    Points are bucketed in a uniform grid over x and y, stored as sorted cells pointing to
+    contiguous ranges of point indices. The next, left and right links are kept as integer
+    arrays of point indices, -1 meaning no link, and k-hop queries walk a compressed sparse
+    row (CSR) adjacency built from them. Queries return point indices, which map to waypoint
+    ids through `ids`.
+    """
+
+    def __init__(self, layout, cell_size=5.0):
+        """
+        :param layout: dictionary of arrays, as returned by get_scene_layout_arrays
+        :param cell_size: size in meters of the cells of the grid
+        """
+        self.ids = np.asarray(layout["ids"])
+        self.locations = np.asarray(layout["locations"], dtype=np.float64)
+        self.next = np.asarray(layout["next"], dtype=np.int64)
+        self.left = np.asarray(layout["left"], dtype=np.int64)
+        self.right = np.asarray(layout["right"], dtype=np.int64)
+        self._cell_size = float(cell_size)
+        self._id_to_index = None
+        self._adjacency = {}  # {links: (indptr, indices)}
+
+        cells = np.floor(self.locations[:, 0:2] / self._cell_size).astype(np.int64)
+        order = np.lexsort((cells[:, 1], cells[:, 0]))
+        cells = cells[order]
+        if len(cells) > 0:
+            starts = np.flatnonzero(np.any(np.diff(cells, axis=0) != 0, axis=1)) + 1
+            starts = np.concatenate(([0], starts))
+        else:
+            starts = np.zeros(0, dtype=np.int64)
+        ends = np.append(starts[1:], len(cells))
+
+        self._order = order
+        self._cells = {
+            (int(cells[start, 0]), int(cells[start, 1])): (int(start), int(end))
+            for start, end in zip(starts, ends)}
+        self._cell_keys = cells[starts]
+        self._cell_ranges = np.column_stack((starts, ends)).astype(np.int64)
+
+        if len(cells) > 0:
+            self._cell_min = cells.min(axis=0)
+            self._cell_max = cells.max(axis=0)
+
+    @classmethod
+    def from_map(cls, carla_map, precision=0.05, cache_dir=None, cell_size=5.0):
+        """
+        Builds the index of the layout of a map.
+        """
+        return cls(get_scene_layout_arrays(carla_map, precision, cache_dir), cell_size)
+
+    @classmethod
+    def from_waypoints_graph(cls, waypoints_graph, geo_reference, cell_size=5.0):
+        """
+        Builds the index from the dictionary returned by get_scene_layout.
+        :param waypoints_graph: dictionary of waypoints, keyed by id
+        :param geo_reference: GeoReference of the map, used to recover the locations of the waypoints
+        """
+        ids = list(waypoints_graph)
+        id_to_index = {waypoint_id: i for i, waypoint_id in enumerate(ids)}
+        id_to_index[-1] = -1
+
+        def _links(key):
+            return np.array([id_to_index.get(waypoints_graph[i][key], -1) for i in ids], dtype=np.int64)
+
+        positions = np.array([waypoints_graph[i]["position"] for i in ids], dtype=np.float64).reshape(-1, 3)
+        layout = {
+            "ids": np.array(ids, dtype=np.uint64),
+            "locations": geo_reference.inverse_transform(positions),
+            "next": _links("next_waypoint_id"),
+            "left": _links("left_lane_waypoint_id"),
+            "right": _links("right_lane_waypoint_id")
+        }
+        return cls(layout, cell_size)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index_of(self, waypoint_id):
+        """
+        Returns the point index of a waypoint id, or -1 if it is not part of the layout.
+        """
+        if self._id_to_index is None:
+            self._id_to_index = {waypoint_id: i for i, waypoint_id in enumerate(self.ids.tolist())}
+        return self._id_to_index.get(waypoint_id, -1)
+
+    def nearest(self, location, max_distance=float('inf')):
+        """
+        Returns the point closest to a location.
+        :param location: carla.Location or (x, y, z)
+        :param max_distance: maximum distance of the search, in meters
+        :return: tuple (index, distance), with index -1 if no point is within max_distance
+        """
+        query = self._to_array(location)
+        if not self._cells:
+            return -1, float('inf')
+
+        cell_x, cell_y = [int(math.floor(c / self._cell_size)) for c in query[0:2]]
+        if (min(max(cell_x, int(self._cell_min[0])), int(self._cell_max[0])) != cell_x or
+                min(max(cell_y, int(self._cell_min[1])), int(self._cell_max[1])) != cell_y):
+            # Outside of the grid, the rings would have to grow up to the far side of the grid
+            return self._nearest_outside_grid(query, max_distance)
+
+        # Rings beyond the grid bounds are empty, so the search can stop there
+        max_ring = int(max(abs(cell_x - self._cell_min[0]), abs(cell_x - self._cell_max[0]),
+                           abs(cell_y - self._cell_min[1]), abs(cell_y - self._cell_max[1])))
+        if max_distance != float('inf'):
+            max_ring = min(max_ring, int(math.ceil(max_distance / self._cell_size)))
+
+        best_index = -1
+        best_distance = max_distance
+        for ring in range(max_ring + 1):
+            candidates = self._ring_candidates(cell_x, cell_y, ring)
+            if len(candidates) > 0:
+                distances = np.linalg.norm(self.locations[candidates] - query, axis=1)
+                i = int(np.argmin(distances))
+                if distances[i] <= best_distance:
+                    best_index = int(candidates[i])
+                    best_distance = float(distances[i])
+            # Points outside the searched rings are at least this far away
+            if best_index >= 0 and best_distance <= ring * self._cell_size:
+                break
+
+        return best_index, best_distance
+
+    def _nearest_outside_grid(self, query, max_distance):
+        # Distance in x and y from the query to each of the cells, a lower bound of the distance
+        # to their points. Only the cells not further than the first candidate are searched
+        lower = self._cell_keys * self._cell_size
+        gaps = np.maximum(np.maximum(lower - query[0:2], query[0:2] - (lower + self._cell_size)), 0.0)
+        bounds = np.hypot(gaps[:, 0], gaps[:, 1])
+
+        start, end = self._cell_ranges[np.argmin(bounds)]
+        first = self._order[start:end]
+        radius = min(float(np.min(np.linalg.norm(self.locations[first] - query, axis=1))), max_distance)
+
+        ranges = self._cell_ranges[bounds <= radius]
+        if len(ranges) == 0:
+            return -1, max_distance
+        candidates = np.concatenate([self._order[start:end] for start, end in ranges])
+        distances = np.linalg.norm(self.locations[candidates] - query, axis=1)
+        i = int(np.argmin(distances))
+        if distances[i] > max_distance:
+            return -1, max_distance
+        return int(candidates[i]), float(distances[i])
+
+    def within_radius(self, location, radius):
+        """
+        Returns the points within a radius of a location.
+        :param location: carla.Location or (x, y, z)
+        :param radius: radius of the search, in meters
+        :return: tuple (indices, distances), sorted by increasing distance
+        """
+        query = self._to_array(location)
+        min_x, min_y = [int(math.floor((c - radius) / self._cell_size)) for c in query[0:2]]
+        max_x, max_y = [int(math.floor((c + radius) / self._cell_size)) for c in query[0:2]]
+
+        ranges = []
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                cell = self._cells.get((x, y))
+                if cell is not None:
+                    ranges.append(self._order[cell[0]:cell[1]])
+        if not ranges:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+        candidates = np.concatenate(ranges)
+        distances = np.linalg.norm(self.locations[candidates] - query, axis=1)
+        mask = distances <= radius
+        candidates = candidates[mask]
+        distances = distances[mask]
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+    def neighbours(self, index):
+        """
+        Returns the indices linked to a point, as (next, left, right), -1 meaning no link.
+        """
+        return int(self.next[index]), int(self.left[index]), int(self.right[index])
+
+    def k_hop(self, index, k, links=('next', 'left', 'right')):
+        """
+        Returns the points reachable from a point following at most k links.
+        :param index: index of the starting point
+        :param k: maximum number of links to follow
+        :param links: types of links to follow, any of 'next', 'left' and 'right'
+        :return: dictionary {index: number of hops}, including the starting point with 0 hops
+        """
+        indptr, indices = self.adjacency(links)
+        # Memoryviews index faster than numpy arrays for the few points reached at each hop
+        indptr, indices = memoryview(indptr), memoryview(indices)
+
+        hops = {index: 0}
+        frontier = [index]
+        for hop in range(1, k + 1):
+            reached = []
+            for i in frontier:
+                for j in indices[indptr[i]:indptr[i + 1]]:
+                    if j not in hops:
+                        hops[j] = hop
+                        reached.append(j)
+            if not reached:
+                break
+            frontier = reached
+        return hops
+
+    def adjacency(self, links=('next', 'left', 'right')):
+        """
+        Returns the adjacency of the points in compressed sparse row format, built on first use.
+        :param links: types of links to include, any of 'next', 'left' and 'right'
+        :return: tuple (indptr, indices), the points linked to point i being
+            indices[indptr[i]:indptr[i + 1]]
+        """
+        links = tuple(links)
+        if links not in self._adjacency:
+            targets = np.column_stack([getattr(self, link) for link in links]).reshape(len(self), len(links))
+            valid = targets >= 0
+            indptr = np.zeros(len(self) + 1, dtype=np.int64)
+            np.cumsum(valid.sum(axis=1), out=indptr[1:])
+            self._adjacency[links] = (indptr, np.ascontiguousarray(targets[valid], dtype=np.int64))
+        return self._adjacency[links]
+
+    def _ring_candidates(self, cell_x, cell_y, ring):
+        if ring == 0:
+            cells = [(cell_x, cell_y)]
+        else:
+            cells = [(x, y) for x in range(cell_x - ring, cell_x + ring + 1) for y in (cell_y - ring, cell_y + ring)]
+            cells += [(x, y) for x in (cell_x - ring, cell_x + ring) for y in range(cell_y - ring + 1, cell_y + ring)]
+
+        ranges = []
+        for cell in cells:
+            cell_range = self._cells.get(cell)
+            if cell_range is not None:
+                ranges.append(self._order[cell_range[0]:cell_range[1]])
+        return np.concatenate(ranges) if ranges else ranges
+
+    @staticmethod
+    def _to_array(location):
+        if hasattr(location, 'x'):
+            return np.array([location.x, location.y, location.z], dtype=np.float64)
+        return np.asarray(location, dtype=np.float64)
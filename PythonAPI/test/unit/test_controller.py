@@ -0,0 +1,94 @@
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'carla'))
+
+import carla
+
+import unittest
+
+from agents.navigation.controller import (PIDLateralController, PIDLongitudinalController,
+                                          PIDControllerBank)
+
+
+class _Waypoint(object):
+    def __init__(self, transform):
+        self.transform = transform
+
+
+class _Vehicle(object):
+    def __init__(self, steer=0.0):
+        self.control = carla.VehicleControl()
+        self.control.steer = steer
+
+    def get_control(self):
+        return self.control
+
+
+class TestPIDControllerBank(unittest.TestCase):
+    def setUp(self):
+        self.args_lateral = {'K_P': 1.95, 'K_I': 0.05, 'K_D': 0.2, 'dt': 0.05}
+        self.args_longitudinal = {'K_P': 1.0, 'K_I': 0.05, 'K_D': 0.1, 'dt': 0.05}
+        self.rng = random.Random(42)
+
+    def _random_transform(self):
+        return carla.Transform(
+            carla.Location(self.rng.uniform(-10, 10), self.rng.uniform(-10, 10)),
+            carla.Rotation(yaw=self.rng.uniform(-180, 180)))
+
+    def test_equivalence(self):
+        size = 8
+        offset = 0.5
+        vehicles = [_Vehicle(self.rng.uniform(-0.8, 0.8)) for _ in range(size)]
+        bank = PIDControllerBank(vehicles, self.args_lateral, self.args_longitudinal, offset=offset)
+        lon_controllers = [PIDLongitudinalController(None, **self.args_longitudinal) for _ in range(size)]
+        lat_controllers = [PIDLateralController(None, offset, **self.args_lateral) for _ in range(size)]
+        past_steering = [vehicle.get_control().steer for vehicle in vehicles]
+
+        for _ in range(30):
+            target_speeds = [self.rng.uniform(0, 50) for _ in range(size)]
+            current_speeds = [self.rng.uniform(0, 50) for _ in range(size)]
+            vehicle_transforms = [self._random_transform() for _ in range(size)]
+            waypoints = [_Waypoint(self._random_transform()) for _ in range(size)]
+
+            ego_locations = [(t.location.x, t.location.y) for t in vehicle_transforms]
+            ego_forwards = [(t.get_forward_vector().x, t.get_forward_vector().y) for t in vehicle_transforms]
+            target_locations = []
+            for wp in waypoints:
+                r_vec = wp.transform.get_right_vector()
+                target_locations.append((wp.transform.location.x + offset * r_vec.x,
+                                         wp.transform.location.y + offset * r_vec.y))
+
+            throttle, brake, steer = bank.pid_control(
+                target_speeds, current_speeds, ego_locations, ego_forwards, target_locations)
+
+            for i in range(size):
+                acceleration = lon_controllers[i]._pid_control(target_speeds[i], current_speeds[i])
+                steering = lat_controllers[i]._pid_control(waypoints[i], vehicle_transforms[i])
+                steering = min(max(steering, past_steering[i] - 0.1), past_steering[i] + 0.1)
+                steering = min(max(steering, -0.8), 0.8)
+                past_steering[i] = steering
+
+                self.assertAlmostEqual(throttle[i], min(acceleration, 0.75) if acceleration >= 0 else 0.0, places=5)
+                self.assertAlmostEqual(brake[i], 0.0 if acceleration >= 0 else min(-acceleration, 0.3), places=5)
+                self.assertAlmostEqual(steer[i], steering, places=5)
+
+    def test_reset(self):
+        bank = PIDControllerBank([_Vehicle(), _Vehicle()], self.args_lateral, self.args_longitudinal)
+        for _ in range(5):
+            bank.pid_control([30, 30], [0, 0], [(0, 0), (0, 0)], [(1, 0), (1, 0)], [(5, 1), (5, 1)])
+        bank.reset(1, _Vehicle(-0.5))
+        throttle, _, steer = bank.pid_control(
+            [30, 30], [0, 0], [(0, 0), (0, 0)], [(1, 0), (1, 0)], [(5, 1), (5, 1)])
+        controller = PIDLongitudinalController(None, **self.args_longitudinal)
+        self.assertAlmostEqual(throttle[1], min(controller._pid_control(30, 0), 0.75), places=5)
+        self.assertNotEqual(steer[0], steer[1])
+        # The steering of the new vehicle is only allowed to change gradually
+        self.assertAlmostEqual(steer[1], -0.4, places=5)
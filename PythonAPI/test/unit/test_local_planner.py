@@ -0,0 +1,90 @@
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import gc
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'carla'))
+
+import carla
+
+import unittest
+from collections import deque
+
+from agents.navigation import local_planner
+from agents.navigation.local_planner import RoadOption
+from agents.tools.map_cache import CachedMap
+
+
+class _Map(object):
+    name = 'Town00'
+
+
+class TestJunctionOptions(unittest.TestCase):
+    def test_scoped_to_the_map_instance(self):
+        first_map, second_map = _Map(), _Map()
+        key = (1, 2, -1, ((3, 0, -1), (4, 0, -1)))
+
+        options = local_planner._get_junction_options(first_map)
+        options[key] = [RoadOption.LEFT, RoadOption.RIGHT]
+        self.assertIs(local_planner._get_junction_options(first_map), options)
+
+        # Another map with the same name, such as a reloaded one, does not share the options
+        self.assertNotIn(key, local_planner._get_junction_options(second_map))
+
+        cached_map = CachedMap(first_map)
+        self.assertNotIn(key, local_planner._get_junction_options(cached_map))
+        self.assertIs(local_planner._get_junction_options(cached_map),
+                      local_planner._get_junction_options(cached_map))
+
+    def test_dropped_with_the_map(self):
+        carla_map = _Map()
+        local_planner._get_junction_options(carla_map)[(1, 2, -1, ())] = []
+        num_maps = len(local_planner._junction_options_cache)
+
+        del carla_map
+        gc.collect()
+        self.assertEqual(len(local_planner._junction_options_cache), num_maps - 1)
+
+    def test_maps_without_weak_references(self):
+        class _SlotsMap(object):
+            __slots__ = ('name',)
+
+        carla_map = _SlotsMap()
+        options = local_planner._get_junction_options(carla_map)
+        options[(1, 2, -1, ())] = []
+        self.assertEqual(local_planner._get_junction_options(carla_map), {})
+
+
+class TestObsoleteWaypoints(unittest.TestCase):
+    def _planner(self, num_waypoints, num_locations):
+        planner = local_planner.LocalPlanner.__new__(local_planner.LocalPlanner)
+        planner._waypoints_queue = deque([(None, RoadOption.LANEFOLLOW)] * num_waypoints)
+        planner._waypoints_locations = local_planner._LocationBuffer()
+        for i in range(num_locations):
+            planner._waypoints_locations.append(carla.Location(float(i), 0.0, 0.0))
+        planner._purge_window = 4
+        planner._min_distance = 3.5
+        return planner
+
+    def test_purge(self):
+        planner = self._planner(10, 10)
+        self.assertEqual(planner._get_num_obsolete_waypoints(carla.Location(0.0, 0.0, 0.0)), 4)
+        self.assertEqual(planner._get_num_obsolete_waypoints(carla.Location(1.0, 0.0, 0.0)), 5)
+        self.assertEqual(planner._get_num_obsolete_waypoints(carla.Location(20.0, 0.0, 0.0)), 0)
+
+        # The last waypoint is kept until very close by
+        planner = self._planner(3, 3)
+        self.assertEqual(planner._get_num_obsolete_waypoints(carla.Location(0.0, 0.0, 0.0)), 2)
+        self.assertEqual(planner._get_num_obsolete_waypoints(carla.Location(1.5, 0.0, 0.0)), 3)
+
+    def test_misaligned_buffers(self):
+        vehicle_location = carla.Location(1.5, 0.0, 0.0)
+        for num_waypoints, num_locations, expected in ((10, 6, 5), (6, 10, 5), (10, 0, 0)):
+            planner = self._planner(num_waypoints, num_locations)
+            planner._min_distance = 10.0
+            self.assertEqual(planner._get_num_obsolete_waypoints(vehicle_location), expected)
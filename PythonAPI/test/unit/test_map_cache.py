@@ -0,0 +1,77 @@
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import os
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'carla'))
+
+import carla
+
+import unittest
+
+from agents.tools.map_cache import CachedMap
+
+
+class _Map(object):
+    name = 'Town00'
+
+    def __init__(self):
+        self.queries = 0
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=carla.LaneType.Driving):
+        self.queries += 1
+        return (round(location.x), round(location.y), project_to_road)
+
+
+class TestCachedMap(unittest.TestCase):
+    def test_hits_and_misses(self):
+        carla_map = _Map()
+        cached_map = CachedMap(carla_map, resolution=0.1)
+
+        first = cached_map.get_waypoint(carla.Location(10.0, 5.0, 0.0))
+        second = cached_map.get_waypoint(carla.Location(10.02, 4.99, 0.01))
+        third = cached_map.get_waypoint(carla.Location(10.5, 5.0, 0.0))
+        fourth = cached_map.get_waypoint(carla.Location(10.0, 5.0, 0.0), project_to_road=False)
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, third)
+        self.assertNotEqual(first, fourth)
+        self.assertEqual(carla_map.queries, 3)
+        self.assertEqual(cached_map.stats()['hits'], 1)
+        self.assertEqual(cached_map.stats()['misses'], 3)
+        self.assertEqual(cached_map.name, 'Town00')
+
+    def test_lru(self):
+        carla_map = _Map()
+        cached_map = CachedMap(carla_map, resolution=1.0, max_size=2)
+        for x in (0.0, 10.0, 0.0, 20.0, 0.0, 10.0):
+            cached_map.get_waypoint(carla.Location(x, 0.0, 0.0))
+        self.assertEqual(carla_map.queries, 4)
+        self.assertEqual(cached_map.stats()['size'], 2)
+
+        cached_map.clear()
+        self.assertEqual(cached_map.stats(), {'hits': 0, 'misses': 0, 'hit_rate': 0.0, 'size': 0})
+
+    def test_threads(self):
+        carla_map = _Map()
+        cached_map = CachedMap(carla_map, resolution=1.0, max_size=50)
+
+        def query(offset):
+            for i in range(2000):
+                cached_map.get_waypoint(carla.Location(float((i * 7 + offset) % 100), 0.0, 0.0))
+
+        threads = [threading.Thread(target=query, args=(offset,)) for offset in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = cached_map.stats()
+        self.assertEqual(stats['hits'] + stats['misses'], 8000)
+        self.assertEqual(stats['misses'], carla_map.queries)
+        self.assertEqual(stats['size'], 50)
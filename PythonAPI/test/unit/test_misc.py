@@ -0,0 +1,102 @@
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import math
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'carla'))
+
+import carla
+import numpy as np
+
+import unittest
+
+from agents.tools.misc import (is_within_distance, compute_magnitude_angle, distance_vehicle, vector,
+                               compute_distance, locations_to_array, is_within_distance_batch,
+                               compute_magnitude_angle_batch, distance_vehicle_batch, vector_batch,
+                               compute_distance_batch)
+
+
+class _Waypoint(object):
+    def __init__(self, location):
+        self.transform = carla.Transform(location, carla.Rotation())
+
+
+class TestBatchFunctions(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(42)
+        self.locations = [self._random_location() for _ in range(200)]
+        self.array = locations_to_array(self.locations)
+        self.reference = carla.Transform(self._random_location(), carla.Rotation(yaw=self.rng.uniform(-180, 180)))
+
+    def _random_location(self):
+        return carla.Location(self.rng.uniform(-50, 50), self.rng.uniform(-50, 50), self.rng.uniform(-5, 5))
+
+    def test_locations_to_array(self):
+        self.assertEqual(self.array.shape, (200, 3))
+        self.assertEqual(self.array.dtype, np.float64)
+        for location, row in zip(self.locations, self.array):
+            self.assertEqual(tuple(row), (location.x, location.y, location.z))
+
+    def test_is_within_distance(self):
+        for angle_interval in (None, [0, 90], [90, 180], [0, 180], [30, 60]):
+            within = is_within_distance_batch(self.array, self.reference, 40.0, angle_interval)
+            for location, result in zip(self.locations, within):
+                expected = is_within_distance(carla.Transform(location), self.reference, 40.0, angle_interval)
+                self.assertEqual(bool(result), expected)
+
+    def test_is_within_distance_edges(self):
+        # Reference looking along x, with targets on the interval limits
+        reference = carla.Transform(carla.Location(), carla.Rotation(yaw=0.0))
+        locations = [carla.Location(10, 0, 0), carla.Location(0, 10, 0), carla.Location(-10, 0, 0),
+                     carla.Location(0.0005, 0, 0), carla.Location(20, 0, 0), carla.Location(0, 0, 0)]
+        array = locations_to_array(locations)
+        for angle_interval in (None, [0, 90], [0, 180], [90, 180], [-1, 91], [-1, 181]):
+            within = is_within_distance_batch(array, reference, 10.0, angle_interval)
+            expected = [is_within_distance(carla.Transform(l), reference, 10.0, angle_interval) for l in locations]
+            self.assertEqual([bool(w) for w in within], expected)
+
+    def test_compute_magnitude_angle(self):
+        orientation = self.reference.rotation.yaw
+        locations = self.locations + [self.reference.location]
+        distances, angles = compute_magnitude_angle_batch(
+            locations_to_array(locations), self.reference.location, orientation)
+        for location, distance, angle in zip(locations, distances, angles):
+            expected = compute_magnitude_angle(location, self.reference.location, orientation)
+            self.assertAlmostEqual(distance, expected[0], places=9)
+            if math.isnan(expected[1]):
+                self.assertTrue(math.isnan(angle))
+            else:
+                self.assertAlmostEqual(angle, expected[1], places=6)
+
+    def test_distance_vehicle(self):
+        distances = distance_vehicle_batch(self.array, self.reference)
+        for location, distance in zip(self.locations, distances):
+            self.assertAlmostEqual(distance, distance_vehicle(_Waypoint(location), self.reference), places=9)
+
+    def test_vector(self):
+        vectors = vector_batch(self.reference.location, self.array)
+        for location, result in zip(self.locations, vectors):
+            np.testing.assert_allclose(result, vector(self.reference.location, location), rtol=1e-12)
+
+    def test_compute_distance(self):
+        distances = compute_distance_batch(self.reference.location, self.array)
+        for location, distance in zip(self.locations, distances):
+            self.assertAlmostEqual(distance, compute_distance(self.reference.location, location), places=9)
+
+    def test_empty(self):
+        array = locations_to_array([])
+        self.assertEqual(array.shape, (0, 3))
+        self.assertEqual(is_within_distance_batch(array, self.reference, 10.0).shape, (0,))
+        self.assertEqual(is_within_distance_batch(array, self.reference, 10.0, [0, 90]).shape, (0,))
+        distances, angles = compute_magnitude_angle_batch(array, self.reference.location, 0.0)
+        self.assertEqual((distances.shape, angles.shape), ((0,), (0,)))
+        self.assertEqual(distance_vehicle_batch(array, self.reference).shape, (0,))
+        self.assertEqual(vector_batch(self.reference.location, array).shape, (0, 3))
+        self.assertEqual(compute_distance_batch(self.reference.location, array).shape, (0,))
+
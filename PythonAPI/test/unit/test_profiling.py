@@ -0,0 +1,64 @@
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import io
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'carla'))
+
+import unittest
+
+from agents.tools import profiling
+
+
+class _Vehicle(object):
+    id = 42
+
+
+class _Agent(object):
+    def __init__(self):
+        self._vehicle = _Vehicle()
+
+    @profiling.profiled('agent.run_step')
+    def run_step(self):
+        with profiling.profile_phase(self._vehicle, 'server.get_actors'):
+            pass
+        return 'control'
+
+
+class TestProfiling(unittest.TestCase):
+    def tearDown(self):
+        profiling.disable()
+        profiling.get_registry().reset()
+
+    def test_disabled(self):
+        self.assertEqual(_Agent().run_step(), 'control')
+        self.assertEqual(profiling.get_registry().histograms, {})
+
+    def test_tick_report(self):
+        profiling.enable()
+        agent = _Agent()
+        agent.run_step()
+        agent.run_step()
+        profiling.count_round_trips(agent._vehicle)
+
+        stream = io.StringIO()
+        entries = profiling.TickReporter(stream=stream).tick()
+        calls = {phase: calls for owner, phase, _, calls in entries if owner == 42}
+        self.assertEqual(calls['agent.run_step'], 2)
+        self.assertEqual(calls['server.get_actors'], 2)
+        self.assertIn('server round trips: agent 42: 3', stream.getvalue())
+        self.assertEqual(profiling.get_registry().end_tick(), [])
+
+    def test_histogram(self):
+        histogram = profiling.Histogram()
+        for microseconds in (1, 3, 10, 100, 1000):
+            histogram.add(microseconds * 1e-6)
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.max, 1e-3)
+        self.assertLessEqual(histogram.percentile(50), 16e-6)
+        self.assertGreaterEqual(histogram.percentile(50), 10e-6)
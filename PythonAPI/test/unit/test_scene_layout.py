@@ -0,0 +1,204 @@
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'carla'))
+
+import carla
+import numpy as np
+
+import unittest
+
+from scene_layout import SceneLayoutIndex, SceneLayoutTracker
+
+
+def _random_layout(rng, num_points):
+    locations = np.column_stack([
+        rng.uniform(-200, 200, num_points),
+        rng.uniform(-200, 200, num_points),
+        rng.uniform(0, 10, num_points)])
+    next_links = np.arange(1, num_points + 1)
+    next_links[-1] = -1
+    return {
+        'ids': np.arange(100, 100 + num_points, dtype=np.uint64),
+        'locations': locations,
+        'next': next_links,
+        'left': rng.integers(-1, num_points, num_points),
+        'right': rng.integers(-1, num_points, num_points)
+    }
+
+
+class _Extent(object):
+    def __init__(self, x, y, z, location=None):
+        self.extent = carla.Vector3D(x, y, z)
+        self.location = location or carla.Location()
+
+
+class _Actor(object):
+    def __init__(self, actor_id, type_id, location, role_name='autopilot', state=0):
+        self.id = actor_id
+        self.type_id = type_id
+        self.location = location
+        self.attributes = {'role_name': role_name}
+        self.state = state
+        self.bounding_box = _Extent(2.0, 1.0, 0.8)
+        self.trigger_volume = _Extent(1.0, 1.0, 1.0, carla.Location(0.5, 0.0, 0.0))
+
+    def get_location(self):
+        return self.location
+
+    def get_transform(self):
+        return carla.Transform(self.location, carla.Rotation(yaw=30.0))
+
+
+class _Waypoint(object):
+    road_id = 3
+    lane_id = -1
+
+
+class _Map(object):
+    @staticmethod
+    def transform_to_geolocation(location):
+        return carla.GeoLocation(49.0, 8.0, 100.0)
+
+    @staticmethod
+    def get_waypoint(location):
+        return _Waypoint()
+
+
+class _World(object):
+    def __init__(self, actors):
+        self.actors = actors
+
+    def get_actors(self):
+        return list(self.actors)
+
+
+class TestSceneLayoutTracker(unittest.TestCase):
+    def setUp(self):
+        self.hero = _Actor(1, 'vehicle.tesla.model3', carla.Location(10.0, 0.0, 0.0), role_name='hero')
+        self.vehicle = _Actor(2, 'vehicle.audi.tt', carla.Location(20.0, 5.0, 0.0))
+        self.walker = _Actor(3, 'walker.pedestrian.0001', carla.Location(0.0, 5.0, 0.0))
+        self.light = _Actor(4, 'traffic.traffic_light', carla.Location(30.0, 0.0, 0.0), state=0)
+        self.stop = _Actor(5, 'traffic.stop', carla.Location(40.0, 0.0, 0.0))
+        self.world = _World([self.hero, self.vehicle, self.walker, self.light, self.stop])
+        self.tracker = SceneLayoutTracker(self.world, _Map())
+
+    def test_first_tick(self):
+        delta = self.tracker.tick()
+        self.assertEqual(sorted(delta['vehicles']), [1, 2])
+        self.assertEqual(list(delta['walkers']), [3])
+        self.assertEqual(list(delta['traffic_lights']), [4])
+        self.assertEqual(list(delta['stop_signs']), [5])
+        self.assertEqual(delta['added']['vehicles'], [1, 2])
+        self.assertEqual(delta['added']['traffic_lights'], [4])
+        self.assertTrue(all(not ids for ids in delta['removed'].values()))
+        self.assertEqual(delta['hero_vehicle']['id'], 1)
+        self.assertEqual(delta['hero_vehicle']['position'], delta['vehicles'][1]['position'])
+
+    def test_unchanged_actors_are_omitted(self):
+        self.tracker.tick()
+        delta = self.tracker.tick()
+        for category in SceneLayoutTracker.CATEGORIES:
+            self.assertEqual(delta[category], {})
+            self.assertEqual(delta['added'][category], [])
+            self.assertEqual(delta['removed'][category], [])
+
+    def test_changes(self):
+        first = self.tracker.tick()
+        self.vehicle.location = carla.Location(22.0, 5.0, 0.0)
+        self.light.state = 2
+        self.world.actors.remove(self.walker)
+        self.world.actors.append(_Actor(6, 'static.prop.barrel', carla.Location(50.0, 0.0, 0.0)))
+
+        delta = self.tracker.tick()
+        self.assertEqual(list(delta['vehicles']), [2])
+        self.assertNotEqual(delta['vehicles'][2]['position'], first['vehicles'][2]['position'])
+        self.assertEqual(delta['traffic_lights'][4]['state'], 2)
+        self.assertEqual(delta['removed']['walkers'], [3])
+        self.assertEqual(delta['walkers'], {})
+        self.assertEqual(delta['added']['static_obstacles'], [6])
+        self.assertEqual(list(delta['static_obstacles']), [6])
+        self.assertEqual(delta['stop_signs'], {})
+
+        objects = self.tracker.get_dynamic_objects()
+        self.assertEqual(objects['walkers'], {})
+        self.assertEqual(objects['vehicles'][2], delta['vehicles'][2])
+        self.assertEqual(objects['traffic_lights'][4]['state'], 2)
+
+    def test_snapshots(self):
+        self.tracker.tick()
+        snapshot = self.tracker.get_dynamic_objects()
+        walkers = dict(snapshot['walkers'])
+        vehicle = snapshot['vehicles'][2]
+
+        self.vehicle.location = carla.Location(25.0, 5.0, 0.0)
+        self.light.state = 1
+        self.world.actors.remove(self.walker)
+        self.tracker.tick()
+
+        self.assertEqual(snapshot['walkers'], walkers)
+        self.assertIs(snapshot['vehicles'][2], vehicle)
+        self.assertEqual(snapshot['traffic_lights'][4]['state'], 0)
+
+        # Changing a snapshot does not change the tracker
+        snapshot['vehicles'].clear()
+        self.assertEqual(sorted(self.tracker.get_dynamic_objects()['vehicles']), [1, 2])
+
+
+class TestSceneLayoutIndex(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(7)
+        self.layout = _random_layout(self.rng, 5000)
+        self.index = SceneLayoutIndex(self.layout, cell_size=4.0)
+
+    def test_nearest(self):
+        for query in self.rng.uniform(-250, 250, (50, 3)):
+            distances = np.linalg.norm(self.layout['locations'] - query, axis=1)
+            index, distance = self.index.nearest(query)
+            self.assertAlmostEqual(distance, distances.min())
+            self.assertAlmostEqual(distances[index], distances.min())
+
+        self.assertEqual(self.index.nearest((1000.0, 1000.0, 0.0), max_distance=10.0)[0], -1)
+
+    def test_nearest_outside_grid(self):
+        for query in ((1e7, 0.0, 0.0), (-3e6, 5e6, 1.0), (0.0, -1e9, 0.0)):
+            distances = np.linalg.norm(self.layout['locations'] - query, axis=1)
+            index, distance = self.index.nearest(query)
+            self.assertAlmostEqual(distance, distances.min())
+            self.assertEqual(distances[index], distances.min())
+            self.assertEqual(self.index.nearest(query, max_distance=distances.min() - 1.0)[0], -1)
+            self.assertEqual(self.index.nearest(query, max_distance=distances.min() + 1.0)[0], index)
+
+    def test_within_radius(self):
+        for query in self.rng.uniform(-200, 200, (50, 3)):
+            distances = np.linalg.norm(self.layout['locations'] - query, axis=1)
+            indices, found = self.index.within_radius(query, 12.0)
+            self.assertEqual(sorted(indices.tolist()), np.flatnonzero(distances <= 12.0).tolist())
+            self.assertTrue(np.all(np.diff(found) >= 0))
+
+    def test_k_hop(self):
+        self.assertEqual(self.index.k_hop(0, 3, links=('next',)), {0: 0, 1: 1, 2: 2, 3: 3})
+        hops = self.index.k_hop(10, 2)
+        for i in self.index.neighbours(10):
+            if i >= 0 and i != 10:
+                self.assertEqual(hops[i], 1)
+        for start in (0, 10, 2500):
+            expected = {start: 0}
+            frontier = [start]
+            for hop in range(1, 6):
+                frontier = [j for i in frontier for j in self.index.neighbours(i) if j >= 0 and j not in expected]
+                for j in frontier:
+                    expected.setdefault(j, hop)
+            self.assertEqual(self.index.k_hop(start, 5), expected)
+
+        indptr, indices = self.index.adjacency(('left',))
+        self.assertEqual(len(indptr), len(self.index) + 1)
+        self.assertEqual(indices.tolist(), self.layout['left'][self.layout['left'] >= 0].tolist())
+        self.assertEqual(self.index.index_of(110), 10)
+        self.assertEqual(self.index.index_of(1), -1)
@@ -0,0 +1,120 @@
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', '..', 'Co-Simulation', 'Sumo'))
+if 'SUMO_HOME' in os.environ:
+    sys.path.append(os.path.join(os.environ['SUMO_HOME'], 'tools'))
+
+import numpy as np
+
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+try:
+    from sumo_integration.bridge_helper import BridgeHelper
+    from sumo_integration.sumo_simulation import SumoSimulation, decode_subscription_results, traci
+except ImportError:
+    traci = None
+
+
+def _recorded_results():
+    """
+    Results of traci.vehicle.getAllSubscriptionResults, recorded from the Town04 example
+    """
+    def vehicle(type_id, vclass, length, width, height, position, angle, slope, speed, signals):
+        return {
+            traci.constants.VAR_TYPE: type_id,
+            traci.constants.VAR_VEHICLECLASS: vclass,
+            traci.constants.VAR_COLOR: (255, 255, 0, 255),
+            traci.constants.VAR_LENGTH: length,
+            traci.constants.VAR_WIDTH: width,
+            traci.constants.VAR_HEIGHT: height,
+            traci.constants.VAR_POSITION3D: position,
+            traci.constants.VAR_ANGLE: angle,
+            traci.constants.VAR_SLOPE: slope,
+            traci.constants.VAR_SPEED: speed,
+            traci.constants.VAR_SPEED_LAT: 0.0,
+            traci.constants.VAR_SIGNALS: signals
+        }
+
+    return {
+        '0': vehicle('vehicle.chevrolet.impala', 'passenger', 5.369193077087402, 2.052736520767212,
+                     1.4150995016098022, (519.4923271042501, 213.63728957498736, 0.0),
+                     359.7070413035418, 0.0, 14.720635529873288, 0),
+        '1': vehicle('vehicle.micro.microlino', 'evehicle', 2.2024967670440674, 1.4853248596191406,
+                     1.3464953899383545, (596.7892590464886, 525.2129885717794, 1.4682247618268047),
+                     105.5511447119674, 3.430532140683747, 13.029657743084979, 0),
+        '4': vehicle('vehicle.citroen.c3', 'passenger', 3.9753477573394775, 1.862074851989746,
+                     1.6257729530334473, (658.2686025147531, 661.1618699512433, 0.04),
+                     237.383696564106, 0.0, 11.92808654572361, 2),
+        '5': vehicle('vehicle.ford.mustang', 'passenger', 4.904701232910156, 2.0606582164764404,
+                     1.478397011756897, (720.445427931638, 551.7854729704044, 0.02),
+                     299.9424197998527, 0.0, 10.034092028060282, 1),
+    }
+
+
+def _transform_arrays(transforms):
+    locations = np.array([[t.location.x, t.location.y, t.location.z] for t in transforms], dtype=np.float32)
+    rotations = np.array([[t.rotation.pitch, t.rotation.yaw, t.rotation.roll] for t in transforms], dtype=np.float32)
+    return locations.reshape(-1, 3), rotations.reshape(-1, 3)
+
+
+@unittest.skipIf(traci is None, 'sumo tools not found, declare the SUMO_HOME environment variable')
+class TestDecodeSubscriptionResults(unittest.TestCase):
+    def setUp(self):
+        self.results = _recorded_results()
+        BridgeHelper.offset = (-102.5, 207.3)
+
+    def test_matches_scalar_path(self):
+        actor_ids = ['5', '0', '4', '1']
+        states = decode_subscription_results(self.results, actor_ids)
+        self.assertEqual(states.ids, actor_ids)
+
+        with mock.patch.object(traci.vehicle, 'getSubscriptionResults', side_effect=self.results.get):
+            actors = [SumoSimulation.get_actor(actor_id) for actor_id in actor_ids]
+
+        # carla stores the scalar path in single precision
+        locations, rotations = _transform_arrays([actor.transform for actor in actors])
+        extents = np.array([[a.extent.x, a.extent.y, a.extent.z] for a in actors], dtype=np.float32)
+        np.testing.assert_array_equal(states.locations.astype(np.float32), locations)
+        np.testing.assert_array_equal(states.rotations.astype(np.float32), rotations)
+        np.testing.assert_array_equal(states.extents.astype(np.float32), extents)
+        self.assertEqual(states.signals.tolist(), [actor.signals for actor in actors])
+
+        scalar = _transform_arrays([
+            BridgeHelper.get_carla_transform(actor.transform, actor.extent) for actor in actors])
+        vectorized = BridgeHelper.get_carla_transforms(states.locations, states.rotations, states.extents)
+        for expected, result in zip(scalar, vectorized):
+            np.testing.assert_array_equal(result, expected)
+
+    def test_missing_results(self):
+        self.results['4'] = {}
+        states = decode_subscription_results(self.results, ['0', '4', '7', '1'])
+        self.assertEqual(states.ids, ['0', '1'])
+        self.assertEqual(states.locations.shape, (2, 3))
+        self.assertEqual(states.signals.tolist(), [0, 0])
+        np.testing.assert_array_equal(
+            states.locations[1], self.results['1'][traci.constants.VAR_POSITION3D])
+
+    def test_empty_results(self):
+        for results, actor_ids in (({}, ['0', '1']), (self.results, []), ({}, [])):
+            states = decode_subscription_results(results, actor_ids)
+            self.assertEqual(states.ids, [])
+            for array in (states.locations, states.rotations, states.extents):
+                self.assertEqual(array.shape, (0, 3))
+            self.assertEqual(states.signals.shape, (0,))
+
+            locations, rotations = BridgeHelper.get_carla_transforms(
+                states.locations, states.rotations, states.extents)
+            self.assertEqual(locations.shape, (0, 3))
+            self.assertEqual(rotations.shape, (0, 3))
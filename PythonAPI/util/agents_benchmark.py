@@ -0,0 +1,831 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2024 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Micro-benchmarks for the agents package. They run offline, using synthetic actors
+and maps instead of a CARLA server, so only the carla module is needed. Maps are
+built from a synthetic OpenDRIVE road loaded with carla.Map, or from a pure Python
+grid of roads when the OpenDRIVE map can not be loaded.
+"""
+
+import argparse
+import contextlib
+import fnmatch
+import io
+import glob
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'carla'))
+
+import carla
+import networkx as nx
+import numpy as np
+
+from agents.navigation.basic_agent import BasicAgent
+from agents.navigation.behavior_agent import BehaviorAgent
+from agents.navigation.controller import VehiclePIDController
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.navigation.local_planner import LocalPlanner
+from agents.navigation.route_planning_service import RoutePlanningService
+from agents.tools import misc
+from scene_layout import SceneLayoutIndex
+
+
+# ==============================================================================
+# -- Synthetic scene -----------------------------------------------------------
+# ==============================================================================
+
+
+class StubActor(object):
+    """Actor with a fixed location and velocity, answering the queries of the agents"""
+
+    def __init__(self, actor_id, location, velocity):
+        self.id = actor_id
+        self._location = location
+        self._velocity = velocity
+
+    def get_location(self):
+        return self._location
+
+    def get_velocity(self):
+        return self._velocity
+
+
+class StubWaypoint(object):
+    """Waypoint holding only a transform, in a lane of the usual width"""
+
+    lane_width = 3.5
+
+    def __init__(self, transform):
+        self.transform = transform
+
+
+def random_actors(rng, num_actors, radius, max_speed, first_id=1):
+    """Creates actors uniformly distributed in a disc around the origin"""
+    actors = []
+    for i in range(num_actors):
+        distance = radius * math.sqrt(rng.random())
+        angle = rng.uniform(-math.pi, math.pi)
+        heading = rng.uniform(-math.pi, math.pi)
+        speed = rng.uniform(0, max_speed)
+        actors.append(StubActor(
+            first_id + i,
+            carla.Location(distance * math.cos(angle), distance * math.sin(angle), 0.0),
+            carla.Vector3D(speed * math.cos(heading), speed * math.sin(heading), 0.0)))
+    return actors
+
+
+def synthetic_layout(rng, num_roads, num_lanes, lane_length, spacing):
+    """
+    Creates a layout, in the format of scene_layout.get_scene_layout_arrays, made of straight
+    roads of parallel lanes randomly placed in a Town-sized area
+    """
+    ids, locations, next_links, left_links, right_links = [], [], [], [], []
+    num_points = int(lane_length / spacing)
+    offset = 0
+    for _ in range(num_roads):
+        start = np.array([rng.uniform(-500, 500), rng.uniform(-500, 500)])
+        yaw = rng.uniform(-math.pi, math.pi)
+        forward = np.array([math.cos(yaw), math.sin(yaw)])
+        right = np.array([-forward[1], forward[0]])
+        for lane in range(num_lanes):
+            distances = np.arange(num_points) * spacing
+            xy = start + distances[:, np.newaxis] * forward + (lane * 3.5) * right
+            locations.append(np.column_stack([xy, np.zeros(num_points)]))
+            indices = offset + np.arange(num_points)
+            next_links.append(np.append(indices[1:], -1))
+            left_links.append(indices - num_points if lane > 0 else np.full(num_points, -1))
+            right_links.append(indices + num_points if lane < num_lanes - 1 else np.full(num_points, -1))
+            ids.append(indices)
+            offset += num_points
+    return {
+        'ids': np.concatenate(ids).astype(np.uint64),
+        'locations': np.concatenate(locations),
+        'next': np.concatenate(next_links),
+        'left': np.concatenate(left_links),
+        'right': np.concatenate(right_links)
+    }
+
+
+# ==============================================================================
+# -- Synthetic maps ------------------------------------------------------------
+# ==============================================================================
+
+
+def opendrive_ring_road(straight_length=200.0, radius=50.0, lanes_per_side=2, lane_width=3.5):
+    """
+    OpenDRIVE description of a closed ring made of four straight roads and four arcs,
+    with lanes_per_side driving lanes in each direction
+    """
+    def lane(lane_id, lane_change):
+        return (
+            '<lane id="{0}" type="driving" level="false">'
+            '<link><predecessor id="{0}"/><successor id="{0}"/></link>'
+            '<width sOffset="0" a="{1}" b="0" c="0" d="0"/>'
+            '<roadMark sOffset="0" type="{2}" weight="standard" color="standard" width="0.15" laneChange="{3}"/>'
+            '</lane>').format(lane_id, lane_width, 'broken' if lane_change != 'none' else 'solid', lane_change)
+
+    left_lanes = ''.join(lane(i, 'both' if i < lanes_per_side else 'none') for i in range(lanes_per_side, 0, -1))
+    right_lanes = ''.join(lane(-i, 'both' if i < lanes_per_side else 'none') for i in range(1, lanes_per_side + 1))
+    center_lane = ('<lane id="0" type="none" level="false"><roadMark sOffset="0" type="solid" weight="standard" '
+                   'color="standard" width="0.15" laneChange="none"/></lane>')
+
+    geometries = [('line', straight_length), ('arc', math.pi * radius / 2)] * 4
+    roads = []
+    x, y, hdg = 0.0, 0.0, 0.0
+    for i, (kind, length) in enumerate(geometries):
+        shape = '<line/>' if kind == 'line' else '<arc curvature="{}"/>'.format(1.0 / radius)
+        roads.append(
+            '<road name="Road {0}" length="{1}" id="{0}" junction="-1">'
+            '<link><predecessor elementType="road" elementId="{2}" contactPoint="end"/>'
+            '<successor elementType="road" elementId="{3}" contactPoint="start"/></link>'
+            '<planView><geometry s="0" x="{4}" y="{5}" hdg="{6}" length="{1}">{7}</geometry></planView>'
+            '<elevationProfile><elevation s="0" a="0" b="0" c="0" d="0"/></elevationProfile>'
+            '<lateralProfile/>'
+            '<lanes><laneSection s="0"><left>{8}</left><center>{9}</center><right>{10}</right></laneSection></lanes>'
+            '</road>'.format(i, length, (i - 1) % len(geometries), (i + 1) % len(geometries),
+                             x, y, hdg, shape, left_lanes, center_lane, right_lanes))
+        if kind == 'line':
+            x += length * math.cos(hdg)
+            y += length * math.sin(hdg)
+        else:
+            x += radius * (math.sin(hdg + length / radius) - math.sin(hdg))
+            y += radius * (math.cos(hdg) - math.cos(hdg + length / radius))
+            hdg += length / radius
+
+    return ('<?xml version="1.0" standalone="yes"?><OpenDRIVE>'
+            '<header revMajor="1" revMinor="4" name="SyntheticRing" version="1.00"/>'
+            '{}</OpenDRIVE>'.format(''.join(roads)))
+
+
+class StubLaneMarking(object):
+    """Lane marking that forbids lane changes"""
+
+    lane_change = carla.LaneChange.NONE
+
+
+class StubLane(object):
+    """Straight single-lane road of the grid map"""
+
+    def __init__(self, road_id, start, end, junction_id=-1):
+        self.id = road_id
+        self.start = np.array(start, dtype=np.float64)
+        self.length = float(np.linalg.norm(np.subtract(end, start)))
+        self.direction = (np.array(end, dtype=np.float64) - self.start) / self.length
+        self.yaw = math.degrees(math.atan2(self.direction[1], self.direction[0]))
+        self.junction_id = junction_id
+        self.successors = []
+
+
+class StubMapWaypoint(object):
+    """Waypoint of the grid map, answering the queries of the planners"""
+
+    _MARKING = StubLaneMarking()
+
+    def __init__(self, lane, s):
+        self.lane = lane
+        self.s = s
+        self.id = hash((lane.id, round(s, 3)))
+        self.road_id = lane.id
+        self.section_id = 0
+        self.lane_id = -1
+        self.junction_id = lane.junction_id
+        self.is_junction = lane.junction_id >= 0
+        self.lane_type = carla.LaneType.Driving
+        self.lane_width = 3.5
+        self.lane_change = carla.LaneChange.NONE
+        self.left_lane_marking = self.right_lane_marking = self._MARKING
+        x, y = lane.start + s * lane.direction
+        self.transform = carla.Transform(carla.Location(x, y, 0.0), carla.Rotation(yaw=lane.yaw))
+
+    def next(self, distance):
+        s = self.s + distance
+        if s <= self.lane.length:
+            return [StubMapWaypoint(self.lane, s)]
+        waypoints = []
+        for successor in self.lane.successors:
+            waypoints.extend(StubMapWaypoint(successor, 0.0).next(s - self.lane.length))
+        return waypoints
+
+    def get_left_lane(self):
+        return None
+
+    def get_right_lane(self):
+        return None
+
+
+class StubMap(object):
+    """
+    Pure Python map made of a square grid of two-way roads, joined at each
+    intersection by junction lanes for every turn except U-turns
+    """
+
+    name = 'StubGrid'
+
+    def __init__(self, size=6, block=100.0, margin=10.0, lane_offset=1.75):
+        self.lanes = []
+        incoming = {}
+        outgoing = {}
+        nodes = [(i, j) for i in range(size) for j in range(size)]
+        for (i, j) in nodes:
+            for neighbour in ((i + 1, j), (i, j + 1)):
+                if neighbour not in nodes:
+                    continue
+                for u, v in (((i, j), neighbour), (neighbour, (i, j))):
+                    direction = np.subtract(v, u) / np.linalg.norm(np.subtract(v, u))
+                    normal = np.array([-direction[1], direction[0]])
+                    start = np.multiply(u, block) + direction * margin + normal * lane_offset
+                    end = np.multiply(v, block) - direction * margin + normal * lane_offset
+                    lane = StubLane(len(self.lanes), start, end)
+                    lane.nodes = (u, v)
+                    self.lanes.append(lane)
+                    outgoing.setdefault(u, []).append(lane)
+                    incoming.setdefault(v, []).append(lane)
+
+        for junction_id, node in enumerate(nodes):
+            for lane_in in incoming.get(node, []):
+                for lane_out in outgoing.get(node, []):
+                    if lane_out.nodes[1] == lane_in.nodes[0]:
+                        continue
+                    end = lane_in.start + lane_in.length * lane_in.direction
+                    connector = StubLane(len(self.lanes), end, lane_out.start, junction_id)
+                    connector.successors.append(lane_out)
+                    lane_in.successors.append(connector)
+                    self.lanes.append(connector)
+
+        self._starts = np.array([lane.start for lane in self.lanes])
+        self._directions = np.array([lane.direction for lane in self.lanes])
+        self._lengths = np.array([lane.length for lane in self.lanes])
+
+    def get_topology(self):
+        return [(StubMapWaypoint(lane, 0.0), StubMapWaypoint(lane, lane.length)) for lane in self.lanes]
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=carla.LaneType.Driving):
+        point = np.array([location.x, location.y])
+        s = np.clip(np.einsum('ij,ij->i', point - self._starts, self._directions), 0.0, self._lengths)
+        diff = self._starts + s[:, np.newaxis] * self._directions - point
+        index = int(np.argmin(np.einsum('ij,ij->i', diff, diff)))
+        return StubMapWaypoint(self.lanes[index], float(s[index]))
+
+    def generate_waypoints(self, distance):
+        return [StubMapWaypoint(lane, s) for lane in self.lanes if lane.junction_id < 0
+                for s in np.arange(0.0, lane.length, distance)]
+
+
+class StubActorList(list):
+    """List of actors with the filter method of carla.ActorList"""
+
+    def filter(self, pattern):
+        return StubActorList(actor for actor in self if fnmatch.fnmatch(actor.type_id, pattern))
+
+
+class StubWorld(object):
+    """World holding a map and a list of actors"""
+
+    def __init__(self, carla_map):
+        self.carla_map = carla_map
+        self.actors = StubActorList()
+
+    def get_map(self):
+        return self.carla_map
+
+    def get_actors(self):
+        return self.actors
+
+
+class StubVehicle(StubActor):
+    """Vehicle that can be placed at any transform, and driven by the agents"""
+
+    type_id = 'vehicle.stub.car'
+    bounding_box = carla.BoundingBox(carla.Location(), carla.Vector3D(2.5, 1.0, 0.8))
+    attributes = {'role_name': 'autopilot'}
+
+    def __init__(self, actor_id, world, transform, speed=0.0):
+        super(StubVehicle, self).__init__(actor_id, transform.location, carla.Vector3D())
+        self._world = world
+        self.set_transform(transform, speed)
+
+    def set_transform(self, transform, speed=0.0):
+        self._transform = transform
+        self._location = transform.location
+        forward = transform.get_forward_vector()
+        self._velocity = carla.Vector3D(speed * forward.x, speed * forward.y, 0.0)
+
+    def get_location(self):
+        location = self._transform.location
+        return carla.Location(location.x, location.y, location.z)
+
+    def get_transform(self):
+        location, rotation = self._transform.location, self._transform.rotation
+        return carla.Transform(carla.Location(location.x, location.y, location.z),
+                               carla.Rotation(rotation.pitch, rotation.yaw, rotation.roll))
+
+    def get_world(self):
+        return self._world
+
+    def get_control(self):
+        return carla.VehicleControl()
+
+    def get_speed_limit(self):
+        return 50.0
+
+
+def load_synthetic_map(backend):
+    """
+    Returns the map used by the benchmarks and the name of its backend.
+    :param backend: 'opendrive', 'stub' or 'auto' to try the OpenDRIVE map first
+    """
+    if backend in ('opendrive', 'auto'):
+        try:
+            return carla.Map('SyntheticRing', opendrive_ring_road()), 'opendrive'
+        except Exception as error:  # pylint: disable=broad-except
+            if backend == 'opendrive':
+                raise
+            print('OpenDRIVE map not available ({}), using the stub map'.format(error))
+    return StubMap(), 'stub'
+
+
+def quiet(function):
+    """Runs a function hiding its prints, such as the warnings about the stub map not being a carla.Map"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function()
+
+
+def route_pairs(rng, carla_map, num_routes, planner=None):
+    """
+    Random pairs of distinct waypoints of the map. If a GlobalRoutePlanner is given, only the
+    pairs it can route are kept, as lanes of opposite directions may not be connected at all
+    """
+    waypoints = carla_map.generate_waypoints(10.0)
+    pairs = []
+    for _ in range(100 * num_routes):
+        if len(pairs) == num_routes:
+            break
+        origin, destination = rng.sample(waypoints, 2)
+        if planner is not None:
+            start = planner._localize(origin.transform.location)
+            end = planner._localize(destination.transform.location)
+            if start is None or end is None or not nx.has_path(planner._graph, start[0], end[0]):
+                continue
+        pairs.append((origin, destination))
+    if len(pairs) < num_routes:
+        raise RuntimeError('Only {} of the {} routes could be sampled'.format(len(pairs), num_routes))
+    return pairs
+
+
+def peak_memory(function):
+    """Runs a function, returning its result and the peak of memory allocated by Python, in KiB"""
+    tracemalloc.start()
+    try:
+        result = function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak / 1024.0
+
+
+# ==============================================================================
+# -- Benchmarks ----------------------------------------------------------------
+# ==============================================================================
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Registers a benchmark function, which returns a dictionary of results"""
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def time_per_call(function, repeat, number):
+    """Best time per call, in microseconds"""
+    return 1e6 * min(timeit.repeat(function, repeat=repeat, number=number)) / number
+
+
+@benchmark('hazard_screening')
+def bench_hazard_screening(args):
+    """
+    Screening of dense scenes of walkers and vehicles by the BehaviorAgent. The candidates are the
+    actors that go through the obstacle checks, with their current or their predicted state.
+    """
+    rng = random.Random(args.seed)
+    ego = StubVehicle(0, None, carla.Transform(), speed=10.0)
+    waypoint = StubWaypoint(carla.Transform())
+
+    agent = BehaviorAgent.__new__(BehaviorAgent)
+    agent._vehicle = ego
+    agent._hazard_horizon = 3.0
+
+    # (actor type, filter distance, max distance of the obstacle checks, max speed)
+    scenes = [('walkers', 10, 10, 2.0), ('vehicles', 45, 15, 15.0)]
+
+    results = {}
+    for actor_type, filter_distance, max_distance, max_speed in scenes:
+        for num_actors in (100, 300, 1000):
+            actors = random_actors(rng, num_actors, 100.0, max_speed)
+
+            def legacy():
+                def dist(a): return a.get_location().distance(waypoint.transform.location)
+                return [a for a in actors if dist(a) < filter_distance and a.id != ego.id]
+
+            def screening():
+                return agent._screen_hazards(actors, waypoint, max_distance)
+
+            check_actors, risk_actors, _ = screening()
+            results['{}_{}'.format(actor_type, num_actors)] = {
+                'legacy_filter_us': time_per_call(legacy, args.repeat, args.number),
+                'screening_us': time_per_call(screening, args.repeat, args.number),
+                'legacy_candidates': len(legacy()),
+                'checked_candidates': len(check_actors),
+                'predicted_candidates': len(risk_actors),
+            }
+    return results
+
+
+def legacy_is_within_distance(target_transform, reference_transform, max_distance, angle_interval=None):
+    """Implementation of misc.is_within_distance based on small numpy arrays, used as reference"""
+    target_vector = np.array([
+        target_transform.location.x - reference_transform.location.x,
+        target_transform.location.y - reference_transform.location.y
+    ])
+    norm_target = np.linalg.norm(target_vector)
+    if norm_target < 0.001:
+        return True
+    if norm_target > max_distance:
+        return False
+    if not angle_interval:
+        return True
+    fwd = reference_transform.get_forward_vector()
+    forward_vector = np.array([fwd.x, fwd.y])
+    angle = math.degrees(math.acos(np.clip(np.dot(forward_vector, target_vector) / norm_target, -1., 1.)))
+    return angle_interval[0] < angle < angle_interval[1]
+
+
+def legacy_compute_magnitude_angle(target_location, current_location, orientation):
+    """Implementation of misc.compute_magnitude_angle based on small numpy arrays, used as reference"""
+    target_vector = np.array([target_location.x - current_location.x, target_location.y - current_location.y])
+    norm_target = np.linalg.norm(target_vector)
+    forward_vector = np.array([math.cos(math.radians(orientation)), math.sin(math.radians(orientation))])
+    d_angle = math.degrees(math.acos(np.clip(np.dot(forward_vector, target_vector) / norm_target, -1., 1.)))
+    return (norm_target, d_angle)
+
+
+def legacy_vector(location_1, location_2):
+    """Implementation of misc.vector based on small numpy arrays, used as reference"""
+    x = location_2.x - location_1.x
+    y = location_2.y - location_1.y
+    z = location_2.z - location_1.z
+    norm = np.linalg.norm([x, y, z]) + np.finfo(float).eps
+    return [x / norm, y / norm, z / norm]
+
+
+def legacy_compute_distance(location_1, location_2):
+    """Implementation of misc.compute_distance based on small numpy arrays, used as reference"""
+    x = location_2.x - location_1.x
+    y = location_2.y - location_1.y
+    z = location_2.z - location_1.z
+    return np.linalg.norm([x, y, z]) + np.finfo(float).eps
+
+
+@benchmark('misc_scalar')
+def bench_misc_scalar(args):
+    """Per-call cost of the scalar geometry helpers, before and after removing numpy"""
+    reference = carla.Transform(carla.Location(1.0, 2.0, 0.0), carla.Rotation(yaw=30.0))
+    target = carla.Transform(carla.Location(6.0, 4.0, 0.5))
+
+    cases = {
+        'is_within_distance': (
+            lambda: legacy_is_within_distance(target, reference, 10.0, [0, 90]),
+            lambda: misc.is_within_distance(target, reference, 10.0, [0, 90])),
+        'compute_magnitude_angle': (
+            lambda: legacy_compute_magnitude_angle(target.location, reference.location, 30.0),
+            lambda: misc.compute_magnitude_angle(target.location, reference.location, 30.0)),
+        'vector': (
+            lambda: legacy_vector(reference.location, target.location),
+            lambda: misc.vector(reference.location, target.location)),
+        'compute_distance': (
+            lambda: legacy_compute_distance(reference.location, target.location),
+            lambda: misc.compute_distance(reference.location, target.location)),
+    }
+
+    results = {}
+    for name, (before, after) in cases.items():
+        results[name] = {
+            'before_us': time_per_call(before, args.repeat, args.number * 10),
+            'after_us': time_per_call(after, args.repeat, args.number * 10),
+        }
+    return results
+
+
+@benchmark('misc_batch')
+def bench_misc_batch(args):
+    """Cost of checking N targets against one reference, looping the scalar helpers or using the batch ones"""
+    rng = random.Random(args.seed)
+    reference = carla.Transform(carla.Location(), carla.Rotation(yaw=45.0))
+
+    results = {}
+    for num_targets in (10, 100, 1000):
+        targets = [a.get_location() for a in random_actors(rng, num_targets, 50.0, 0.0)]
+        transforms = [carla.Transform(loc) for loc in targets]
+        array = misc.locations_to_array(targets)
+
+        cases = {
+            'is_within_distance': (
+                lambda: [misc.is_within_distance(t, reference, 20.0, [0, 90]) for t in transforms],
+                lambda: misc.is_within_distance_batch(array, reference, 20.0, [0, 90])),
+            'compute_magnitude_angle': (
+                lambda: [misc.compute_magnitude_angle(l, reference.location, 45.0) for l in targets],
+                lambda: misc.compute_magnitude_angle_batch(array, reference.location, 45.0)),
+            'compute_distance': (
+                lambda: [misc.compute_distance(reference.location, l) for l in targets],
+                lambda: misc.compute_distance_batch(reference.location, array)),
+        }
+        for name, (scalar, batch) in cases.items():
+            results['{}_{}'.format(name, num_targets)] = {
+                'scalar_loop_us': time_per_call(scalar, args.repeat, args.number),
+                'batch_us': time_per_call(batch, args.repeat, args.number),
+            }
+    return results
+
+
+@benchmark('scene_layout_index')
+def bench_scene_layout_index(args):
+    """Spatial queries over a Town-sized layout, compared with a linear scan of the points"""
+    rng = random.Random(args.seed)
+    layout = synthetic_layout(rng, num_roads=400, num_lanes=4, lane_length=100.0, spacing=0.25)
+    locations = layout['locations']
+
+    start = timeit.default_timer()
+    index = SceneLayoutIndex(layout)
+    build_time = timeit.default_timer() - start
+
+    query = np.array([rng.uniform(-400, 400), rng.uniform(-400, 400), 0.0])
+
+    def linear_nearest():
+        return np.argmin(np.linalg.norm(locations - query, axis=1))
+
+    def linear_radius():
+        return np.flatnonzero(np.linalg.norm(locations - query, axis=1) <= 10.0)
+
+    first = index.nearest(query)[0]
+    return {
+        'num_points': len(index),
+        'build_s': build_time,
+        'linear_nearest_us': time_per_call(linear_nearest, args.repeat, args.number // 10 or 1),
+        'nearest_us': time_per_call(lambda: index.nearest(query), args.repeat, args.number),
+        'linear_radius_10m_us': time_per_call(linear_radius, args.repeat, args.number // 10 or 1),
+        'radius_10m_us': time_per_call(lambda: index.within_radius(query, 10.0), args.repeat, args.number),
+        'nearest_outside_grid_us': time_per_call(
+            lambda: index.nearest((1e5, -1e5, 0.0)), args.repeat, args.number),
+        'k_hop_5_us': time_per_call(lambda: index.k_hop(first, 5), args.repeat, args.number),
+        'k_hop_50_us': time_per_call(lambda: index.k_hop(first, 50), args.repeat, args.number),
+    }
+
+
+class StubRoutePlanner(object):
+    """Planner whose trace_route keeps the interpreter busy for a fixed time, like a large A* search"""
+
+    def __init__(self, duration):
+        self._duration = duration
+
+    def trace_route(self, origin, destination):
+        end = timeit.default_timer() + self._duration
+        while timeit.default_timer() < end:
+            pass
+        return [(StubWaypoint(carla.Transform(origin)), None), (StubWaypoint(carla.Transform(destination)), None)]
+
+
+def _tick_statistics(durations):
+    durations = np.array(durations) * 1e3
+    return {
+        'mean_ms': float(np.mean(durations)),
+        'p50_ms': float(np.percentile(durations, 50)),
+        'p99_ms': float(np.percentile(durations, 99)),
+        'max_ms': float(np.max(durations)),
+        'jitter_ms': float(np.std(durations)),
+    }
+
+
+@benchmark('async_route_planning')
+def bench_async_route_planning(args):
+    """Tick-time jitter of a control loop that requests a new route every second, with and without the planning service"""
+    planning_time = 0.2
+    tick_work = 0.005
+    num_ticks = 200
+    requests_every = 20
+    origin, destination = carla.Location(), carla.Location(100.0, 0.0, 0.0)
+
+    def control_work():
+        end = timeit.default_timer() + tick_work
+        while timeit.default_timer() < end:
+            pass
+
+    def synchronous_loop():
+        planner = StubRoutePlanner(planning_time)
+        durations = []
+        for tick in range(num_ticks):
+            start = timeit.default_timer()
+            if tick % requests_every == 0:
+                planner.trace_route(origin, destination)
+            control_work()
+            durations.append(timeit.default_timer() - start)
+        return durations
+
+    def asynchronous_loop():
+        durations = []
+        with RoutePlanningService(StubRoutePlanner(planning_time)) as service:
+            future = None
+            for tick in range(num_ticks):
+                start = timeit.default_timer()
+                if tick % requests_every == 0:
+                    future = service.submit(origin, destination)
+                if future is not None and future.done():
+                    future.result()
+                    future = None
+                control_work()
+                durations.append(timeit.default_timer() - start)
+        return durations
+
+    return {
+        'synchronous': _tick_statistics(synchronous_loop()),
+        'asynchronous': _tick_statistics(asynchronous_loop()),
+    }
+
+
+@benchmark('global_route_planner')
+def bench_global_route_planner(args):
+    """Graph build time and memory, and routes per second of the GlobalRoutePlanner"""
+    rng = random.Random(args.seed)
+    carla_map, backend = load_synthetic_map(args.map)
+
+    start = timeit.default_timer()
+    _, build_memory = peak_memory(lambda: GlobalRoutePlanner(carla_map, 2.0))
+    build_time = timeit.default_timer() - start
+    planner = GlobalRoutePlanner(carla_map, 2.0)
+
+    pairs = route_pairs(rng, carla_map, 50, planner)
+    lengths = []
+    start = timeit.default_timer()
+    for origin, destination in pairs:
+        lengths.append(len(planner.trace_route(origin.transform.location, destination.transform.location)))
+    routes_time = timeit.default_timer() - start
+
+    return {
+        'map_backend': backend,
+        'graph_nodes': planner._graph.number_of_nodes(),
+        'graph_edges': planner._graph.number_of_edges(),
+        'build_s': build_time,
+        'build_peak_kib': build_memory,
+        'routes_per_s': len(pairs) / routes_time,
+        'mean_route_waypoints': float(np.mean(lengths)),
+    }
+
+
+def _agent_scene(args, num_vehicles=0):
+    """Map, world and ego vehicle placed at a random waypoint, plus other vehicles around it"""
+    rng = random.Random(args.seed)
+    carla_map, backend = load_synthetic_map(args.map)
+    world = StubWorld(carla_map)
+    waypoints = carla_map.generate_waypoints(5.0)
+    start = rng.choice(waypoints)
+    ego = StubVehicle(0, world, start.transform, speed=8.0)
+    world.actors.append(ego)
+    for i, waypoint in enumerate(rng.sample(waypoints, min(num_vehicles, len(waypoints)))):
+        world.actors.append(StubVehicle(i + 1, world, waypoint.transform, speed=8.0))
+    return rng, carla_map, backend, world, ego
+
+
+@benchmark('local_planner')
+def bench_local_planner(args):
+    """Latency of LocalPlanner.run_step while the vehicle follows a random route, and memory of the planner"""
+    rng, carla_map, backend, world, ego = _agent_scene(args)
+    planner, memory = peak_memory(lambda: quiet(lambda: LocalPlanner(ego, opt_dict={'random_generator': rng})))
+
+    latencies = []
+    for _ in range(args.number * 10):
+        start = timeit.default_timer()
+        planner.run_step()
+        latencies.append(timeit.default_timer() - start)
+        ego.set_transform(planner.target_waypoint.transform, speed=8.0)
+
+    results = _tick_statistics(latencies)
+    results.update({'map_backend': backend, 'planner_peak_kib': memory})
+    return results
+
+
+@benchmark('pid_controller')
+def bench_pid_controller(args):
+    """Latency of VehiclePIDController.run_step"""
+    _, carla_map, backend, world, ego = _agent_scene(args)
+    controller = VehiclePIDController(
+        ego, {'K_P': 1.95, 'K_I': 0.05, 'K_D': 0.2, 'dt': 0.05}, {'K_P': 1.0, 'K_I': 0.05, 'K_D': 0, 'dt': 0.05})
+    target = carla_map.get_waypoint(ego.get_location()).next(5.0)[0]
+    return {
+        'map_backend': backend,
+        'run_step_us': time_per_call(lambda: controller.run_step(30.0, target), args.repeat, args.number * 10),
+    }
+
+
+@benchmark('obstacle_checks')
+def bench_obstacle_checks(args):
+    """Latency of the vehicle obstacle checks of the BasicAgent in scenes of growing density"""
+    results = {}
+    for num_vehicles in (10, 50, 200):
+        _, carla_map, backend, world, ego = _agent_scene(args, num_vehicles)
+        agent = quiet(lambda: BasicAgent(ego, opt_dict={'random_generator': random.Random(args.seed)}))
+        vehicle_list = world.get_actors().filter('*vehicle*')
+        results['vehicles_{}'.format(num_vehicles)] = {
+            'map_backend': backend,
+            'vehicle_obstacle_us': time_per_call(
+                lambda: agent._vehicle_obstacle_detected(vehicle_list, 30.0), args.repeat, args.number),
+            'run_step_us': time_per_call(agent.run_step, args.repeat, args.number),
+        }
+    return results
+
+
+# ==============================================================================
+# -- main() --------------------------------------------------------------------
+# ==============================================================================
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        '--filter',
+        nargs='+',
+        default=None,
+        help='names of the benchmarks to run (default: all)')
+    argparser.add_argument(
+        '--repeat',
+        default=5,
+        type=int,
+        help='number of repetitions of each measurement (default: 5)')
+    argparser.add_argument(
+        '--number',
+        default=100,
+        type=int,
+        help='number of calls per repetition (default: 100)')
+    argparser.add_argument(
+        '--seed',
+        default=0,
+        type=int,
+        help='seed of the synthetic scenes (default: 0)')
+    argparser.add_argument(
+        '--map',
+        default='auto',
+        choices=['auto', 'opendrive', 'stub'],
+        help='synthetic map of the planning benchmarks (default: auto, OpenDRIVE if it can be loaded)')
+    argparser.add_argument(
+        '--output',
+        default=None,
+        help='write the results to a json file')
+    args = argparser.parse_args()
+
+    names = args.filter if args.filter else sorted(BENCHMARKS)
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'number': args.number,
+        }
+    }
+    for name in names:
+        print('Running {}...'.format(name))
+        report[name] = BENCHMARKS[name](args)
+        print(json.dumps(report[name], indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2)
+
+
+if __name__ == '__main__':
+    main()